@@ -0,0 +1,70 @@
+# api_metrics.py
+"""
+Сколько запросов к Bot API стоит одна запись.
+
+ApiCallCounter — middleware сессии бота: считает каждый исходящий метод
+(а ответы телом вебхука — note_webhook_reply, они идут мимо сессии).
+track_user — outer-middleware апдейтов: запоминает в contextvar, чей апдейт
+сейчас обрабатывается (задачи, созданные хендлером, наследуют контекст).
+Хендлеры записи зовут funnel_start (/book) и funnel_done (запись создана) —
+между ними накапливаются вызовы этого пользователя.
+"""
+from contextvars import ContextVar
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+FUNNEL_MAX = 1024  # незавершённых воронок держим не больше
+
+_current_user: ContextVar[int | None] = ContextVar("api_metrics_user", default=None)
+_funnels: dict[int, int] = {}  # tg_id → вызовов API с начала /book
+_stats = {
+    "calls": 0, "webhook_replies": 0,
+    "bookings": 0, "booking_calls": 0, "last_booking_calls": 0,
+}
+
+
+class ApiCallCounter(BaseRequestMiddleware):
+    async def __call__(self, make_request, bot, method):
+        note_api_call()
+        return await make_request(bot, method)
+
+
+async def track_user(handler, event, data):
+    user = data.get("event_from_user")
+    token = _current_user.set(user.id if user else None)
+    try:
+        return await handler(event, data)
+    finally:
+        _current_user.reset(token)
+
+
+def note_api_call():
+    _stats["calls"] += 1
+    uid = _current_user.get()
+    if uid is not None and uid in _funnels:
+        _funnels[uid] += 1
+
+
+def note_webhook_reply():
+    """Метод ушёл телом ответа на вебхук (callback_ack): исходящего запроса нет — в воронку не идёт."""
+    _stats["webhook_replies"] += 1
+
+
+def funnel_start(tg_id: int):
+    if tg_id not in _funnels and len(_funnels) >= FUNNEL_MAX:
+        _funnels.pop(next(iter(_funnels)))  # самая старая брошенная воронка
+    _funnels[tg_id] = 0
+
+
+def funnel_done(tg_id: int):
+    calls = _funnels.pop(tg_id, None)
+    if calls is None:
+        return  # запись не через /book (например, после рестарта) — не считаем
+    _stats["bookings"] += 1
+    _stats["booking_calls"] += calls
+    _stats["last_booking_calls"] = calls
+
+
+def stats() -> dict:
+    per_booking = _stats["booking_calls"] / _stats["bookings"] if _stats["bookings"] else 0.0
+    return {**_stats, "per_booking": per_booking, "open_funnels": len(_funnels)}
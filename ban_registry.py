@@ -0,0 +1,114 @@
+# ban_registry.py
+"""
+Баны в памяти процесса: tg_id → (до когда, причина).
+
+is_banned зовут на каждом /start, /book и нажатии в записи, а таблица banned
+крошечная и меняется только через ban_user / unban_user. Поэтому она
+загружается целиком один раз (загрузчики — ban_registry_snapshot в database.py /
+database_async.py), дальше бан/разбан правят память сразу после записи в БД.
+Истёкшие баны не считаются действующими сразу (_active); из таблицы их
+выметает задача планировщика (expire_bans), но только когда срок ближайшего
+уже прошёл и база не спит — см. expiry_due.
+"""
+import threading
+from datetime import datetime, timezone
+from typing import NamedTuple
+from zoneinfo import ZoneInfo
+
+from config import TIMEZONE
+
+_TZ = ZoneInfo(TIMEZONE)
+
+
+class Ban(NamedTuple):
+    until: str                  # banned_until как в БД (ISO)
+    reason: str
+    expires: datetime | None    # UTC; None — срок не разобрать: бан бессрочный, как раньше
+
+
+_lock = threading.Lock()
+_bans: dict[int, Ban] | None = None  # None — не загружен
+_generation = 0  # растёт при изменениях до загрузки: такой снимок не кэшируется
+_stats = {"checks": 0, "loads": 0, "expired": 0}
+
+
+def _parse(until) -> datetime | None:
+    """banned_until → aware UTC. Без зоны (старые строки, ввод админа) — местное время TIMEZONE."""
+    try:
+        dt = until if isinstance(until, datetime) else datetime.fromisoformat(str(until))
+    except (TypeError, ValueError):
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=_TZ)
+    return dt.astimezone(timezone.utc)
+
+
+def _active(ban: Ban | None, now: datetime) -> Ban | None:
+    if ban is None or (ban.expires is not None and ban.expires <= now):
+        return None
+    return ban
+
+
+def snapshot() -> tuple[dict[int, Ban] | None, int]:
+    """(баны, поколение): баны — если загружены, иначе None и поколение для load()."""
+    with _lock:
+        return _bans, _generation
+
+
+def load(rows, generation: int) -> dict[int, Ban]:
+    """rows — (tg_id, banned_until, reason) из banned.all."""
+    global _bans
+    bans = {
+        int(tg_id): Ban(until, reason or "", _parse(until))
+        for tg_id, until, reason in rows
+        if until  # без срока is_banned и раньше не считал баном
+    }
+    with _lock:
+        _stats["loads"] += 1
+        if generation == _generation and _bans is None:
+            _bans = bans
+        return _bans if _bans is not None else bans
+
+
+def get(bans: dict[int, Ban], tg_id: int, now: datetime) -> Ban | None:
+    """Действующий бан из снимка или None."""
+    _stats["checks"] += 1
+    return _active(bans.get(int(tg_id)), now)
+
+
+def put(tg_id: int, until: str, reason: str):
+    global _bans, _generation
+    with _lock:
+        if _bans is None:
+            _generation += 1
+            return
+        # словарь заменяем целиком: читатели держат старый снимок без блокировки
+        _bans = {**_bans, int(tg_id): Ban(until, reason or "", _parse(until))}
+
+
+def remove(tg_ids):
+    global _bans, _generation
+    with _lock:
+        if _bans is None:
+            _generation += 1
+            return
+        drop = {int(t) for t in tg_ids}
+        _bans = {t: b for t, b in _bans.items() if t not in drop}
+
+
+def expiry_due(now: datetime) -> bool | None:
+    """Истёк ли ближайший срок; None — реестр ещё не загружен."""
+    bans = _bans
+    if bans is None:
+        return None
+    nearest = min((b.expires for b in bans.values() if b.expires is not None), default=None)
+    return nearest is not None and nearest <= now
+
+
+def note_expired(count: int):
+    _stats["expired"] += count
+
+
+def stats() -> dict:
+    with _lock:
+        return {"size": len(_bans) if _bans is not None else None, **_stats}
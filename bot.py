@@ -2,12 +2,12 @@ import asyncio
 from aiogram import Bot, Dispatcher
 
 from config import BOT_TOKEN, WASHING_MACHINES, DRYERS
-from database import init_db, add_machine, get_machines_by_type
-from scheduler import setup_scheduler, schedule_reminder
+from database import init_db, add_machine, get_machines_by_type, flush_usernames
+from scheduler import setup_scheduler, schedule_reminder, notify_migration_dropped
+from database_async import close_aconn_pool
+from api_metrics import ApiCallCounter, track_user
 
 from handlers import registration, booking, admin
-from database import init_db
-init_db()
 
 
 async def main():
@@ -21,7 +21,9 @@ async def main():
             add_machine("dry", d)
 
     bot = Bot(token=BOT_TOKEN)
+    bot.session.middleware(ApiCallCounter())
     dp = Dispatcher()
+    dp.update.outer_middleware(track_user)
 
     dp.include_router(registration.router)
     dp.include_router(booking.router)
@@ -30,12 +32,15 @@ async def main():
     await bot.delete_webhook(drop_pending_updates=True)
 
     setup_scheduler()
+    await notify_migration_dropped(bot)  # двойные записи, удалённые миграцией
     print("Бот запущен 🚀")
     try:
         await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
     except KeyboardInterrupt:
         print("⛔️ Бот остановлен вручную.")
     finally:
+        flush_usernames()  # username, накопленные с последнего flush
+        await close_aconn_pool()
         await bot.session.close()
 
 
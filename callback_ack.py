@@ -0,0 +1,100 @@
+# callback_ack.py
+"""
+Ответ на нажатие кнопки (answerCallbackQuery) — телом ответа на вебхук.
+
+В режиме вебхука Telegram принимает один метод Bot API прямо в HTTP-ответе
+на апдейт; так ACK не стоит отдельного запроса к api.telegram.org.
+  - вебхук обрабатывает апдейты в фоне и сразу отвечает 200; только нажатия
+    кнопок он ждёт до REPLY_WAIT_SEC (CallbackReplyHandler в webhook_app) —
+    успел хендлер, ACK уходит телом ответа;
+  - DeferredAnswerMiddleware (outer на dp.callback_query, только в webhook_app)
+    открывает на время апдейта «слот» для ответа и через REPLY_WAIT_SEC
+    закрывает его сам: ответ ушёл бы уже не в теле, поэтому отправляется сразу;
+  - хендлеры вместо `await callback.answer(...)` зовут `await ack(callback, ...)`:
+    при открытом слоте ответ кладётся туда (повторный ack заменяет предыдущий),
+    без слота (polling, фоновые задачи) — отправляется сразу, как раньше;
+  - flush() отправляет отложенный ответ немедленно — для долгих шагов,
+    чтобы «часики» на кнопке не висели до конца хендлера.
+"""
+import asyncio
+import os
+from contextvars import ContextVar
+
+from aiogram import BaseMiddleware
+from aiogram.methods import AnswerCallbackQuery, TelegramMethod
+from aiogram.types import CallbackQuery
+
+import api_metrics
+
+# сколько вебхук ждёт хендлер нажатия; дольше — ответ 200 сразу, ACK отдельным запросом
+REPLY_WAIT_SEC = float(os.getenv("CALLBACK_REPLY_WAIT_SEC", "1.5"))
+
+
+class _Slot:
+    __slots__ = ("method", "closed")
+
+    def __init__(self):
+        self.method: AnswerCallbackQuery | None = None
+        self.closed = False  # ответ уже ушёл отдельным запросом
+
+
+_slot: ContextVar[_Slot | None] = ContextVar("callback_ack_slot", default=None)
+
+
+async def ack(callback: CallbackQuery, text: str | None = None, show_alert: bool = False):
+    method = callback.answer(text=text, show_alert=show_alert)
+    slot = _slot.get()
+    if slot is not None and not slot.closed:
+        slot.method = method
+        return
+    await method
+
+
+async def flush():
+    """Отправить отложенный ответ сейчас (шаг оказался долгим)."""
+    slot = _slot.get()
+    if slot is None or slot.closed:
+        return
+    slot.closed = True
+    if slot.method is not None:
+        method, slot.method = slot.method, None
+        await method
+
+
+class DeferredAnswerMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event, data):
+        slot = _Slot()
+        token = _slot.set(slot)
+        timer = asyncio.get_running_loop().call_later(REPLY_WAIT_SEC, _release, slot)
+        try:
+            result = await handler(event, data)
+        except Exception:
+            await _send_quietly(slot)  # кнопка не должна «висеть» из-за ошибки хендлера
+            raise
+        finally:
+            timer.cancel()
+            _slot.reset(token)
+        slot.closed = True
+        if slot.method is None:
+            return result
+        if isinstance(result, TelegramMethod):
+            await _send_quietly(slot)  # тело ответа уже занято методом хендлера
+            return result
+        api_metrics.note_webhook_reply()
+        return slot.method
+
+
+def _release(slot: _Slot):
+    # вебхук больше не ждёт этот апдейт: отложенный ответ — отдельным запросом
+    if not slot.closed:
+        asyncio.ensure_future(_send_quietly(slot))
+
+
+async def _send_quietly(slot: _Slot):
+    slot.closed = True
+    if slot.method is not None:
+        method, slot.method = slot.method, None
+        try:
+            await method
+        except Exception:
+            pass
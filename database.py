@@ -2,10 +2,21 @@
 import os
 import base64
 import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from enum import Enum
+from functools import lru_cache
+from typing import NamedTuple
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
 
 from config import DB_PATH, WORKING_HOURS, ADMIN_IDS, TIMEZONE
+import occupancy
+import machine_catalog
+import ban_registry
 
 TZ = ZoneInfo(TIMEZONE)
 
@@ -14,22 +25,39 @@ class DBUnavailable(Exception):
     pass
 
 # ---------- админ-утилиты ----------
-def _admin_set_from_config():
-    raw = ADMIN_IDS
-    if isinstance(raw, (list, tuple, set)):
+def _parse_admin_ids(raw) -> frozenset[int]:
+    if isinstance(raw, (list, tuple, set, frozenset)):
         items = [str(x) for x in raw]
     else:
         s = str(raw).strip()
         if s.startswith("[") and s.endswith("]"):
             s = s[1:-1]
         items = [p.strip().strip("'").strip('"') for p in s.split(",") if p.strip()]
-    return set(items)
+    ids = set()
+    for item in items:
+        try:
+            ids.add(int(item))
+        except ValueError:
+            print(f"⚠️ ADMIN_IDS: пропущен не-числовой id {item!r}")
+    return frozenset(ids)
+
+def reload_admins() -> frozenset[int]:
+    """Пересобрать список админов: env ADMIN_IDS (через запятую), иначе config.ADMIN_IDS."""
+    global _ADMINS
+    _ADMINS = _parse_admin_ids(os.getenv("ADMIN_IDS") or ADMIN_IDS)
+    return _ADMINS
+
+_ADMINS: frozenset[int] = frozenset()
+reload_admins()
+
+def admin_ids() -> frozenset[int]:
+    return _ADMINS
 
 def is_admin(user_id: int | str) -> bool:
     try:
-        return str(int(user_id)) in _admin_set_from_config()
-    except Exception:
-        return str(user_id).strip() in _admin_set_from_config()
+        return int(user_id) in _ADMINS
+    except (TypeError, ValueError):
+        return False
 
 # ---------- кодирование фамилии/комнаты ----------
 def _b64e(s: str | None) -> str | None:
@@ -45,6 +73,115 @@ def _b64d_try(s: str | None) -> str | None:
     except Exception:
         return s
 
+# ---------- кэш профилей: tg_id → (id, tg_id, surname, room) ----------
+# get_user зовут почти все хендлеры; профиль меняется только через
+# save_user / add_user / update_username / bind_stub_user_to_real — они и сбрасывают запись.
+# TTL страхует от правок мимо бота (руками в БД).
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "2048"))
+USER_CACHE_TTL_SEC = float(os.getenv("USER_CACHE_TTL_SEC", "600"))
+
+_user_cache: "OrderedDict[int, tuple[float, tuple | None]]" = OrderedDict()
+_user_cache_lock = threading.Lock()
+_user_cache_gen = 0  # растёт при сбросе: чтение, начатое до записи, не кэшируется
+_user_cache_stats = {"hits": 0, "misses": 0}
+
+def _user_cache_get(tg_id: int) -> tuple[bool, tuple | None, int]:
+    """(нашли, профиль, поколение): поколение нужно _user_cache_put после запроса в БД."""
+    with _user_cache_lock:
+        item = _user_cache.get(tg_id)
+        if item is not None and item[0] > time.monotonic():
+            _user_cache.move_to_end(tg_id)
+            _user_cache_stats["hits"] += 1
+            return True, item[1], _user_cache_gen
+        _user_cache_stats["misses"] += 1
+        return False, None, _user_cache_gen
+
+def _user_cache_put(tg_id: int, user: tuple | None, generation: int):
+    with _user_cache_lock:
+        if generation != _user_cache_gen:
+            return
+        _user_cache[tg_id] = (time.monotonic() + USER_CACHE_TTL_SEC, user)
+        _user_cache.move_to_end(tg_id)
+        while len(_user_cache) > USER_CACHE_SIZE:
+            _user_cache.popitem(last=False)
+
+def _user_cache_drop(tg_id: int):
+    global _user_cache_gen
+    with _user_cache_lock:
+        _user_cache.pop(tg_id, None)
+        _user_cache_gen += 1
+
+def _user_row(row) -> tuple | None:
+    if not row: return None
+    return (row[0], row[1], _b64d_try(row[2]), _b64d_try(row[3]))
+
+def user_cache_stats() -> dict:
+    with _user_cache_lock:
+        return {"size": len(_user_cache), **_user_cache_stats}
+
+# ---------- username: без повторных записей, пачками ----------
+# /start обновляет username каждый раз; после рассылки это сотни одинаковых upsert.
+# Повтор известного значения пропускаем, новое кладём в очередь — её пишет
+# одной транзакцией flush_usernames (задача планировщика раз в USERNAME_FLUSH_SEC).
+USERNAME_FLUSH_SEC = float(os.getenv("USERNAME_FLUSH_SEC", "10"))
+
+_usernames_known: dict[int, str | None] = {}  # что уже в БД или в очереди
+_usernames_pending: dict[int, str] = {}
+_usernames_lock = threading.Lock()
+_username_stats = {"skipped": 0, "queued": 0, "flushed": 0, "flushes": 0}
+
+def _note_username(tg_id: int, username: str | None):
+    with _usernames_lock:
+        _usernames_known[tg_id] = username
+        if len(_usernames_known) > USER_CACHE_SIZE:
+            _usernames_known.pop(next(iter(_usernames_known)))
+
+def _queue_username(tg_id: int, username: str | None):
+    if not username: return
+    with _usernames_lock:
+        if tg_id in _usernames_known and _usernames_known[tg_id] == username:
+            _username_stats["skipped"] += 1
+            return
+        _usernames_known[tg_id] = username
+        _usernames_pending[tg_id] = username
+        _username_stats["queued"] += 1
+
+def _pending_tg_by_username(username: str) -> int | None:
+    u = username.lower()
+    with _usernames_lock:
+        for tg_id, name in _usernames_pending.items():
+            if name.lower() == u:
+                return tg_id
+    return None
+
+def flush_usernames() -> int:
+    """Записать накопленные username одной транзакцией. Возвращает число строк."""
+    global _usernames_pending
+    with _usernames_lock:
+        batch, _usernames_pending = _usernames_pending, {}
+    if not batch:
+        return 0
+    try:
+        with get_conn() as conn, conn.transaction():
+            for tg_id, username in batch.items():
+                conn.run("users.upsert_username", (tg_id, username))
+    except Exception:
+        # вернём в очередь (более свежие значения, пришедшие за это время, не трогаем)
+        with _usernames_lock:
+            for tg_id, username in batch.items():
+                _usernames_pending.setdefault(tg_id, username)
+        raise
+    for tg_id in batch:
+        _user_cache_drop(tg_id)  # upsert мог создать строку для незарегистрированного
+    with _usernames_lock:
+        _username_stats["flushed"] += len(batch)
+        _username_stats["flushes"] += 1
+    return len(batch)
+
+def username_stats() -> dict:
+    with _usernames_lock:
+        return {"pending": len(_usernames_pending), **_username_stats}
+
 # ---------- TG-заглушки (для ручных добавлений по Фамилия+Комната) ----------
 def _stub_tg_id(surname: str, room: str) -> int:
     seed = f"{surname}|{room}".encode("utf-8")
@@ -54,61 +191,283 @@ def _stub_tg_id(surname: str, room: str) -> int:
 def ensure_user_by_surname_room(surname: str, room: str) -> int:
     """Возвращает id пользователя. Если его нет — создаёт 'стаб' с фиктивным tg_id."""
     with get_conn() as conn:
-        row = conn.execute(
-            "SELECT id FROM users WHERE surname=? AND room=?",
-            (_b64e(surname), _b64e(room)),
+        row = conn.run(
+            "users.id_by_surname_room", (_b64e(surname), _b64e(room))
         ).fetchone()
         if row:
             return row[0]
         tg_stub = _stub_tg_id(surname, room)
-        conn.execute(
-            "INSERT INTO users (tg_id, surname, room) VALUES (?, ?, ?)",
-            (tg_stub, _b64e(surname), _b64e(room)),
-        )
-        return conn.execute("SELECT id FROM users WHERE tg_id=?", (tg_stub,)).fetchone()[0]
+        conn.run("users.insert", (tg_stub, _b64e(surname), _b64e(room)))
+        return conn.run("users.id_by_tg", (tg_stub,)).fetchone()[0]
+
+def machine_catalog_snapshot():
+    """Каталог машин; из БД — только если его ещё нет или его сбросили."""
+    catalog, generation = machine_catalog.snapshot()
+    if catalog is not None:
+        return catalog
+    with get_conn() as conn:
+        rows = conn.run("machines.all").fetchall()
+    return machine_catalog.load(rows, generation)
+
+def get_machine(machine_id: int) -> machine_catalog.Machine | None:
+    return machine_catalog_snapshot().get(machine_id)
 
 def get_machine_id_by_name(name: str) -> int | None:
-    with get_conn() as conn:
-        row = conn.execute("SELECT id FROM machines WHERE name=?", (name,)).fetchone()
-        return row[0] if row else None
+    return machine_catalog_snapshot().id_by_name(name)
 
 def set_machine_active(machine_id: int, active: bool) -> None:
     """
     Включить/выключить машину.
     active=True  → машина доступна в /book
-    active=False → скрыта из записи, но старые записи и напоминания живут.
+    active=False → скрыта из записи, старые записи живут, напоминания по ним
+                   не шлются (таймеры снимает scheduler.cancel_machine_reminders).
     """
     with get_conn() as conn:
-        conn.execute(
-            "UPDATE machines SET is_active=? WHERE id=?",
-            (bool(active), machine_id),
-        )
+        conn.run("machines.set_active", (bool(active), machine_id))
+    machine_catalog.invalidate()
 
 
 def get_all_machines():
     """
     Все машины для админки (и активные, и выключенные).
     """
-    with get_conn() as conn:
-        return conn.execute(
-            "SELECT id, type, name, is_active FROM machines ORDER BY type, name"
-        ).fetchall()
+    return [tuple(m) for m in machine_catalog_snapshot().all()]
 
 
 # ---------- выбор backend: Postgres или SQLite ----------
 DATABASE_URL = os.getenv("DATABASE_URL", "").strip()
-
-def _rewrite_qmarks(sql: str) -> str:
-    # SQLite использует '?', Postgres — %s
-    return sql.replace("?", "%s")
-
-def _rewrite_insert_or_ignore(sql: str) -> str:
-    s = sql.lstrip()
-    if s.upper().startswith("INSERT OR IGNORE"):
-        s = "INSERT" + s[len("INSERT OR IGNORE"):]
-        s = s + " ON CONFLICT DO NOTHING"
-        return sql[:len(sql) - len(sql.lstrip())] + s
-    return sql
+PG_POOL_MAX = int(os.getenv("PG_POOL_MAX", "10"))  # верхний предел коннектов к Postgres — на оба пула
+# из него: асинхронному пулу (database_async, хендлеры) — PG_APOOL_MAX,
+# синхронному (run_db, планировщик, миграции) — остальное
+PG_APOOL_MAX = max(1, int(os.getenv("PG_APOOL_MAX", str(PG_POOL_MAX // 2))))
+PG_SYNC_POOL_MAX = max(1, PG_POOL_MAX - PG_APOOL_MAX)
+
+# ---------- SQL: пишем на диалекте SQLite, под Postgres компилируем ----------
+@lru_cache(maxsize=512)
+def _compile_sql(sql: str) -> str:
+    """
+    Переводит выражение из SQLite-диалекта в диалект текущего backend'а.
+    Для SQLite возвращает как есть. Для Postgres:
+      INSERT OR IGNORE ... → INSERT ... ON CONFLICT DO NOTHING;
+      ? → %s, а '%' → '%%' (драйвер форматирует строку целиком).
+    Строковые литералы '...' не трогаем: '?' внутри них остаётся '?'.
+    Результат кэшируется, так что и «ручные» запросы компилируются один раз.
+    """
+    if not DATABASE_URL:
+        return sql
+
+    body = sql.rstrip().rstrip(";")
+    head = body.lstrip()
+    if head.upper().startswith("INSERT OR IGNORE"):
+        indent = body[:len(body) - len(head)]
+        body = indent + "INSERT" + head[len("INSERT OR IGNORE"):] + " ON CONFLICT DO NOTHING"
+
+    out = []
+    in_literal = False
+    for ch in body:
+        if ch == "'":
+            in_literal = not in_literal  # '' внутри литерала просто переключит дважды
+            out.append(ch)
+        elif ch == "%":
+            out.append("%%")
+        elif ch == "?" and not in_literal:
+            out.append("%s")
+        else:
+            out.append(ch)
+    return "".join(out)
+
+
+# брони слота (дата, час) + стирка этого же человека часом раньше + отметка об отправке
+_REMINDER_PLAN_SQL = """
+        SELECT u.tg_id, b.machine_id, m.name, m.type,
+               EXISTS (
+                   SELECT 1 FROM bookings p
+                    WHERE p.user_id = b.user_id AND p.date = b.date
+                      AND p.hour = b.hour - 1 AND p.machine_type = 'wash'
+               ),
+               EXISTS (
+                   SELECT 1 FROM reminders_sent r
+                    WHERE r.tg_id = u.tg_id AND r.machine_id = b.machine_id
+                      AND r.date = b.date AND r.hour = b.hour AND r.minutes_before = ?
+               )
+          FROM bookings b
+          JOIN users    u ON u.id = b.user_id
+          JOIN machines m ON m.id = b.machine_id
+         WHERE b.date = ? AND b.hour = ?"""
+
+# Горячие выражения объявлены один раз и исполняются по ключу: conn.run(key, params).
+# Компиляция под backend — при импорте, на каждом вызове ничего не переписывается.
+_SQL_SOURCE = {
+    # --- пользователи ---
+    "users.get": "SELECT id, tg_id, surname, room, username FROM users WHERE tg_id=?",
+    "users.id_by_tg": "SELECT id FROM users WHERE tg_id=?",
+    "users.id_by_surname_room": "SELECT id FROM users WHERE surname=? AND room=?",
+    # стаб — только запись админа без Telegram (tg_id < 0, см. _stub_tg_id):
+    # жилец с той же Фамилией+Комнатой (или сам же при повторном сохранении) — не стаб
+    "users.stub_by_surname_room": "SELECT id FROM users WHERE surname=? AND room=? AND tg_id < 0",
+    "users.insert": "INSERT INTO users (tg_id, surname, room) VALUES (?, ?, ?)",
+    "users.insert_ignore": "INSERT OR IGNORE INTO users (tg_id, surname, room) VALUES (?, ?, ?)",
+    "users.upsert_profile": """
+        INSERT INTO users (tg_id, surname, room)
+        VALUES (?, ?, ?)
+        ON CONFLICT(tg_id) DO UPDATE SET
+            surname=excluded.surname,
+            room=excluded.room
+    """,
+    "users.upsert_username": """
+        INSERT INTO users (tg_id, username)
+        VALUES (?, ?)
+        ON CONFLICT(tg_id) DO UPDATE SET username=excluded.username
+    """,
+    "users.tg_by_username": "SELECT tg_id FROM users WHERE LOWER(username)=LOWER(?) LIMIT 1",
+    "users.incomplete": """
+        SELECT tg_id, COALESCE(username, '')
+        FROM users
+        WHERE surname IS NULL OR room IS NULL
+    """,
+    "users.delete": "DELETE FROM users WHERE id=?",
+    # записи стаба, которые упёрлись бы в лимит «1 тип в сутки», перенести нельзя:
+    # удаляем их явно и возвращаем — вызывающий освобождает слоты и сообщает о них
+    "users.drop_stub_conflicts": """
+        DELETE FROM bookings
+         WHERE user_id=?
+           AND EXISTS (
+                SELECT 1 FROM bookings mine
+                 WHERE mine.user_id=? AND mine.date=bookings.date
+                   AND mine.machine_type=bookings.machine_type
+           )
+        RETURNING machine_id, date, hour
+    """,
+    "users.move_bookings": "UPDATE bookings SET user_id=? WHERE user_id=?",
+    # --- машины ---
+    "machines.set_active": "UPDATE machines SET is_active=? WHERE id=?",
+    "machines.all": "SELECT id, type, name, is_active FROM machines ORDER BY type, name",
+    "machines.insert_ignore": "INSERT OR IGNORE INTO machines (type, name) VALUES (?, ?)",
+    # --- бан/антиспам ---
+    "banned.upsert": """
+        INSERT INTO banned (tg_id, reason, banned_until, banned_at)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(tg_id) DO UPDATE SET
+            reason=excluded.reason,
+            banned_until=excluded.banned_until,
+            banned_at=excluded.banned_at
+    """,
+    "banned.all": "SELECT tg_id, banned_until, reason FROM banned",
+    "banned.delete": "DELETE FROM banned WHERE tg_id=?",
+    "banned.delete_expired": "DELETE FROM banned WHERE banned_until <= ? RETURNING tg_id",
+    "attempts.count": "SELECT count FROM failed_attempts WHERE tg_id=?",
+    "attempts.upsert": """
+        INSERT INTO failed_attempts (tg_id, count, last_attempt)
+        VALUES (?, ?, ?)
+        ON CONFLICT(tg_id) DO UPDATE SET
+            count=excluded.count,
+            last_attempt=excluded.last_attempt
+    """,
+    "attempts.delete": "DELETE FROM failed_attempts WHERE tg_id=?",
+    # --- бронирования ---
+    "bookings.user_has_type": """
+        SELECT 1 FROM bookings
+        WHERE user_id=? AND date=? AND machine_type=?
+        LIMIT 1
+    """,
+    "bookings.exact": """
+        SELECT 1 FROM bookings
+        WHERE user_id=? AND machine_id=? AND date=? AND hour=?
+        LIMIT 1
+    """,
+    "bookings.busy_hours": "SELECT hour FROM bookings WHERE machine_id=? AND date=?",
+    "bookings.busy_by_date": "SELECT machine_id, hour FROM bookings WHERE date=?",
+    # тип машины копируем в запись: на нём держится уникальный ключ «1 тип в сутки»
+    "bookings.insert": """
+        INSERT INTO bookings (user_id, machine_id, date, hour, machine_type)
+        SELECT ?, m.id, ?, ?, m.type FROM machines m WHERE m.id=?
+        ON CONFLICT DO NOTHING
+        RETURNING id
+    """,
+    "bookings.user_future": """
+        SELECT b.id, m.name, b.date, b.hour
+          FROM bookings b
+          JOIN machines m ON b.machine_id = m.id
+         WHERE b.user_id = ?
+           AND ((b.date > ?) OR (b.date = ? AND b.hour >= ?))
+         ORDER BY b.date, b.hour
+    """,
+    # запись одним выражением: регистрация, бан и активность машины проверяются
+    # в INSERT ... SELECT; занятый слот и лимит «1 тип в сутки» — уникальные
+    # ключи, конфликт по любому из них гасит ON CONFLICT DO NOTHING
+    "bookings.book": """
+        INSERT INTO bookings (user_id, machine_id, date, hour, machine_type)
+        SELECT u.id, m.id, ?, ?, m.type
+          FROM users u, machines m
+         WHERE u.tg_id = ? AND m.id = ?
+           AND m.type = COALESCE(?, m.type)
+           AND COALESCE(u.surname, '') <> '' AND COALESCE(u.room, '') <> ''
+           AND m.is_active
+           AND NOT EXISTS (
+                SELECT 1 FROM banned bn
+                 WHERE bn.tg_id = u.tg_id AND bn.banned_until > ?
+           )
+        ON CONFLICT DO NOTHING
+        RETURNING id, user_id, machine_type,
+                  (SELECT m.name FROM machines m WHERE m.id = bookings.machine_id),
+                  EXISTS (
+                       SELECT 1 FROM bookings o
+                        WHERE o.user_id = bookings.user_id AND o.date = bookings.date
+                          AND o.machine_type <> bookings.machine_type
+                  )
+    """,
+    # почему bookings.book ничего не вставил — одним запросом
+    "bookings.book_refusal": """
+        SELECT u.id, COALESCE(u.surname, ''), COALESCE(u.room, ''),
+               m.type, m.name, m.is_active,
+               (SELECT bn.banned_until FROM banned bn WHERE bn.tg_id = ?),
+               (SELECT b.user_id FROM bookings b
+                 WHERE b.machine_id = m.id AND b.date = ? AND b.hour = ?),
+               EXISTS (
+                    SELECT 1 FROM bookings b
+                     WHERE b.user_id = u.id AND b.date = ? AND b.machine_type = m.type
+               )
+          FROM (SELECT 1 AS one) AS dual
+          LEFT JOIN users u ON u.tg_id = ?
+          LEFT JOIN machines m ON m.id = ?
+    """,
+    # сводка для меню дат: занятые будущие слоты по (дата, тип) + число активных машин
+    # по типу (строки с date IS NULL) — одним запросом на любой горизонт
+    "bookings.availability": """
+        SELECT b.date, m.type, COUNT(*)
+          FROM bookings b
+          JOIN machines m ON m.id = b.machine_id
+         WHERE m.is_active
+           AND b.date >= ? AND b.date < ?
+           AND (b.date > ? OR b.hour > ?)
+           AND b.hour BETWEEN ? AND ?
+         GROUP BY b.date, m.type
+        UNION ALL
+        SELECT NULL, type, COUNT(*)
+          FROM machines
+         WHERE is_active
+         GROUP BY type
+    """,
+    "bookings.delete": "DELETE FROM bookings WHERE id=? RETURNING machine_id, date, hour",
+    "bookings.delete_before": "DELETE FROM bookings WHERE date < ?",
+    # --- антидубли напоминаний ---
+    "reminders.was_sent": """
+        SELECT 1
+          FROM reminders_sent
+         WHERE tg_id=? AND machine_id=? AND date=? AND hour=? AND minutes_before=?
+         LIMIT 1
+    """,
+    "reminders.delete_before": "DELETE FROM reminders_sent WHERE date < ?",
+    # всё для решения «слать ли напоминание» — одним запросом (см. reminder_plan)
+    "reminders.plan": _REMINDER_PLAN_SQL,
+    "reminders.plan_one": _REMINDER_PLAN_SQL + " AND u.tg_id = ? AND b.machine_id = ?",
+    "reminders.mark_sent": """
+        INSERT INTO reminders_sent (tg_id, machine_id, date, hour, minutes_before)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(tg_id, machine_id, date, hour, minutes_before) DO NOTHING
+    """,
+}
+STATEMENTS: dict[str, str] = {key: _compile_sql(sql) for key, sql in _SQL_SOURCE.items()}
 
 class _CursorWrapper:
     def __init__(self, cur): self._cur = cur
@@ -269,53 +628,277 @@ if DATABASE_URL:
         return _PgConn()
     '''
 if DATABASE_URL:
+    from collections import deque
+
     import psycopg2
     from psycopg2 import OperationalError
-    from psycopg2 import pool
 
-    # держим несколько постоянных коннектов, без пересоздания на каждый SELECT
-    _pg_pool = pool.SimpleConnectionPool(
-        1, 10,  # min/max
-        DATABASE_URL,
-        connect_timeout=3,
-    )
-
-    class _PgConn:
-        def __init__(self):
+    PG_POOL_MIN = int(os.getenv("PG_POOL_MIN", "2"))                        # тёплых коннектов держим всегда
+    PG_POOL_MAX_LIFETIME = float(os.getenv("PG_POOL_MAX_LIFETIME", "1800"))  # сек, потом коннект пересоздаём
+    PG_POOL_PROBE_INTERVAL = float(os.getenv("PG_POOL_PROBE_INTERVAL", "60"))
+    PG_POOL_CHECKOUT_TIMEOUT = float(os.getenv("PG_POOL_CHECKOUT_TIMEOUT", "5"))
+    # если бот столько секунд не ходил в БД — пул перестаёт пинговать Neon и даёт ему уснуть
+    PG_POOL_IDLE_TIMEOUT = float(os.getenv("PG_POOL_IDLE_TIMEOUT", "240"))
+
+    class _PgPool:
+        """
+        Потокобезопасный пул для psycopg2 (SimpleConnectionPool таким не является).
+        - getconn() ждёт свободный коннект до PG_POOL_CHECKOUT_TIMEOUT, потом DBUnavailable;
+        - prewarm() заранее открывает PG_POOL_MIN коннектов;
+        - фоновый поток проверяет простаивающие коннекты SELECT 1, выкидывает
+          мёртвые и слишком старые (PG_POOL_MAX_LIFETIME) и доливает пул до минимума.
+        """
+
+        def __init__(self, dsn: str, minconn: int, maxconn: int):
+            self._dsn = dsn
+            self.minconn = minconn
+            self.maxconn = maxconn
+            self._cond = threading.Condition()
+            self._idle: deque = deque()          # (conn, вернули_в_пул_в)
+            self._born: dict = {}                # conn → время открытия
+            self._in_use = 0
+            self._opening = 0
+            self._last_activity = 0.0
+            self._maintenance: threading.Thread | None = None
+            self.stats = {
+                "created": 0, "closed": 0, "waits": 0, "wait_timeouts": 0,
+                "reconnects": 0, "probes": 0, "probe_failures": 0,
+            }
+
+        # --- открытие/закрытие ---
+        def _connect(self):
             try:
-                self._conn = _pg_pool.getconn()
-            except Exception as e:
+                # маленький таймаут, чтобы не "висеть" на первом запросе
+                conn = psycopg2.connect(self._dsn, connect_timeout=3)
+            except OperationalError as e:
                 raise DBUnavailable(str(e)) from e
-            self._conn.autocommit = True
-            self._opened: list[_CursorWrapper] = []
+            conn.autocommit = True
+            return conn
 
-        def _reset_conn(self):
+        def _discard(self, conn):
+            """Закрыть коннект. Вызывать под self._cond."""
+            self._born.pop(conn, None)
+            self.stats["closed"] += 1
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+        def _expired(self, conn, now: float) -> bool:
+            return bool(conn.closed) or now - self._born.get(conn, now) > PG_POOL_MAX_LIFETIME
+
+        # --- выдача/возврат ---
+        def getconn(self):
+            deadline = time.monotonic() + PG_POOL_CHECKOUT_TIMEOUT
+            with self._cond:
+                self._last_activity = time.monotonic()
+                while True:
+                    while self._idle:
+                        conn, _ = self._idle.pop()  # LIFO: самый «свежий»
+                        if self._expired(conn, time.monotonic()):
+                            self._discard(conn)
+                            continue
+                        self._in_use += 1
+                        return conn
+                    if self._in_use + self._opening < self.maxconn:
+                        self._opening += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.stats["wait_timeouts"] += 1
+                        raise DBUnavailable("пул Postgres исчерпан")
+                    self.stats["waits"] += 1
+                    self._cond.wait(remaining)
+
+            # коннектимся вне блокировки — остальные потоки не ждут наш handshake
             try:
-                _pg_pool.putconn(self._conn, close=True)
+                conn = self._connect()
             except Exception:
+                with self._cond:
+                    self._opening -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._opening -= 1
+                self._in_use += 1
+                self._born[conn] = time.monotonic()
+                self.stats["created"] += 1
+            return conn
+
+        def putconn(self, conn, close: bool = False):
+            with self._cond:
+                self._in_use -= 1
+                if close or self._expired(conn, time.monotonic()) or len(self._idle) >= self.maxconn:
+                    self._discard(conn)
+                else:
+                    self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+
+        def replace(self, conn):
+            """Коннект оказался мёртвым: закрыть и выдать новый."""
+            self.putconn(conn, close=True)
+            with self._cond:
+                self.stats["reconnects"] += 1
+            return self.getconn()
+
+        # --- прогрев и обслуживание ---
+        def prewarm(self):
+            """Открыть коннекты до PG_POOL_MIN и запустить фоновое обслуживание."""
+            with self._cond:
+                self._last_activity = time.monotonic()
+                missing = self.minconn - len(self._idle) - self._in_use - self._opening
+                self._opening += max(0, missing)
+            fresh = []
+            try:
+                for _ in range(max(0, missing)):
+                    fresh.append(self._connect())
+            finally:
+                with self._cond:
+                    self._opening -= max(0, missing)
+                    now = time.monotonic()
+                    for conn in fresh:
+                        self._born[conn] = now
+                        self._idle.append((conn, now))
+                        self.stats["created"] += 1
+                    self._cond.notify_all()
+            self._start_maintenance()
+
+        def _start_maintenance(self):
+            if self._maintenance and self._maintenance.is_alive():
+                return
+            self._maintenance = threading.Thread(
+                target=self._maintenance_loop, name="pg-pool-maintenance", daemon=True
+            )
+            self._maintenance.start()
+
+        def _maintenance_loop(self):
+            while True:
+                time.sleep(PG_POOL_PROBE_INTERVAL)
                 try:
-                    self._conn.close()
+                    self._maintain()
                 except Exception:
                     pass
-            self._conn = _pg_pool.getconn()
-            self._conn.autocommit = True
 
-        def execute(self, sql: str, params=()):
-            sql = _rewrite_insert_or_ignore(sql)
-            sql = _rewrite_qmarks(sql)
+        def _maintain(self):
+            now = time.monotonic()
+            with self._cond:
+                dormant = now - self._last_activity > PG_POOL_IDLE_TIMEOUT
+                # забираем из пула коннекты, простоявшие дольше интервала проверки
+                to_probe, keep = [], deque()
+                for conn, returned_at in self._idle:
+                    if self._expired(conn, now):
+                        self._discard(conn)
+                    elif dormant:
+                        # бот давно молчит: не будим Neon пингами, коннекты всё равно умрут
+                        self._discard(conn)
+                    elif now - returned_at >= PG_POOL_PROBE_INTERVAL:
+                        to_probe.append(conn)
+                    else:
+                        keep.append((conn, returned_at))
+                self._idle = keep
+                self._in_use += len(to_probe)
+            if dormant:
+                return
+
+            for conn in to_probe:
+                alive = True
+                try:
+                    with conn.cursor() as cur:
+                        cur.execute("SELECT 1")
+                except Exception:
+                    alive = False
+                with self._cond:
+                    self.stats["probes"] += 1
+                    self._in_use -= 1
+                    if alive:
+                        self._idle.append((conn, time.monotonic()))
+                    else:
+                        self.stats["probe_failures"] += 1
+                        self.stats["reconnects"] += 1
+                        self._discard(conn)
+                    self._cond.notify()
+
+            try:
+                self.prewarm()
+            except DBUnavailable:
+                pass
+
+        def snapshot(self) -> dict:
+            with self._cond:
+                return {
+                    "in_use": self._in_use,
+                    "idle": len(self._idle),
+                    "min": self.minconn,
+                    "max": self.maxconn,
+                    **self.stats,
+                }
+
+    # коннекты не открываются при импорте: если Neon спит, импорт не должен падать
+    _pg_pool = _PgPool(DATABASE_URL, min(PG_POOL_MIN, PG_SYNC_POOL_MAX), PG_SYNC_POOL_MAX)
+
+    def prewarm_db_pool():
+        _pg_pool.prewarm()
+
+    def db_pool_stats() -> dict:
+        return _pg_pool.snapshot()
+
+    class _PgConn:
+        def __init__(self):
+            self._conn = _pg_pool.getconn()  # сам бросает DBUnavailable
+            self._opened: list[_CursorWrapper] = []
+            self._in_tx = False
+
+        def _reset_conn(self):
+            old, self._conn = self._conn, None
+            self._conn = _pg_pool.replace(old)
+
+        def _execute(self, sql: str, params):
             try:
                 cur = self._conn.cursor()
                 cur.execute(sql, params)
             except OperationalError as e:
+                if self._in_tx:
+                    # посреди транзакции коннект не подменить — начатое уже потеряно
+                    raise DBUnavailable(str(e)) from e
                 # Neon/сеть могло прибить коннект — пересоздаём и повторяем 1 раз
                 self._reset_conn()
-                cur = self._conn.cursor()
-                cur.execute(sql, params)
+                try:
+                    cur = self._conn.cursor()
+                    cur.execute(sql, params)
+                except OperationalError as e:
+                    raise DBUnavailable(str(e)) from e
 
             w = _CursorWrapper(cur)
             self._opened.append(w)
             return w
 
+        def execute(self, sql: str, params=()):
+            return self._execute(_compile_sql(sql), params)
+
+        def run(self, key: str, params=()):
+            return self._execute(STATEMENTS[key], params)
+
+        @contextmanager
+        def transaction(self):
+            """Несколько выражений одной транзакцией (по умолчанию коннект в autocommit)."""
+            self._conn.autocommit = False
+            self._in_tx = True
+            try:
+                yield self
+                self._conn.commit()
+            except Exception:
+                try:
+                    self._conn.rollback()
+                except Exception:
+                    pass
+                raise
+            finally:
+                self._in_tx = False
+                try:
+                    self._conn.autocommit = True
+                except Exception:
+                    pass
+
         def close(self):
             for w in self._opened:
                 try:
@@ -323,13 +906,9 @@ if DATABASE_URL:
                 except Exception:
                     pass
             self._opened.clear()
-            try:
+            if self._conn is not None:
                 _pg_pool.putconn(self._conn)
-            except Exception:
-                try:
-                    self._conn.close()
-                except Exception:
-                    pass
+                self._conn = None
 
         def __enter__(self): return self
         def __exit__(self, exc_type, exc, tb): self.close()
@@ -339,86 +918,107 @@ if DATABASE_URL:
 
 else:
     import sqlite3
+    import queue
+
+    SQLITE_POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", "4"))
+
+    # настраиваем один раз на коннект, а не на каждый `with get_conn()`
+    _SQLITE_PRAGMAS = (
+        "PRAGMA journal_mode=WAL",     # читатели не блокируются писателем
+        "PRAGMA synchronous=NORMAL",   # в режиме WAL этого достаточно
+        "PRAGMA busy_timeout=5000",    # ждём блокировку, а не падаем с 'database is locked'
+        "PRAGMA mmap_size=67108864",   # 64 МБ читаем через mmap
+        "PRAGMA foreign_keys=ON",      # важно для каскадов
+    )
+
+    # LIFO: чаще переиспользуем «тёплые» коннекты с заполненным кэшем выражений
+    _sqlite_pool: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue(maxsize=SQLITE_POOL_SIZE)
+
+    def _sqlite_connect() -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            DB_PATH,
+            timeout=5,
+            check_same_thread=False,  # коннект живёт в пуле и переходит между потоками run_db
+            cached_statements=256,
+        )
+        for pragma in _SQLITE_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
     class _SqliteConn:
         def __init__(self):
-            self._conn = sqlite3.connect(DB_PATH)
-            self._conn.execute("PRAGMA foreign_keys=ON")  # важно для каскадов
+            try:
+                self._conn = _sqlite_pool.get_nowait()
+            except queue.Empty:
+                self._conn = _sqlite_connect()
 
         def execute(self, *args, **kwargs):
             return self._conn.execute(*args, **kwargs)
+        def run(self, key: str, params=()):
+            return self._conn.execute(STATEMENTS[key], params)
         def commit(self): self._conn.commit()
-        def close(self): self._conn.close()
+
+        @contextmanager
+        def transaction(self):
+            """Несколько выражений (в т.ч. DDL) одной транзакцией."""
+            self._conn.commit()  # закрыть неявную транзакцию модуля sqlite3, если была
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+
+        def close(self):
+            # возвращаем коннект в пул; лишний (сверх SQLITE_POOL_SIZE) или
+            # оставшийся посреди транзакции — закрываем
+            if self._conn.in_transaction:
+                self._conn.close()
+                return
+            try:
+                _sqlite_pool.put_nowait(self._conn)
+            except queue.Full:
+                self._conn.close()
+
         def __enter__(self): return self
         def __exit__(self, exc_type, exc, tb):
             try:
                 if exc_type is None: self._conn.commit()
                 else: self._conn.rollback()
             finally:
-                self._conn.close()
+                self.close()
 
     def get_conn(): return _SqliteConn()
 
-def ensure_reminders_table():
-    """
-    Таблица для антидубликатов напоминаний.
-    Храним именно tg_id (а не users.id).
-    Если старая таблица была с другим набором колонок, она будет
-    пересоздана (данные о прошлых напоминаниях нам не критичны).
-    """
-    with get_conn() as conn:
-        # На случай старой схемы — пересоздаём таблицу.
-        #conn.execute("DROP TABLE IF EXISTS reminders_sent")
-
-        if DATABASE_URL:
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS reminders_sent (
-                    tg_id          BIGINT      NOT NULL,
-                    machine_id     INTEGER     NOT NULL,
-                    date           DATE        NOT NULL,
-                    hour           INTEGER     NOT NULL,
-                    minutes_before INTEGER     NOT NULL,
-                    sent_at        TIMESTAMPTZ DEFAULT now(),
-                    PRIMARY KEY (tg_id, machine_id, date, hour, minutes_before)
-                );
-            """)
-        else:
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS reminders_sent (
-                    tg_id          INTEGER     NOT NULL,
-                    machine_id     INTEGER     NOT NULL,
-                    date           TEXT        NOT NULL,
-                    hour           INTEGER     NOT NULL,
-                    minutes_before INTEGER     NOT NULL,
-                    sent_at        TEXT        DEFAULT (strftime('%Y-%m-%dT%H:%M:%S','now')),
-                    PRIMARY KEY (tg_id, machine_id, date, hour, minutes_before)
-                );
-            """)
-
-def ensure_machines_active_column():
-    """
-    Добавляем колонку is_active в таблицу machines, если её ещё нет.
-    TRUE / 1 = машина работает и доступна в /book.
-    """
-    with get_conn() as conn:
-        if DATABASE_URL:
-            # Postgres: есть IF NOT EXISTS
-            conn.execute("""
-                ALTER TABLE machines
-                ADD COLUMN IF NOT EXISTS is_active BOOLEAN NOT NULL DEFAULT TRUE;
-            """)
-        else:
-            # SQLite: IF NOT EXISTS нет, просто ловим ошибку «duplicate column name»
+    def prewarm_db_pool():
+        # открываем коннекты заранее, чтобы PRAGMA не выполнялись на первом запросе
+        fresh = [_sqlite_connect() for _ in range(SQLITE_POOL_SIZE - _sqlite_pool.qsize())]
+        for conn in fresh:
             try:
-                conn.execute("""
-                    ALTER TABLE machines
-                    ADD COLUMN is_active INTEGER NOT NULL DEFAULT 1;
-                """)
-            except Exception:
-                pass
+                _sqlite_pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
 
+    def db_pool_stats() -> dict:
+        return {"idle": _sqlite_pool.qsize(), "max": SQLITE_POOL_SIZE}
 
-# ---------- инициализация схемы ----------
-def init_db():
+# ---------- схема: версионированные миграции ----------
+# Каждый шаг получает коннект внутри общей транзакции и применяется один раз:
+# номер последнего шага хранится в schema_version. Шаги только дописываем в конец.
+# Шаги 1–4 идемпотентны — базы, созданные до schema_version, проходят их без потерь.
+
+def _has_column(conn, table: str, column: str) -> bool:
+    if DATABASE_URL:
+        return bool(conn.execute(
+            "SELECT 1 FROM information_schema.columns WHERE table_name=? AND column_name=?",
+            (table, column),
+        ).fetchone())
+    return any(r[1] == column for r in conn.execute(f"PRAGMA table_info({table})").fetchall())
+
+
+def _m001_base_tables(conn):
+    """Базовые таблицы (то, что раньше делали init_db и ensure_*_table)."""
     if DATABASE_URL:
         ddl = [
             """
@@ -448,8 +1048,33 @@ def init_db():
                 UNIQUE (machine_id, date, hour)
             );
             """,
-            "CREATE INDEX IF NOT EXISTS idx_bookings_user_date ON bookings (user_id, date);",
-            "CREATE INDEX IF NOT EXISTS idx_bookings_machine_date ON bookings (machine_id, date);",
+            """
+            CREATE TABLE IF NOT EXISTS banned (
+                tg_id BIGINT UNIQUE NOT NULL,
+                reason TEXT,
+                banned_until TEXT,
+                banned_at TIMESTAMPTZ DEFAULT now()
+            );
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS failed_attempts (
+                tg_id BIGINT UNIQUE NOT NULL,
+                count INTEGER DEFAULT 0,
+                last_attempt TIMESTAMPTZ DEFAULT now()
+            );
+            """,
+            # антидубли напоминаний: храним именно tg_id (а не users.id)
+            """
+            CREATE TABLE IF NOT EXISTS reminders_sent (
+                tg_id          BIGINT      NOT NULL,
+                machine_id     INTEGER     NOT NULL,
+                date           DATE        NOT NULL,
+                hour           INTEGER     NOT NULL,
+                minutes_before INTEGER     NOT NULL,
+                sent_at        TIMESTAMPTZ DEFAULT now(),
+                PRIMARY KEY (tg_id, machine_id, date, hour, minutes_before)
+            );
+            """,
         ]
     else:
         ddl = [
@@ -480,178 +1105,302 @@ def init_db():
                 UNIQUE (machine_id, date, hour)
             );
             """,
-            "CREATE INDEX IF NOT EXISTS idx_bookings_user_date ON bookings (user_id, date);",
-            "CREATE INDEX IF NOT EXISTS idx_bookings_machine_date ON bookings (machine_id, date);",
+            """
+            CREATE TABLE IF NOT EXISTS banned (
+                tg_id INTEGER UNIQUE NOT NULL,
+                reason TEXT,
+                banned_until TEXT,
+                banned_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%S','now'))
+            );
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS failed_attempts (
+                tg_id INTEGER UNIQUE NOT NULL,
+                count INTEGER DEFAULT 0,
+                last_attempt TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%S','now'))
+            );
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS reminders_sent (
+                tg_id          INTEGER     NOT NULL,
+                machine_id     INTEGER     NOT NULL,
+                date           TEXT        NOT NULL,
+                hour           INTEGER     NOT NULL,
+                minutes_before INTEGER     NOT NULL,
+                sent_at        TEXT        DEFAULT (strftime('%Y-%m-%dT%H:%M:%S','now')),
+                PRIMARY KEY (tg_id, machine_id, date, hour, minutes_before)
+            );
+            """,
         ]
-    with get_conn() as conn:
-        for stmt in ddl: conn.execute(stmt)
-    ensure_ban_tables()
-    ensure_reminders_table()
-    ensure_machines_active_column()
+    ddl += [
+        "CREATE INDEX IF NOT EXISTS idx_bookings_user_date ON bookings (user_id, date);",
+        "CREATE INDEX IF NOT EXISTS idx_bookings_machine_date ON bookings (machine_id, date);",
+    ]
+    for stmt in ddl:
+        conn.execute(stmt)
 
-# ---------- бан/антиспам ----------
-def ensure_ban_tables():
+
+def _m002_machines_active_bigint_ids(conn):
+    """
+    machines.is_active (TRUE / 1 = машина работает и доступна в /book);
+    на Postgres tg_id в бан-таблицах — BIGINT (в старых базах был INTEGER).
+    """
     if DATABASE_URL:
-        with get_conn() as conn:
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS banned (
-                    tg_id BIGINT UNIQUE NOT NULL,
-                    reason TEXT,
-                    banned_until TEXT,
-                    banned_at TIMESTAMPTZ DEFAULT now()
-                );
-            """)
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS failed_attempts (
-                    tg_id BIGINT UNIQUE NOT NULL,
-                    count INTEGER DEFAULT 0,
-                    last_attempt TIMESTAMPTZ DEFAULT now()
-                );
-            """)
-            try:
-                conn.execute("ALTER TABLE banned ALTER COLUMN tg_id TYPE BIGINT USING tg_id::bigint;")
-            except Exception:
-                pass
+        conn.execute("ALTER TABLE machines ADD COLUMN IF NOT EXISTS is_active BOOLEAN NOT NULL DEFAULT TRUE;")
+        conn.execute("ALTER TABLE banned ALTER COLUMN tg_id TYPE BIGINT USING tg_id::bigint;")
+        conn.execute("ALTER TABLE failed_attempts ALTER COLUMN tg_id TYPE BIGINT USING tg_id::bigint;")
+    elif not _has_column(conn, "machines", "is_active"):
+        conn.execute("ALTER TABLE machines ADD COLUMN is_active INTEGER NOT NULL DEFAULT 1;")
+
 
+# (tg_id, машина, дата, час) записей, удалённых миграцией 3; см. take_migration_dropped
+_migration_dropped: list[tuple] = []
+
+
+def _m003_bookings_machine_type(conn):
+    """
+    Тип машины прямо в bookings + уникальный индекс (user_id, date, machine_type):
+    правило «1 запись на тип в сутки» держит сама БД, а не проверка перед INSERT.
+    """
+    if not _has_column(conn, "bookings", "machine_type"):
+        conn.execute("ALTER TABLE bookings ADD COLUMN machine_type TEXT;")
+    # старые записи: тип берём из machines
+    conn.execute("""
+        UPDATE bookings
+           SET machine_type = (SELECT m.type FROM machines m WHERE m.id = bookings.machine_id)
+         WHERE machine_type IS NULL;
+    """)
+    # индексу мешают двойные записи: оставляем самую раннюю (меньший id),
+    # остальные удаляем. Кого это задело — запоминаем: после старта бот
+    # сообщит жильцам и админам (take_migration_dropped)
+    dup = """
+        FROM bookings
+       WHERE machine_type IS NOT NULL
+         AND EXISTS (
+             SELECT 1 FROM bookings e
+              WHERE e.user_id = bookings.user_id
+                AND e.date = bookings.date
+                AND e.machine_type = bookings.machine_type
+                AND e.id < bookings.id
+         )
+    """
+    dropped = conn.execute(f"""
+        SELECT u.tg_id, m.name, b.date, b.hour
+          FROM bookings b
+          LEFT JOIN users u ON u.id = b.user_id
+          LEFT JOIN machines m ON m.id = b.machine_id
+         WHERE b.id IN (SELECT id {dup})
+         ORDER BY b.id
+    """).fetchall()
+    conn.execute(f"DELETE {dup}")
+    for tg_id, machine_name, date_iso, hour in dropped:
+        print(
+            f"⚠️ Двойная запись удалена ради лимита «1 тип в сутки»: "
+            f"tg_id={tg_id} {machine_name} {date_iso} {hour:02d}:00"
+        )
+    _migration_dropped.extend(tuple(r) for r in dropped)
+    conn.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_bookings_user_date_type
+        ON bookings (user_id, date, machine_type);
+    """)
+
+
+def _m004_hot_indexes(conn):
+    """Индексы под горячие запросы (см. index_report)."""
+    # ensure_user_by_surname_room / bind_stub_user_to_real
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_surname_room ON users (surname, room);")
+    # tg_id_by_username: LOWER(username)=LOWER(?)
+    if not _has_column(conn, "users", "username"):
+        # в базах старше update_username колонки нет — CREATE TABLE IF NOT EXISTS её не добавит
+        conn.execute("ALTER TABLE users ADD COLUMN username TEXT;")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_username_lower ON users (LOWER(username));")
+    # сетка занятости и напоминания берут записи по дате (и часу)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_bookings_date_hour ON bookings (date, hour);")
+    # чистка старых отметок идёт по дате
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_reminders_sent_date ON reminders_sent (date);")
+
+
+MIGRATIONS = [
+    _m001_base_tables,
+    _m002_machines_active_bigint_ids,
+    _m003_bookings_machine_type,
+    _m004_hot_indexes,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+SCHEMA_LOCK_KEY = 7_204_311  # ключ pg_advisory_xact_lock для миграций
+
+
+def _read_schema_version(conn) -> int:
+    try:
+        row = conn.execute("SELECT version FROM schema_version").fetchone()
+    except DBUnavailable:
+        raise
+    except Exception:
+        return 0  # таблицы ещё нет — база до версионирования или пустая
+    return row[0] if row else 0
+
+
+# ---------- инициализация схемы ----------
+def init_db() -> bool:
+    """
+    Догоняет схему до SCHEMA_VERSION. Если версия совпадает — один SELECT и выход.
+    Все недостающие шаги идут в одной транзакции. Возвращает True, если что-то применили.
+    """
+    with get_conn() as conn:
+        if _read_schema_version(conn) >= SCHEMA_VERSION:
+            return False
+
+        with conn.transaction():
+            conn.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+            if DATABASE_URL:
+                # два инстанса при деплое не должны мигрировать одновременно
+                conn.execute("SELECT pg_advisory_xact_lock(?)", (SCHEMA_LOCK_KEY,))
+            current = _read_schema_version(conn)  # перечитываем под блокировкой
             try:
-                conn.execute("ALTER TABLE failed_attempts ALTER COLUMN tg_id TYPE BIGINT USING tg_id::bigint;")
+                for n, step in enumerate(MIGRATIONS[current:], start=current + 1):
+                    print(f"🛠 Миграция схемы {n}: {step.__name__}")
+                    step(conn)
+                conn.execute("DELETE FROM schema_version")
+                conn.execute("INSERT INTO schema_version (version) VALUES (?)", (SCHEMA_VERSION,))
             except Exception:
-                pass
+                _migration_dropped.clear()  # транзакция откатится — ничего не удалено
+                raise
+    return current < SCHEMA_VERSION
 
-            #conn.execute("ALTER TABLE banned ALTER COLUMN tg_id TYPE BIGINT USING tg_id::bigint;")
-            #conn.execute("ALTER TABLE failed_attempts ALTER COLUMN tg_id TYPE BIGINT USING tg_id::bigint;")
-    else:
-        with get_conn() as conn:
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS banned (
-                    tg_id INTEGER UNIQUE NOT NULL,
-                    reason TEXT,
-                    banned_until TEXT,
-                    banned_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%S','now'))
-                );
-            """)
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS failed_attempts (
-                    tg_id INTEGER UNIQUE NOT NULL,
-                    count INTEGER DEFAULT 0,
-                    last_attempt TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%S','now'))
-                );
-            """)
+def take_migration_dropped() -> list[tuple]:
+    """Записи, удалённые миграцией: (tg_id, машина, дата, час). Отдаёт один раз."""
+    dropped = _migration_dropped[:]
+    _migration_dropped.clear()
+    return dropped
+
+# ---------- бан/антиспам ----------
+
+def ban_registry_snapshot() -> dict[int, ban_registry.Ban]:
+    """Все баны; из БД — только при первом обращении."""
+    bans, generation = ban_registry.snapshot()
+    if bans is not None:
+        return bans
+    with get_conn() as conn:
+        rows = conn.run("banned.all").fetchall()
+    return ban_registry.load(rows, generation)
 
 def ban_user(tg_id: int, reason: str | None = None, days: int = 7):
     until = (datetime.now(TZ) + timedelta(days=days)).isoformat(timespec="seconds")
     banned_at = datetime.now(TZ).isoformat(timespec="seconds")
+    reason = reason or "Без причины"
     with get_conn() as conn:
-        conn.execute("""
-            INSERT INTO banned (tg_id, reason, banned_until, banned_at)
-            VALUES (?, ?, ?, ?)
-            ON CONFLICT(tg_id) DO UPDATE SET
-                reason=excluded.reason,
-                banned_until=excluded.banned_until,
-                banned_at=excluded.banned_at
-        """, (tg_id, reason or "Без причины", until, banned_at))
+        conn.run("banned.upsert", (tg_id, reason, until, banned_at))
+    ban_registry.put(tg_id, until, reason)
+
+def ban_status(tg_id: int) -> ban_registry.Ban | None:
+    """Действующий бан (срок + причина) или None."""
+    return ban_registry.get(ban_registry_snapshot(), tg_id, datetime.now(TZ))
 
 def is_banned(tg_id: int) -> bool:
-    with get_conn() as conn:
-        row = conn.execute("SELECT banned_until FROM banned WHERE tg_id=?", (tg_id,)).fetchone()
-        if not row: return False
-        until = row[0]
-        if not until: return False
-        try:
-            if datetime.fromisoformat(until) <= datetime.now(TZ):
-                conn.execute("DELETE FROM banned WHERE tg_id=?", (tg_id,))
-                return False
-        except Exception:
-            pass
-        return True
+    return ban_status(tg_id) is not None
 
 def unban_user(tg_id: int):
     with get_conn() as conn:
-        conn.execute("DELETE FROM banned WHERE tg_id=?", (tg_id,))
+        conn.run("banned.delete", (tg_id,))
+    ban_registry.remove([tg_id])
+
+def expire_bans() -> int:
+    """Задача планировщика: удалить истёкшие баны одним DELETE."""
+    now = datetime.now(TZ).isoformat(timespec="seconds")
+    with get_conn() as conn:
+        expired = [tg_id for (tg_id,) in conn.run("banned.delete_expired", (now,)).fetchall()]
+    if expired:
+        ban_registry.remove(expired)
+        ban_registry.note_expired(len(expired))
+    return len(expired)
 
 def register_failed_attempt(tg_id: int) -> int:
     now = datetime.now(TZ).isoformat(timespec="seconds")
     with get_conn() as conn:
-        row = conn.execute("SELECT count FROM failed_attempts WHERE tg_id=?", (tg_id,)).fetchone()
+        row = conn.run("attempts.count", (tg_id,)).fetchone()
         count = (row[0] if row else 0) + 1
-        conn.execute("""
-            INSERT INTO failed_attempts (tg_id, count, last_attempt)
-            VALUES (?, ?, ?)
-            ON CONFLICT(tg_id) DO UPDATE SET
-                count=excluded.count,
-                last_attempt=excluded.last_attempt
-        """, (tg_id, count, now))
+        conn.run("attempts.upsert", (tg_id, count, now))
     return count
 
 def reset_failed_attempts(tg_id: int):
     with get_conn() as conn:
-        conn.execute("DELETE FROM failed_attempts WHERE tg_id=?", (tg_id,))
+        conn.run("attempts.delete", (tg_id,))
 
 # ---------- пользователи ----------
-def bind_stub_user_to_real(tg_id, surname, room):
-    with get_conn() as conn:
-        stub = conn.execute("SELECT id FROM users WHERE surname=? AND room=?",
-                            (_b64e(surname), _b64e(room))).fetchone()
-        if not stub: return
+def bind_stub_user_to_real(tg_id, surname, room) -> list[tuple]:
+    """
+    Переносит записи стаба (созданного админом по Фамилии+Комнате) на tg_id.
+    Возвращает (machine_id, date, hour) записей, которые перенести не вышло
+    (у жильца уже есть запись этого типа в тот день), — они удалены.
+    """
+    with get_conn() as conn, conn.transaction():
+        stub = conn.run("users.stub_by_surname_room", (_b64e(surname), _b64e(room))).fetchone()
+        if not stub: return []
         stub_id = stub[0]
 
-        conn.execute("""
-            INSERT INTO users (tg_id, surname, room)
-            VALUES (?, ?, ?)
-            ON CONFLICT(tg_id) DO UPDATE SET surname=excluded.surname, room=excluded.room
-        """, (tg_id, _b64e(surname), _b64e(room)))
+        conn.run("users.upsert_profile", (tg_id, _b64e(surname), _b64e(room)))
 
-        real_id = conn.execute("SELECT id FROM users WHERE tg_id=?", (tg_id,)).fetchone()[0]
-        conn.execute("UPDATE bookings SET user_id=? WHERE user_id=?", (real_id, stub_id))
-        conn.execute("DELETE FROM users WHERE id=?", (stub_id,))
+        real_id = conn.run("users.id_by_tg", (tg_id,)).fetchone()[0]
+        dropped = conn.run("users.drop_stub_conflicts", (stub_id, real_id)).fetchall()
+        conn.run("users.move_bookings", (real_id, stub_id))
+        conn.run("users.delete", (stub_id,))
+    _user_cache_drop(tg_id)
+    return _note_stub_conflicts(tg_id, dropped)
+
+
+def _note_stub_conflicts(tg_id, dropped) -> list[tuple]:
+    out = []
+    for machine_id, date_iso, hour in dropped:
+        occupancy.mark_free(str(date_iso), machine_id, hour)
+        print(
+            f"⚠️ tg_id={tg_id}: запись стаба не перенесена (уже есть запись этого типа) — "
+            f"machine_id={machine_id} {date_iso} {hour:02d}:00"
+        )
+        out.append((machine_id, str(date_iso), hour))
+    return out
 
 def add_user(tg_id, surname, room):
     with get_conn() as conn:
-        conn.execute(
-            "INSERT OR IGNORE INTO users (tg_id, surname, room) VALUES (?, ?, ?)",
-            (tg_id, _b64e(surname), _b64e(room))
-        )
+        conn.run("users.insert_ignore", (tg_id, _b64e(surname), _b64e(room)))
+    _user_cache_drop(tg_id)
 
-def save_user(tg_id, surname, room):
-    bind_stub_user_to_real(tg_id, surname, room)
+def save_user(tg_id, surname, room) -> list[tuple]:
+    """Возвращает записи стаба, которые не удалось перенести (см. bind_stub_user_to_real)."""
+    dropped = bind_stub_user_to_real(tg_id, surname, room)
     with get_conn() as conn:
-        conn.execute("""
-            INSERT INTO users (tg_id, surname, room)
-            VALUES (?, ?, ?)
-            ON CONFLICT(tg_id) DO UPDATE SET
-                surname=excluded.surname,
-                room=excluded.room
-        """, (tg_id, _b64e(surname), _b64e(room)))
+        conn.run("users.upsert_profile", (tg_id, _b64e(surname), _b64e(room)))
+    _user_cache_drop(tg_id)
+    return dropped
 
 def update_username(tg_id: int, username: str | None):
-    if not username: return
-    with get_conn() as conn:
-        conn.execute("""
-            INSERT INTO users (tg_id, username)
-            VALUES (?, ?)
-            ON CONFLICT(tg_id) DO UPDATE SET username=excluded.username
-        """, (tg_id, username))
+    """Без записи в БД: в очередь flush_usernames (или пропуск, если не поменялся)."""
+    _queue_username(tg_id, username)
 
 def tg_id_by_username(username: str) -> int | None:
     u = username.lstrip("@")
+    pending = _pending_tg_by_username(u)
+    if pending is not None:
+        return pending
     with get_conn() as conn:
-        row = conn.execute("SELECT tg_id FROM users WHERE LOWER(username)=LOWER(?) LIMIT 1", (u,)).fetchone()
+        row = conn.run("users.tg_by_username", (u,)).fetchone()
         return row[0] if row else None
 
 def get_user(tg_id):
+    found, user, generation = _user_cache_get(tg_id)
+    if found:
+        return user
     with get_conn() as conn:
-        row = conn.execute("SELECT id, tg_id, surname, room FROM users WHERE tg_id=?", (tg_id,)).fetchone()
-        if not row: return None
-        return (row[0], row[1], _b64d_try(row[2]), _b64d_try(row[3]))
+        row = conn.run("users.get", (tg_id,)).fetchone()
+    if row:
+        _note_username(tg_id, row[4])
+    user = _user_row(row)
+    _user_cache_put(tg_id, user, generation)
+    return user
 
 def get_incomplete_users():
     """Пользователи без фамилии или комнаты."""
     with get_conn() as conn:
-        return conn.execute("""
-            SELECT tg_id, COALESCE(username, '')
-            FROM users
-            WHERE surname IS NULL OR room IS NULL
-        """).fetchall()
+        return conn.run("users.incomplete").fetchall()
 
 # ---------- машины/бронирования ----------
 '''
@@ -661,10 +1410,8 @@ def add_machine(type_, name):
 '''
 def add_machine(type_, name):
     with get_conn() as conn:
-        conn.execute(
-            "INSERT OR IGNORE INTO machines (type, name) VALUES (?, ?)",
-            (type_, name)
-        )
+        conn.run("machines.insert_ignore", (type_, name))
+    machine_catalog.invalidate()
 '''
 def get_machines_by_type(type_):
     with get_conn() as conn:
@@ -672,52 +1419,167 @@ def get_machines_by_type(type_):
 '''
 
 def get_machines_by_type(type_):
-    with get_conn() as conn:
-        return conn.execute(
-            "SELECT id, type, name FROM machines WHERE type=? AND is_active",
-            (type_,)
-        ).fetchall()
+    return [(m.id, m.type, m.name) for m in machine_catalog_snapshot().active(type_)]
 
 def get_user_bookings_today(user_id, date_iso, machine_type):
     with get_conn() as conn:
-        row = conn.execute("""
-            SELECT 1
-            FROM bookings b
-            JOIN machines m ON m.id = b.machine_id
-            WHERE b.user_id = ? AND b.date = ? AND m.type = ?
-            LIMIT 1
-        """, (user_id, date_iso, machine_type)).fetchone()
+        row = conn.run("bookings.user_has_type", (user_id, date_iso, machine_type)).fetchone()
     return bool(row)
 
 def get_user_booking_exact(user_id: int, machine_id: int, date_iso: str, hour: int) -> bool:
     with get_conn() as conn:
-        row = conn.execute("""
-            SELECT 1 FROM bookings
-            WHERE user_id=? AND machine_id=? AND date=? AND hour=?
-            LIMIT 1
-        """, (user_id, machine_id, date_iso, hour)).fetchone()
+        row = conn.run("bookings.exact", (user_id, machine_id, date_iso, hour)).fetchone()
     return bool(row)
 
+def busy_masks(date_iso: str) -> dict[int, int]:
+    """{machine_id: маска занятых часов} на дату; из БД — только при первом обращении."""
+    masks, token = occupancy.lookup(date_iso)
+    if masks is not None:
+        return masks
+    with get_conn() as conn:
+        rows = conn.run("bookings.busy_by_date", (date_iso,)).fetchall()
+    return occupancy.load_date(date_iso, rows, token)
+
 def get_free_hours(machine_id, date_iso):
+    busy = busy_masks(date_iso).get(int(machine_id), 0)
+    return occupancy.mask_to_hours(occupancy.ALL_HOURS & ~busy)
+
+def _availability_params(start_date, days: int, now: datetime):
+    end = start_date + timedelta(days=days)
+    return (
+        start_date.isoformat(), end.isoformat(),
+        now.date().isoformat(), now.hour,
+        min(WORKING_HOURS), max(WORKING_HOURS),  # записи админа вне рабочих часов не в счёт
+    )
+
+def _summarize_availability(rows, start_date, days: int, now: datetime) -> dict[str, dict[str, int]]:
+    """Свободные слоты = активные машины × открытые часы − занятые (см. bookings.availability)."""
+    machines = {t: n for d, t, n in rows if d is None}
+    busy = {(str(d), t): n for d, t, n in rows if d is not None}
+    summary: dict[str, dict[str, int]] = {}
+    for i in range(days):
+        d_iso = (start_date + timedelta(days=i)).isoformat()
+        open_cnt = occupancy.bit_count(occupancy.future_mask(d_iso, now))
+        summary[d_iso] = {
+            t: max(0, machines.get(t, 0) * open_cnt - busy.get((d_iso, t), 0))
+            for t in ("wash", "dry")
+        }
+    return summary
+
+def availability_summary(start_date, days: int) -> dict[str, dict[str, int]]:
+    """
+    {date_iso: {'wash': свободно, 'dry': свободно}} на days дней от start_date.
+    Только активные машины; для «сегодня» — только будущие часы. Один запрос.
+    """
+    now = datetime.now(TZ)
     with get_conn() as conn:
-        busy = {r[0] for r in conn.execute(
-            "SELECT hour FROM bookings WHERE machine_id=? AND date=?",
-            (machine_id, date_iso)
-        ).fetchall()}
-    return [h for h in WORKING_HOURS if h not in busy]
+        rows = conn.run(
+            "bookings.availability", _availability_params(start_date, days, now)
+        ).fetchall()
+    return _summarize_availability(rows, start_date, days, now)
 
-def create_booking(user_id, machine_id, date_iso, hour):
+def create_booking(user_id, machine_id, date_iso, hour) -> int | None:
+    """id новой записи или None, если слот занят / уже есть запись на этот тип в этот день."""
+    with get_conn() as conn:
+        row = conn.run("bookings.insert", (user_id, date_iso, hour, machine_id)).fetchone()
+    if row:
+        occupancy.mark_busy(date_iso, machine_id, hour)
+    return row[0] if row else None
+
+def delete_booking(booking_id: int) -> tuple | None:
+    """Удаляет запись; (machine_id, date, hour) удалённой или None, если её уже не было."""
+    with get_conn() as conn:
+        row = conn.run("bookings.delete", (booking_id,)).fetchone()
+    if row:
+        occupancy.mark_free(str(row[1]), row[0], row[2])
+    return row
+
+class BookingOutcome(str, Enum):
+    BOOKED = "booked"
+    SLOT_TAKEN = "slot_taken"              # слот занят другим
+    ALREADY_MINE = "already_mine"          # этот же слот уже ваш
+    DAILY_LIMIT = "daily_limit"            # уже есть запись на этот тип в этот день
+    BANNED = "banned"
+    INACTIVE_MACHINE = "inactive_machine"  # машина выключена админом
+    NOT_REGISTERED = "not_registered"      # нет фамилии/комнаты
+    NO_MACHINE = "no_machine"              # машины нет (или не того типа)
+
+
+class BookingResult(NamedTuple):
+    outcome: BookingOutcome
+    booking_id: int | None = None
+    user_id: int | None = None             # users.id (не tg_id)
+    machine_type: str | None = None
+    machine_name: str | None = None
+    other_type_booked: bool = False        # в этот день у жильца уже есть запись другого типа
+
+
+def _booking_params(tg_id, machine_id, date_iso, hour, machine_type):
+    now_iso = datetime.now(TZ).isoformat(timespec="seconds")
+    return (date_iso, hour, tg_id, machine_id, machine_type, now_iso)
+
+
+def _booked(row) -> BookingResult:
+    """Строка RETURNING из bookings.book → результат успешной записи."""
+    booking_id, user_id, m_type, m_name, other_type = row
+    return BookingResult(BookingOutcome.BOOKED, booking_id, user_id, m_type, m_name, bool(other_type))
+
+
+def _classify_refusal(row, machine_type: str | None) -> BookingResult:
+    """Разбираем строку bookings.book_refusal: почему запись не состоялась."""
+    user_id, surname, room, m_type, m_name, m_active, banned_until, owner, has_type = row
+    if banned_until and banned_until > datetime.now(TZ).isoformat(timespec="seconds"):
+        return BookingResult(BookingOutcome.BANNED, None, user_id, m_type, m_name)
+    if user_id is None or not (surname and room):
+        return BookingResult(BookingOutcome.NOT_REGISTERED)
+    if m_type is None or (machine_type and m_type != machine_type):
+        return BookingResult(BookingOutcome.NO_MACHINE, None, user_id)
+    if not m_active:
+        return BookingResult(BookingOutcome.INACTIVE_MACHINE, None, user_id, m_type, m_name)
+    if owner is not None and owner == user_id:
+        return BookingResult(BookingOutcome.ALREADY_MINE, None, user_id, m_type, m_name)
+    if has_type:
+        return BookingResult(BookingOutcome.DAILY_LIMIT, None, user_id, m_type, m_name)
+    return BookingResult(BookingOutcome.SLOT_TAKEN, None, user_id, m_type, m_name)
+
+
+def _note_booking_result(res: BookingResult, machine_id: int, date_iso: str, hour: int):
+    # слот точно занят — и когда записали мы, и когда он оказался чужим/нашим
+    if res.outcome in (BookingOutcome.BOOKED, BookingOutcome.SLOT_TAKEN, BookingOutcome.ALREADY_MINE):
+        occupancy.mark_busy(date_iso, machine_id, hour)
+
+
+def book_slot(
+    tg_id: int, machine_id: int, date_iso: str, hour: int, machine_type: str | None = None
+) -> BookingResult:
+    """
+    Атомарная запись на слот: все проверки и INSERT — одно выражение, лимит
+    «1 тип в сутки» держит уникальный индекс. Если не вышло — один запрос на причину.
+    machine_type: ожидаемый тип машины (например, 'dry' для авто-сушки).
+    """
     with get_conn() as conn:
-        conn.execute("""
-            INSERT INTO bookings (user_id, machine_id, date, hour)
-            VALUES (?, ?, ?, ?)
-        """, (user_id, machine_id, date_iso, hour))
+        row = conn.run(
+            "bookings.book", _booking_params(tg_id, machine_id, date_iso, hour, machine_type)
+        ).fetchone()
+        if not row:
+            refusal = conn.run(
+                "bookings.book_refusal",
+                (tg_id, date_iso, hour, date_iso, tg_id, machine_id),
+            ).fetchone()
+    if row:
+        res = _booked(row)
+    else:
+        res = _classify_refusal(refusal, machine_type)
+    _note_booking_result(res, machine_id, date_iso, hour)
+    return res
 
 def cleanup_old_bookings():
     today = datetime.now(TZ).date()
     cutoff = today - timedelta(days=1)
     with get_conn() as conn:
-        conn.execute("DELETE FROM bookings WHERE date < ?", (cutoff.isoformat(),))
+        conn.run("bookings.delete_before", (cutoff.isoformat(),))
+        conn.run("reminders.delete_before", (cutoff.isoformat(),))
+    occupancy.drop_before(cutoff.isoformat())
 
 def was_reminder_sent(
     tg_id: int, machine_id: int, date_iso: str, hour: int, minutes_before: int
@@ -727,12 +1589,9 @@ def was_reminder_sent(
     tg_id + machine_id + дата + час + минут_до.
     """
     with get_conn() as conn:
-        row = conn.execute("""
-            SELECT 1
-              FROM reminders_sent
-             WHERE tg_id=? AND machine_id=? AND date=? AND hour=? AND minutes_before=?
-             LIMIT 1
-        """, (tg_id, machine_id, date_iso, hour, minutes_before)).fetchone()
+        row = conn.run(
+            "reminders.was_sent", (tg_id, machine_id, date_iso, hour, minutes_before)
+        ).fetchone()
     return bool(row)
 
 
@@ -743,8 +1602,93 @@ def mark_reminder_sent(
     Помечаем напоминание как отправленное.
     """
     with get_conn() as conn:
-        conn.execute("""
-            INSERT INTO reminders_sent (tg_id, machine_id, date, hour, minutes_before)
-            VALUES (?, ?, ?, ?, ?)
-            ON CONFLICT(tg_id, machine_id, date, hour, minutes_before) DO NOTHING
-        """, (tg_id, machine_id, date_iso, hour, minutes_before))
+        conn.run("reminders.mark_sent", (tg_id, machine_id, date_iso, hour, minutes_before))
+
+
+class ReminderPlan(NamedTuple):
+    tg_id: int
+    machine_id: int
+    machine_name: str
+    machine_type: str
+    wash_before: bool   # у этого же человека стирка часом раньше
+    sent: bool          # уже отправлено (reminders_sent)
+
+
+def _reminder_plan_query(date_iso, hour, minutes_before, tg_id, machine_id) -> tuple[str, tuple]:
+    if tg_id is None:
+        return "reminders.plan", (minutes_before, date_iso, hour)
+    return "reminders.plan_one", (minutes_before, date_iso, hour, tg_id, machine_id)
+
+
+def _reminder_plans(rows) -> list[ReminderPlan]:
+    return [
+        ReminderPlan(int(t), int(m), name, m_type, bool(wash), bool(sent))
+        for t, m, name, m_type, wash, sent in rows
+    ]
+
+
+def reminder_plan(
+    date_iso: str, hour: int, minutes_before: int,
+    tg_id: int | None = None, machine_id: int | None = None,
+) -> list[ReminderPlan]:
+    """
+    Брони слота со всем, что нужно send_reminder, — одним запросом.
+    С tg_id и machine_id — только эта бронь (пустой список — её уже нет).
+    """
+    key, params = _reminder_plan_query(date_iso, hour, minutes_before, tg_id, machine_id)
+    with get_conn() as conn:
+        return _reminder_plans(conn.run(key, params).fetchall())
+
+
+# ---------- аудит индексов ----------
+# горячие выражения из реестра и примерные параметры для EXPLAIN
+_HOT_QUERIES = {
+    "users.get": (0,),
+    "users.id_by_surname_room": ("", ""),
+    "users.stub_by_surname_room": ("", ""),
+    "users.tg_by_username": ("",),
+    "bookings.user_has_type": (0, "2000-01-01", "wash"),
+    "bookings.busy_hours": (0, "2000-01-01"),
+    "bookings.busy_by_date": ("2000-01-01",),
+    "reminders.was_sent": (0, 0, "2000-01-01", 0, 30),
+    "reminders.plan": (30, "2000-01-01", 0),
+    "reminders.delete_before": ("2000-01-01",),
+}
+
+_PLAN_INDEX_RE = re.compile(
+    r"USING (?:COVERING )?INDEX (\S+)"          # SQLite
+    r"|USING (INTEGER PRIMARY KEY)"             # SQLite, rowid
+    r"|Index (?:Only )?Scan(?: Backward)? using (\S+)"  # Postgres
+    r"|Bitmap Index Scan on (\S+)"              # Postgres
+)
+
+
+def index_report() -> dict[str, list[str]]:
+    """
+    Какие индексы берут горячие запросы: ключ реестра → список индексов
+    (пустой список — полный проход по таблице).
+    На Postgres seq scan на время отчёта выключен: таблицы маленькие,
+    и планировщик иначе всегда выбирает полный проход.
+    """
+    report: dict[str, list[str]] = {}
+    with get_conn() as conn:
+        if DATABASE_URL:
+            conn.execute("SET enable_seqscan = off")
+        try:
+            for key, params in _HOT_QUERIES.items():
+                prefix = "EXPLAIN " if DATABASE_URL else "EXPLAIN QUERY PLAN "
+                rows = conn.execute(prefix + _SQL_SOURCE[key], params).fetchall()
+                plan = "\n".join(str(r[-1]) for r in rows)
+                report[key] = [
+                    next(g for g in m.groups() if g) for m in _PLAN_INDEX_RE.finditer(plan)
+                ]
+        finally:
+            if DATABASE_URL:
+                conn.execute("RESET enable_seqscan")
+    return report
+
+
+def print_index_report():
+    for key, indexes in index_report().items():
+        used = ", ".join(dict.fromkeys(indexes)) if indexes else "⚠️ полный проход"
+        print(f"🔎 {key}: {used}")
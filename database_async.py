@@ -0,0 +1,472 @@
+# database_async.py
+"""
+Асинхронный двойник database.py: те же имена функций, но через await,
+чтобы медленный запрос к Neon / блокировка SQLite не останавливали event loop.
+
+Backend выбирается так же, как в database.py:
+  DATABASE_URL задан → Postgres (psycopg 3, AsyncConnectionPool);
+  иначе              → SQLite (aiosqlite).
+"""
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+
+from config import DB_PATH, WORKING_HOURS
+from database import (
+    DATABASE_URL,
+    PG_APOOL_MAX,
+    DBUnavailable,
+    TZ,
+    _b64e,
+    _stub_tg_id,
+    _user_cache_get,
+    _user_cache_put,
+    _user_cache_drop,
+    _user_row,
+    _note_username,
+    _queue_username,
+    _pending_tg_by_username,
+    _note_stub_conflicts,
+    _compile_sql,
+    STATEMENTS,
+    BookingOutcome,
+    BookingResult,
+    _booked,
+    _booking_params,
+    _classify_refusal,
+    _note_booking_result,
+    _availability_params,
+    _summarize_availability,
+    ReminderPlan,
+    _reminder_plan_query,
+    _reminder_plans,
+    is_admin,  # noqa: F401  (чистая функция, реэкспорт для единообразия)
+)
+from db_warmth import note_db_ok
+import occupancy
+import machine_catalog
+import ban_registry
+
+
+if DATABASE_URL:
+    from psycopg import OperationalError
+    from psycopg_pool import AsyncConnectionPool, PoolTimeout
+    from database import (
+        PG_POOL_MAX_LIFETIME, PG_POOL_IDLE_TIMEOUT, PG_POOL_CHECKOUT_TIMEOUT,
+    )
+
+    # пул открываем лениво — на первом запросе, уже внутри event loop.
+    # Коннекты делят с синхронным пулом общий PG_POOL_MAX; тёплых не держим:
+    # простоявшие PG_POOL_IDLE_TIMEOUT закрываются, и Neon может уснуть
+    _pg_apool = AsyncConnectionPool(
+        DATABASE_URL,
+        min_size=0,
+        max_size=PG_APOOL_MAX,
+        max_lifetime=PG_POOL_MAX_LIFETIME,
+        max_idle=PG_POOL_IDLE_TIMEOUT,
+        timeout=PG_POOL_CHECKOUT_TIMEOUT,
+        check=AsyncConnectionPool.check_connection,
+        kwargs={"autocommit": True, "connect_timeout": 3},
+        open=False,
+    )
+    _pg_apool_opened = False
+
+    async def _ensure_pool_open():
+        global _pg_apool_opened
+        if not _pg_apool_opened:
+            await _pg_apool.open(wait=False)
+            _pg_apool_opened = True
+
+    class _APgConn:
+        def __init__(self):
+            self._conn = None
+
+        async def __aenter__(self):
+            await _ensure_pool_open()
+            try:
+                self._conn = await _pg_apool.getconn()
+            except (PoolTimeout, OperationalError) as e:
+                raise DBUnavailable(str(e)) from e
+            note_db_ok()
+            return self
+
+        async def _execute(self, sql: str, params):
+            try:
+                return await self._conn.execute(sql, params)
+            except OperationalError as e:
+                # битый коннект пул сам выбросит при putconn
+                raise DBUnavailable(str(e)) from e
+
+        async def execute(self, sql: str, params=()):
+            return await self._execute(_compile_sql(sql), params)
+
+        async def fetchone(self, sql: str, params=()):
+            cur = await self.execute(sql, params)
+            return await cur.fetchone()
+
+        async def fetchall(self, sql: str, params=()):
+            cur = await self.execute(sql, params)
+            return await cur.fetchall()
+
+        # --- выражения из реестра database.STATEMENTS ---
+        async def run(self, key: str, params=()):
+            return await self._execute(STATEMENTS[key], params)
+
+        async def run_one(self, key: str, params=()):
+            cur = await self.run(key, params)
+            return await cur.fetchone()
+
+        async def run_all(self, key: str, params=()):
+            cur = await self.run(key, params)
+            return await cur.fetchall()
+
+        @asynccontextmanager
+        async def transaction(self):
+            """Несколько выражений одной транзакцией (по умолчанию коннект в autocommit)."""
+            try:
+                async with self._conn.transaction():
+                    yield self
+            except OperationalError as e:
+                raise DBUnavailable(str(e)) from e
+
+        async def __aexit__(self, exc_type, exc, tb):
+            # autocommit=True — коммитить нечего, просто возвращаем коннект в пул
+            await _pg_apool.putconn(self._conn)
+
+    def get_aconn() -> _APgConn:
+        return _APgConn()
+
+    async def close_aconn_pool():
+        global _pg_apool_opened
+        if _pg_apool_opened:
+            await _pg_apool.close()
+            _pg_apool_opened = False
+
+else:
+    import aiosqlite
+    from database import _SQLITE_PRAGMAS, SQLITE_POOL_SIZE
+
+    # как _sqlite_pool в database.py: долгоживущие коннекты, PRAGMA — один раз на коннект.
+    # Стек (LIFO): чаще берём «тёплый» коннект с заполненным кэшем выражений.
+    # У каждого aiosqlite-коннекта свой поток — при остановке закрыть: close_aconn_pool().
+    _asqlite_idle: list["aiosqlite.Connection"] = []
+
+    async def _asqlite_connect() -> "aiosqlite.Connection":
+        conn = aiosqlite.connect(DB_PATH, timeout=5, cached_statements=256)
+        # поток простаивающего коннекта не должен держать процесс при выходе
+        # (aiosqlite < 0.20: коннект сам Thread, дальше — поле _thread)
+        getattr(conn, "_thread", conn).daemon = True
+        conn = await conn
+        for pragma in _SQLITE_PRAGMAS:
+            await conn.execute(pragma)
+        return conn
+
+    async def _asqlite_release(conn: "aiosqlite.Connection"):
+        # лишний (сверх SQLITE_POOL_SIZE) или оставшийся посреди транзакции — закрываем
+        if conn.in_transaction or len(_asqlite_idle) >= SQLITE_POOL_SIZE:
+            await conn.close()
+        else:
+            _asqlite_idle.append(conn)
+
+    class _ASqliteConn:
+        def __init__(self):
+            self._conn = None
+
+        async def __aenter__(self):
+            self._conn = _asqlite_idle.pop() if _asqlite_idle else await _asqlite_connect()
+            return self
+
+        async def execute(self, sql: str, params=()):
+            return await self._conn.execute(sql, params)
+
+        async def fetchone(self, sql: str, params=()):
+            async with self._conn.execute(sql, params) as cur:
+                return await cur.fetchone()
+
+        async def fetchall(self, sql: str, params=()):
+            async with self._conn.execute(sql, params) as cur:
+                return await cur.fetchall()
+
+        # --- выражения из реестра database.STATEMENTS ---
+        async def run(self, key: str, params=()):
+            return await self._conn.execute(STATEMENTS[key], params)
+
+        async def run_one(self, key: str, params=()):
+            return await self.fetchone(STATEMENTS[key], params)
+
+        async def run_all(self, key: str, params=()):
+            return await self.fetchall(STATEMENTS[key], params)
+
+        @asynccontextmanager
+        async def transaction(self):
+            """Несколько выражений одной транзакцией."""
+            await self._conn.commit()  # закрыть неявную транзакцию, если была
+            await self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self
+                await self._conn.commit()
+            except Exception:
+                await self._conn.rollback()
+                raise
+
+        async def __aexit__(self, exc_type, exc, tb):
+            try:
+                if exc_type is None: await self._conn.commit()
+                else: await self._conn.rollback()
+            finally:
+                await _asqlite_release(self._conn)
+
+    def get_aconn() -> _ASqliteConn:
+        return _ASqliteConn()
+
+    async def close_aconn_pool():
+        """Закрыть простаивающие коннекты (и их потоки) при остановке бота."""
+        while _asqlite_idle:
+            await _asqlite_idle.pop().close()
+
+
+# ---------- машины ----------
+async def machine_catalog_snapshot():
+    """Каталог машин; из БД — только если его ещё нет или его сбросили."""
+    catalog, generation = machine_catalog.snapshot()
+    if catalog is not None:
+        return catalog
+    async with get_aconn() as conn:
+        rows = await conn.run_all("machines.all")
+    return machine_catalog.load(rows, generation)
+
+async def get_machine(machine_id: int) -> machine_catalog.Machine | None:
+    return (await machine_catalog_snapshot()).get(machine_id)
+
+async def get_machine_id_by_name(name: str) -> int | None:
+    return (await machine_catalog_snapshot()).id_by_name(name)
+
+async def set_machine_active(machine_id: int, active: bool) -> None:
+    async with get_aconn() as conn:
+        await conn.run("machines.set_active", (bool(active), machine_id))
+    machine_catalog.invalidate()
+
+async def get_all_machines():
+    return [tuple(m) for m in (await machine_catalog_snapshot()).all()]
+
+async def add_machine(type_, name):
+    async with get_aconn() as conn:
+        await conn.run("machines.insert_ignore", (type_, name))
+    machine_catalog.invalidate()
+
+async def get_machines_by_type(type_):
+    return [(m.id, m.type, m.name) for m in (await machine_catalog_snapshot()).active(type_)]
+
+
+# ---------- бан/антиспам ----------
+async def ban_registry_snapshot() -> dict[int, ban_registry.Ban]:
+    """Все баны; из БД — только при первом обращении."""
+    bans, generation = ban_registry.snapshot()
+    if bans is not None:
+        return bans
+    async with get_aconn() as conn:
+        rows = await conn.run_all("banned.all")
+    return ban_registry.load(rows, generation)
+
+async def ban_user(tg_id: int, reason: str | None = None, days: int = 7):
+    until = (datetime.now(TZ) + timedelta(days=days)).isoformat(timespec="seconds")
+    banned_at = datetime.now(TZ).isoformat(timespec="seconds")
+    reason = reason or "Без причины"
+    async with get_aconn() as conn:
+        await conn.run("banned.upsert", (tg_id, reason, until, banned_at))
+    ban_registry.put(tg_id, until, reason)
+
+async def ban_status(tg_id: int) -> ban_registry.Ban | None:
+    """Действующий бан (срок + причина) или None."""
+    return ban_registry.get(await ban_registry_snapshot(), tg_id, datetime.now(TZ))
+
+async def is_banned(tg_id: int) -> bool:
+    return await ban_status(tg_id) is not None
+
+async def unban_user(tg_id: int):
+    async with get_aconn() as conn:
+        await conn.run("banned.delete", (tg_id,))
+    ban_registry.remove([tg_id])
+
+async def register_failed_attempt(tg_id: int) -> int:
+    now = datetime.now(TZ).isoformat(timespec="seconds")
+    async with get_aconn() as conn:
+        row = await conn.run_one("attempts.count", (tg_id,))
+        count = (row[0] if row else 0) + 1
+        await conn.run("attempts.upsert", (tg_id, count, now))
+    return count
+
+async def reset_failed_attempts(tg_id: int):
+    async with get_aconn() as conn:
+        await conn.run("attempts.delete", (tg_id,))
+
+
+# ---------- пользователи ----------
+async def ensure_user_by_surname_room(surname: str, room: str) -> int:
+    """Возвращает id пользователя. Если его нет — создаёт 'стаб' с фиктивным tg_id."""
+    async with get_aconn() as conn:
+        row = await conn.run_one("users.id_by_surname_room", (_b64e(surname), _b64e(room)))
+        if row:
+            return row[0]
+        tg_stub = _stub_tg_id(surname, room)
+        await conn.run("users.insert", (tg_stub, _b64e(surname), _b64e(room)))
+        row = await conn.run_one("users.id_by_tg", (tg_stub,))
+        return row[0]
+
+async def bind_stub_user_to_real(tg_id, surname, room) -> list[tuple]:
+    async with get_aconn() as conn, conn.transaction():
+        stub = await conn.run_one("users.stub_by_surname_room", (_b64e(surname), _b64e(room)))
+        if not stub: return []
+        stub_id = stub[0]
+
+        await conn.run("users.upsert_profile", (tg_id, _b64e(surname), _b64e(room)))
+
+        real_id = (await conn.run_one("users.id_by_tg", (tg_id,)))[0]
+        dropped = await conn.run_all("users.drop_stub_conflicts", (stub_id, real_id))
+        await conn.run("users.move_bookings", (real_id, stub_id))
+        await conn.run("users.delete", (stub_id,))
+    _user_cache_drop(tg_id)
+    return _note_stub_conflicts(tg_id, dropped)
+
+async def add_user(tg_id, surname, room):
+    async with get_aconn() as conn:
+        await conn.run("users.insert_ignore", (tg_id, _b64e(surname), _b64e(room)))
+    _user_cache_drop(tg_id)
+
+async def save_user(tg_id, surname, room) -> list[tuple]:
+    dropped = await bind_stub_user_to_real(tg_id, surname, room)
+    async with get_aconn() as conn:
+        await conn.run("users.upsert_profile", (tg_id, _b64e(surname), _b64e(room)))
+    _user_cache_drop(tg_id)
+    return dropped
+
+async def update_username(tg_id: int, username: str | None):
+    """Без записи в БД: в очередь flush_usernames (или пропуск, если не поменялся)."""
+    _queue_username(tg_id, username)
+
+async def tg_id_by_username(username: str) -> int | None:
+    u = username.lstrip("@")
+    pending = _pending_tg_by_username(u)
+    if pending is not None:
+        return pending
+    async with get_aconn() as conn:
+        row = await conn.run_one("users.tg_by_username", (u,))
+        return row[0] if row else None
+
+async def get_user(tg_id):
+    found, user, generation = _user_cache_get(tg_id)
+    if found:
+        return user
+    async with get_aconn() as conn:
+        row = await conn.run_one("users.get", (tg_id,))
+    if row:
+        _note_username(tg_id, row[4])
+    user = _user_row(row)
+    _user_cache_put(tg_id, user, generation)
+    return user
+
+async def get_incomplete_users():
+    """Пользователи без фамилии или комнаты."""
+    async with get_aconn() as conn:
+        return await conn.run_all("users.incomplete")
+
+
+# ---------- бронирования ----------
+async def get_user_bookings_today(user_id, date_iso, machine_type):
+    async with get_aconn() as conn:
+        row = await conn.run_one("bookings.user_has_type", (user_id, date_iso, machine_type))
+    return bool(row)
+
+async def get_user_booking_exact(user_id: int, machine_id: int, date_iso: str, hour: int) -> bool:
+    async with get_aconn() as conn:
+        row = await conn.run_one("bookings.exact", (user_id, machine_id, date_iso, hour))
+    return bool(row)
+
+async def busy_masks(date_iso: str) -> dict[int, int]:
+    """{machine_id: маска занятых часов} на дату; из БД — только при первом обращении."""
+    masks, token = occupancy.lookup(date_iso)
+    if masks is not None:
+        return masks
+    async with get_aconn() as conn:
+        rows = await conn.run_all("bookings.busy_by_date", (date_iso,))
+    return occupancy.load_date(date_iso, rows, token)
+
+async def get_free_hours(machine_id, date_iso):
+    busy = (await busy_masks(date_iso)).get(int(machine_id), 0)
+    return occupancy.mask_to_hours(occupancy.ALL_HOURS & ~busy)
+
+async def availability_summary(start_date, days: int) -> dict[str, dict[str, int]]:
+    """Свободные слоты по датам и типам машин (см. database.availability_summary)."""
+    now = datetime.now(TZ)
+    async with get_aconn() as conn:
+        rows = await conn.run_all(
+            "bookings.availability", _availability_params(start_date, days, now)
+        )
+    return _summarize_availability(rows, start_date, days, now)
+
+async def create_booking(user_id, machine_id, date_iso, hour) -> int | None:
+    async with get_aconn() as conn:
+        row = await conn.run_one("bookings.insert", (user_id, date_iso, hour, machine_id))
+    if row:
+        occupancy.mark_busy(date_iso, machine_id, hour)
+    return row[0] if row else None
+
+async def delete_booking(booking_id: int) -> tuple | None:
+    async with get_aconn() as conn:
+        row = await conn.run_one("bookings.delete", (booking_id,))
+    if row:
+        occupancy.mark_free(str(row[1]), row[0], row[2])
+    return row
+
+async def book_slot(
+    tg_id: int, machine_id: int, date_iso: str, hour: int, machine_type: str | None = None
+) -> BookingResult:
+    """Атомарная запись на слот (см. database.book_slot)."""
+    async with get_aconn() as conn:
+        row = await conn.run_one(
+            "bookings.book", _booking_params(tg_id, machine_id, date_iso, hour, machine_type)
+        )
+        if not row:
+            refusal = await conn.run_one(
+                "bookings.book_refusal",
+                (tg_id, date_iso, hour, date_iso, tg_id, machine_id),
+            )
+    if row:
+        res = _booked(row)
+    else:
+        res = _classify_refusal(refusal, machine_type)
+    _note_booking_result(res, machine_id, date_iso, hour)
+    return res
+
+async def cleanup_old_bookings():
+    today = datetime.now(TZ).date()
+    cutoff = today - timedelta(days=1)
+    async with get_aconn() as conn:
+        await conn.run("bookings.delete_before", (cutoff.isoformat(),))
+        await conn.run("reminders.delete_before", (cutoff.isoformat(),))
+    occupancy.drop_before(cutoff.isoformat())
+
+
+# ---------- антидубли напоминаний ----------
+async def was_reminder_sent(
+    tg_id: int, machine_id: int, date_iso: str, hour: int, minutes_before: int
+) -> bool:
+    async with get_aconn() as conn:
+        row = await conn.run_one(
+            "reminders.was_sent", (tg_id, machine_id, date_iso, hour, minutes_before)
+        )
+    return bool(row)
+
+async def mark_reminder_sent(
+    tg_id: int, machine_id: int, date_iso: str, hour: int, minutes_before: int
+) -> None:
+    async with get_aconn() as conn:
+        await conn.run("reminders.mark_sent", (tg_id, machine_id, date_iso, hour, minutes_before))
+
+
+async def reminder_plan(
+    date_iso: str, hour: int, minutes_before: int,
+    tg_id: int | None = None, machine_id: int | None = None,
+) -> list[ReminderPlan]:
+    key, params = _reminder_plan_query(date_iso, hour, minutes_before, tg_id, machine_id)
+    async with get_aconn() as conn:
+        return _reminder_plans(await conn.run_all(key, params))
@@ -0,0 +1,113 @@
+# db_executor.py
+"""
+Мост sync → async для database.py: run_db(fn, *args) отправляет вызов
+синхронной функции БД в отдельный ограниченный пул потоков, чтобы SQL
+не выполнялся в потоке event loop.
+
+Размер пула равен синхронному пулу Postgres (PG_SYNC_POOL_MAX): больше потоков
+всё равно упрутся в ожидание коннекта. Для SQLite — DB_EXECUTOR_WORKERS.
+"""
+import os
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from database import DATABASE_URL, PG_SYNC_POOL_MAX
+from db_warmth import note_db_ok
+
+DB_EXECUTOR_WORKERS = (
+    PG_SYNC_POOL_MAX if DATABASE_URL else int(os.getenv("DB_EXECUTOR_WORKERS", "4"))
+)
+SLOW_WAIT_SEC = 0.5  # ожидание в очереди дольше этого — повод задуматься о размере пула
+
+_executor = ThreadPoolExecutor(
+    max_workers=DB_EXECUTOR_WORKERS,
+    thread_name_prefix="db",
+)
+
+_lock = threading.Lock()
+_queued = 0          # задач ждут свободный поток прямо сейчас
+_max_queued = 0      # пик очереди с момента старта
+_slow_waits = 0      # сколько раз ожидание превысило SLOW_WAIT_SEC
+_per_fn: dict[str, dict[str, float]] = {}
+
+
+def _enter_queue():
+    global _queued, _max_queued
+    with _lock:
+        _queued += 1
+        if _queued > _max_queued:
+            _max_queued = _queued
+
+
+def _leave_queue(state: dict):
+    global _queued
+    with _lock:
+        if state["left"]:
+            return
+        state["left"] = True
+        _queued -= 1
+
+
+def _record(name: str, wait: float, run: float, failed: bool):
+    global _slow_waits
+    with _lock:
+        st = _per_fn.get(name)
+        if st is None:
+            st = _per_fn[name] = {
+                "calls": 0, "errors": 0,
+                "wait_total": 0.0, "wait_max": 0.0,
+                "run_total": 0.0, "run_max": 0.0,
+            }
+        st["calls"] += 1
+        st["errors"] += int(failed)
+        st["wait_total"] += wait
+        st["wait_max"] = max(st["wait_max"], wait)
+        st["run_total"] += run
+        st["run_max"] = max(st["run_max"], run)
+        if wait > SLOW_WAIT_SEC:
+            _slow_waits += 1
+
+
+async def run_db(fn, *args, **kwargs):
+    """Выполнить синхронную функцию БД в пуле потоков и дождаться результата."""
+    loop = asyncio.get_running_loop()
+    name = getattr(fn, "__name__", repr(fn))
+    submitted = time.perf_counter()
+    state = {"left": False}
+    _enter_queue()
+
+    def _call():
+        started = time.perf_counter()
+        _leave_queue(state)
+        failed = True
+        try:
+            result = fn(*args, **kwargs)
+            failed = False
+            note_db_ok()
+            return result
+        finally:
+            _record(name, started - submitted, time.perf_counter() - started, failed)
+
+    try:
+        return await loop.run_in_executor(_executor, _call)
+    finally:
+        # задачу отменили, пока она стояла в очереди — _call так и не стартовал
+        _leave_queue(state)
+
+
+def db_executor_stats() -> dict:
+    """Снимок метрик: глубина очереди, ожидание и время выполнения по функциям."""
+    with _lock:
+        return {
+            "workers": DB_EXECUTOR_WORKERS,
+            "queued": _queued,
+            "max_queued": _max_queued,
+            "slow_waits": _slow_waits,
+            "per_fn": {name: dict(st) for name, st in _per_fn.items()},
+        }
+
+
+def shutdown_db_executor():
+    _executor.shutdown(wait=False, cancel_futures=True)
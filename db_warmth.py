@@ -0,0 +1,118 @@
+# db_warmth.py
+"""
+Следим, «тёплая» ли сейчас база Neon, и будим её заранее.
+
+Neon усыпляет compute после нескольких минут без запросов, и первый
+запрос после сна падает с DBUnavailable. Здесь:
+  - note_db_ok() отмечает каждый успешный поход в БД (вызывают run_db и database_async);
+  - db_state() → "warm" / "waking" / "cold";
+  - wake() запускает дешёвый пинг SELECT 1 с повторами и возвращает future;
+  - wait_warm() даёт хендлеру несколько секунд подождать пробуждения вместо ошибки;
+  - prewake_if_needed() вызывается планировщиком раз в минуту и будит базу
+    перед началом WORKING_HOURS и перед ближайшими напоминаниями.
+
+На SQLite всё это ничего не делает: база всегда «тёплая».
+"""
+import os
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+from config import WORKING_HOURS
+from database import DATABASE_URL, DBUnavailable
+
+NEON_SUSPEND_SEC = float(os.getenv("NEON_SUSPEND_SEC", "300"))  # через сколько Neon засыпает
+WAKE_TIMEOUT_SEC = float(os.getenv("DB_WAKE_TIMEOUT_SEC", "20"))  # сколько пытаемся разбудить
+WAKE_WAIT_SEC = float(os.getenv("DB_WAKE_WAIT_SEC", "8"))         # сколько ждёт хендлер
+PREWAKE_LEAD_MIN = int(os.getenv("DB_PREWAKE_LEAD_MIN", "3"))     # за сколько минут будить
+
+_last_ok = 0.0                      # time.monotonic() последнего успешного запроса
+_wake_task: asyncio.Task | None = None
+_stats = {"wakes": 0, "wake_failures": 0, "prewakes": 0}
+
+
+def note_db_ok():
+    """Запрос к БД прошёл — значит, она сейчас не спит."""
+    global _last_ok
+    _last_ok = time.monotonic()
+
+
+def db_state() -> str:
+    if not DATABASE_URL:
+        return "warm"
+    if _wake_task is not None and not _wake_task.done():
+        return "waking"
+    if _last_ok and time.monotonic() - _last_ok < NEON_SUSPEND_SEC:
+        return "warm"
+    return "cold"
+
+
+async def _ping():
+    from database_async import get_aconn  # локально: database_async сам зовёт note_db_ok
+
+    async with get_aconn() as conn:
+        await conn.fetchone("SELECT 1")
+
+
+async def _wake_loop() -> bool:
+    deadline = time.monotonic() + WAKE_TIMEOUT_SEC
+    delay = 0.5
+    while True:
+        try:
+            await _ping()
+            note_db_ok()
+            return True
+        except DBUnavailable:
+            if time.monotonic() + delay > deadline:
+                _stats["wake_failures"] += 1
+                return False
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 4)
+
+
+def wake() -> asyncio.Future:
+    """Запустить пробуждение (если уже идёт — вернуть текущее). Результат: проснулась ли база."""
+    global _wake_task
+    if _wake_task is None or _wake_task.done():
+        if db_state() == "warm":
+            fut = asyncio.get_running_loop().create_future()
+            fut.set_result(True)
+            return fut
+        _stats["wakes"] += 1
+        _wake_task = asyncio.create_task(_wake_loop())
+    return _wake_task
+
+
+async def wait_warm(timeout: float = WAKE_WAIT_SEC) -> bool:
+    """Подождать пробуждения базы не дольше timeout. True — можно повторять запрос."""
+    if not DATABASE_URL:
+        return False  # на SQLite DBUnavailable не от сна, ждать нечего
+    try:
+        # shield: таймаут хендлера не должен отменять общий пинг
+        return await asyncio.wait_for(asyncio.shield(wake()), timeout)
+    except asyncio.TimeoutError:
+        return False
+
+
+def _demand_soon(now: datetime, upcoming: list[datetime]) -> bool:
+    lead = timedelta(minutes=PREWAKE_LEAD_MIN)
+    # открытие рабочего окна: первые записи и /book с утра
+    opening = now.replace(hour=WORKING_HOURS[0], minute=0, second=0, microsecond=0)
+    if opening - lead <= now < opening:
+        return True
+    # ближайшие напоминания: send_reminder сразу идёт в БД
+    return any(now <= run_at <= now + lead for run_at in upcoming)
+
+
+async def prewake_if_needed(now: datetime, upcoming: list[datetime]):
+    """Задача планировщика: разбудить базу, если скоро будет спрос, а она спит."""
+    if not DATABASE_URL or db_state() != "cold":
+        return
+    if _demand_soon(now, upcoming):
+        _stats["prewakes"] += 1
+        await wake()
+
+
+def warmth_stats() -> dict:
+    idle = time.monotonic() - _last_ok if _last_ok else None
+    return {"state": db_state(), "idle_sec": idle, **_stats}
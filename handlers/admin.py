@@ -5,7 +5,7 @@ from datetime import datetime, timedelta
 
 import pandas as pd
 from openpyxl import Workbook
-from aiogram import Router, F, types, Bot
+from aiogram import Router, F, types, Bot, BaseMiddleware
 from aiogram.filters import Command
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
@@ -15,35 +15,74 @@ from aiogram.exceptions import TelegramRetryAfter
 # from aiogram.utils.exceptions import RetryAfter as TelegramRetryAfter)
 
 from database import (
-    get_conn, _b64d_try, init_db,
+    get_conn, _b64d_try,
     ensure_user_by_surname_room, get_machine_id_by_name, create_booking,
     ban_user, unban_user, tg_id_by_username,
-    get_user_bookings_today, get_free_hours, is_admin, get_incomplete_users,
-    set_machine_active, get_all_machines,
+    get_user_bookings_today, is_admin, get_incomplete_users,
+    set_machine_active, get_all_machines, db_pool_stats, user_cache_stats,
+    username_stats,
+    get_machine, machine_catalog_snapshot,
+    delete_booking as delete_booking_by_id,
 )
-from config import ADMIN_IDS
+from db_executor import run_db, db_executor_stats
+from db_warmth import warmth_stats
+import ban_registry
+import api_metrics
+from callback_ack import ack, flush as flush_ack
 
 from zoneinfo import ZoneInfo
 from config import TIMEZONE
 from aiogram.types import FSInputFile  # для экспорта
-from scheduler import schedule_test_message
+from scheduler import (
+    schedule_test_message, reminder_stats,
+    cancel_reminder, cancel_user_reminders, cancel_machine_reminders, resync_reminders,
+)
+from handlers.booking import render_cache_stats
 
 TZ = ZoneInfo(TIMEZONE)
 
 router = Router()
 
 
-async def _render_schedule(message: types.Message, date: str):
+class AdminOnly(BaseMiddleware):
+    """Всё, что поймали фильтры этого роутера, — только для админов; остальным отказ до хендлера."""
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is not None and is_admin(user.id):
+            return await handler(event, data)
+        if isinstance(event, types.CallbackQuery):
+            return await ack(event, "🚫 Нет доступа.", show_alert=True)
+        return await event.answer("🚫 Нет прав администратора.")
+
+
+router.message.middleware(AdminOnly())
+router.callback_query.middleware(AdminOnly())
+
+
+def _schedule_rows(date: str):
     with get_conn() as conn:
-        cur = conn.execute("""
+        return conn.execute("""
             SELECT b.id, m.name, b.hour, u.surname, u.room, u.tg_id, u.username
             FROM bookings b
             JOIN machines m ON b.machine_id = m.id
             JOIN users u ON b.user_id = u.id
             WHERE b.date = ?
             ORDER BY m.name, b.hour
-        """, (date,))
-        records = cur.fetchall()
+        """, (date,)).fetchall()
+
+
+def _banned_rows():
+    with get_conn() as conn:
+        return conn.execute("""
+            SELECT tg_id, reason, banned_until, banned_at
+            FROM banned
+            ORDER BY banned_at DESC
+        """).fetchall()
+
+
+async def _render_schedule(message: types.Message, date: str):
+    records = await run_db(_schedule_rows, date)
 
     if not records:
         return await message.edit_text(f"📅 {date}: записей нет.")
@@ -106,8 +145,10 @@ def import_bookings_from_xlsx(path: str) -> tuple[int, int, list[str]]:
                 continue
 
             try:
-                create_booking(uid, mid, date_iso, hour)
-                inserted += 1
+                if create_booking(uid, mid, date_iso, hour):
+                    inserted += 1
+                else:
+                    skipped += 1  # слот занят или у жильца уже есть запись на этот тип
             except Exception:
                 skipped += 1
         except Exception as e:
@@ -119,22 +160,16 @@ def import_bookings_from_xlsx(path: str) -> tuple[int, int, list[str]]:
 
 @router.message(Command("import"))
 async def cmd_import(msg: types.Message):
-    if not is_admin(msg.from_user.id):
-        return await msg.answer("🚫 Нет прав администратора.")
     await msg.answer("📥 Пришлите Excel-файл (.xlsx) с записями для импорта.")
 
 
 @router.message(F.document & (F.document.mime_type == "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"))
 async def handle_xlsx(msg: types.Message, bot: Bot):
-    if not is_admin(msg.from_user.id):
-        return await msg.answer("🚫 Нет прав администратора.")
-
     f = await bot.get_file(msg.document.file_id)
     path = f"/tmp/{msg.document.file_unique_id}.xlsx"
     await bot.download_file(f.file_path, path)
 
-    init_db()
-    added, skipped, errors = import_bookings_from_xlsx(path)
+    added, skipped, errors = await run_db(import_bookings_from_xlsx, path)
 
     text = f"✅ Импорт завершён.\nДобавлено: {added}\nПропущено: {skipped}"
     if errors:
@@ -146,9 +181,6 @@ async def handle_xlsx(msg: types.Message, bot: Bot):
 @router.message(Command("admin"))
 @router.message(F.text == "/admin")
 async def admin_panel(msg: types.Message):
-    if not is_admin(msg.from_user.id):
-        return await msg.answer("🚫 У вас нет прав администратора.")
-
     kb = InlineKeyboardMarkup(inline_keyboard=[
         [
             InlineKeyboardButton(text="📅 Расписание", callback_data="admin_menu_schedule"),
@@ -169,9 +201,7 @@ async def admin_panel(msg: types.Message):
 # === Расписание ===
 @router.callback_query(F.data == "admin_menu_schedule")
 async def open_schedule(callback: types.CallbackQuery):
-    await callback.answer()  # ← ранний ACK
-    if not is_admin(callback.from_user.id):
-        return await callback.answer("🚫 Нет доступа.", show_alert=True)
+    await ack(callback)  # ← ранний ACK
 
     today = datetime.now(TZ).date()  # ← локальная дата
     kb = InlineKeyboardMarkup(inline_keyboard=[
@@ -191,25 +221,27 @@ async def open_schedule(callback: types.CallbackQuery):
 # === Статистика ===
 @router.callback_query(F.data == "admin_menu_stats")
 async def show_stats(callback: types.CallbackQuery):
-    await callback.answer()  # ← ACK
-    if not is_admin(callback.from_user.id):
-        return await callback.answer("🚫 Нет доступа.", show_alert=True)
+    await ack(callback)  # ← ACK
 
     today = datetime.now(TZ).date()       # ← TZ
     week_end = today + timedelta(days=6)
 
-    with get_conn() as conn:
-        total = conn.execute(
-            "SELECT COUNT(*) FROM bookings WHERE date BETWEEN ? AND ?",
-            (today.isoformat(), week_end.isoformat())
-        ).fetchone()[0]
+    def _week_stats():
+        with get_conn() as conn:
+            total = conn.execute(
+                "SELECT COUNT(*) FROM bookings WHERE date BETWEEN ? AND ?",
+                (today.isoformat(), week_end.isoformat())
+            ).fetchone()[0]
 
-        by_type = conn.execute("""
-            SELECT m.type, COUNT(*) FROM bookings b
-            JOIN machines m ON b.machine_id = m.id
-            WHERE b.date BETWEEN ? AND ?
-            GROUP BY m.type
-        """, (today.isoformat(), week_end.isoformat())).fetchall()
+            by_type = conn.execute("""
+                SELECT m.type, COUNT(*) FROM bookings b
+                JOIN machines m ON b.machine_id = m.id
+                WHERE b.date BETWEEN ? AND ?
+                GROUP BY m.type
+            """, (today.isoformat(), week_end.isoformat())).fetchall()
+        return total, by_type
+
+    total, by_type = await run_db(_week_stats)
 
     text = (
         f"📊 <b>Статистика на неделю ({today.strftime('%d.%m')} – {week_end.strftime('%d.%m')})</b>\n\n"
@@ -226,13 +258,11 @@ async def show_stats(callback: types.CallbackQuery):
 # === Просмотр расписания по дню ===
 @router.callback_query(F.data.startswith("admin_day_"))
 async def show_admin_schedule(callback: types.CallbackQuery):
-    await callback.answer()  # ← ACK
-    if not is_admin(callback.from_user.id):
-        return await callback.answer("🚫 Нет доступа.", show_alert=True)
+    await ack(callback)  # ← ACK
 
     parts = callback.data.split("_", 2)
     if len(parts) < 3:
-        return await callback.answer("Некорректные данные даты.", show_alert=True)
+        return await ack(callback, "Некорректные данные даты.", show_alert=True)
     date = parts[2]
     await _render_schedule(callback.message, date)
 
@@ -240,39 +270,35 @@ async def show_admin_schedule(callback: types.CallbackQuery):
 # === Удаление конкретной записи ===
 @router.callback_query(F.data.startswith("admin_del_"))
 async def delete_booking(callback: types.CallbackQuery):
-    await callback.answer()  # ← ACK
-    if not is_admin(callback.from_user.id):
-        return await callback.answer("🚫 Нет доступа.", show_alert=True)
+    await ack(callback)  # ← ACK
 
     parts = callback.data.split("_", 3)
     if len(parts) < 4:
-        return await callback.answer("Ошибка данных.", show_alert=True)
+        return await ack(callback, "Ошибка данных.", show_alert=True)
     _, _, booking_id, date = parts
     try:
         booking_id = int(booking_id)
     except ValueError:
-        return await callback.answer("Неверный ID записи.", show_alert=True)
-
-    with get_conn() as conn:
-        conn.execute("DELETE FROM bookings WHERE id=?", (booking_id,))
+        return await ack(callback, "Неверный ID записи.", show_alert=True)
 
+    if await run_db(delete_booking_by_id, booking_id):
+        await cancel_reminder(booking_id)
     await _render_schedule(callback.message, date)
 
 
 # === Бан пользователя ===
 @router.callback_query(F.data.startswith("admin_ban_"))
 async def admin_ban_user(callback: types.CallbackQuery):
-    await callback.answer()  # ← ACK
-    if not is_admin(callback.from_user.id):
-        return await callback.answer("🚫 Нет доступа.", show_alert=True)
+    await ack(callback)  # ← ACK
 
     try:
         _, _, tg_id_str, date = callback.data.split("_", 3)
         tg_id = int(tg_id_str)
     except Exception:
-        return await callback.answer("Ошибка данных бан-кнопки.", show_alert=True)
+        return await ack(callback, "Ошибка данных бан-кнопки.", show_alert=True)
 
-    ban_user(tg_id, reason="Бан из админ-панели", days=7)
+    await run_db(ban_user, tg_id, reason="Бан из админ-панели", days=7)
+    await cancel_user_reminders(tg_id)
     await _render_schedule(callback.message, date)
 
 
@@ -282,18 +308,12 @@ async def admin_ban_user(callback: types.CallbackQuery):
 @router.callback_query(F.data == "admin_menu_export")
 async def export_bookings(event: types.Message | types.CallbackQuery):
     if isinstance(event, types.CallbackQuery):
-        await event.answer()  # ← ACK
-        user_id = event.from_user.id
+        await ack(event)  # ← ACK
+        await flush_ack()  # выгрузка долгая: «часики» на кнопке не держим до конца
         msg = event.message
     else:
-        user_id = event.from_user.id
         msg = event
 
-    if not is_admin(user_id):
-        if isinstance(event, types.CallbackQuery):
-            return await event.answer("🚫 Нет доступа.", show_alert=True)
-        return await msg.answer("🚫 Нет доступа.")
-
     await msg.answer("📤 Формирую таблицу...")
 
     wb = Workbook()
@@ -301,15 +321,17 @@ async def export_bookings(event: types.Message | types.CallbackQuery):
     ws.title = "Bookings"
     ws.append(["ID", "Дата", "Час", "Машина", "Тип", "Фамилия", "Комната"])
 
-    with get_conn() as conn:
-        cur = conn.execute("""
-            SELECT b.id, b.date, b.hour, m.name, m.type, u.surname, u.room
-            FROM bookings b
-            JOIN machines m ON b.machine_id = m.id
-            JOIN users u ON b.user_id = u.id
-            ORDER BY b.date, b.hour
-        """)
-        rows = cur.fetchall()
+    def _export_rows():
+        with get_conn() as conn:
+            return conn.execute("""
+                SELECT b.id, b.date, b.hour, m.name, m.type, u.surname, u.room
+                FROM bookings b
+                JOIN machines m ON b.machine_id = m.id
+                JOIN users u ON b.user_id = u.id
+                ORDER BY b.date, b.hour
+            """).fetchall()
+
+    rows = await run_db(_export_rows)
 
     if not rows:
         return await msg.answer("Нет данных для экспорта.")
@@ -325,7 +347,7 @@ async def export_bookings(event: types.Message | types.CallbackQuery):
 
     # вместо локального имени — безопаснее в /tmp
     fname = f"/tmp/bookings_{datetime.now(TZ).strftime('%Y-%m-%d_%H-%M-%S')}.xlsx"
-    wb.save(fname)
+    await run_db(wb.save, fname)
     await msg.answer_document(FSInputFile(fname), caption="📊 Экспорт всех записей")
     try:
         os.remove(fname)
@@ -334,15 +356,7 @@ async def export_bookings(event: types.Message | types.CallbackQuery):
 
 @router.message(Command("banned"))
 async def list_banned(msg: types.Message):
-    if not is_admin(msg.from_user.id):
-        return await msg.answer("🚫 Нет доступа.")
-
-    with get_conn() as conn:
-        rows = conn.execute("""
-            SELECT tg_id, reason, banned_until, banned_at
-            FROM banned
-            ORDER BY banned_at DESC
-        """).fetchall()
+    rows = await run_db(_banned_rows)
 
     if not rows:
         return await msg.answer("✅ Никто не забанен.")
@@ -362,25 +376,19 @@ async def list_banned(msg: types.Message):
 
 @router.callback_query(F.data.startswith("unban_"))
 async def cb_unban(callback: types.CallbackQuery):
-    await callback.answer()  # ← ACK
-    if not is_admin(callback.from_user.id):
-        return await callback.answer("🚫 Нет доступа.", show_alert=True)
+    await ack(callback)  # ← ACK
 
     try:
         tg_id = int(callback.data.split("_", 1)[1])
     except Exception:
-        return await callback.answer("Ошибка данных.", show_alert=True)
+        return await ack(callback, "Ошибка данных.", show_alert=True)
 
-    unban_user(tg_id)
-    await callback.answer("✅ Пользователь разбанен.", show_alert=True)
+    await run_db(unban_user, tg_id)
+    await resync_reminders()
+    await ack(callback, "✅ Пользователь разбанен.", show_alert=True)
 
     # Обновим список на экране
-    with get_conn() as conn:
-        rows = conn.execute("""
-            SELECT tg_id, reason, banned_until, banned_at
-            FROM banned
-            ORDER BY banned_at DESC
-        """).fetchall()
+    rows = await run_db(_banned_rows)
 
     if not rows:
         return await callback.message.edit_text("✅ Никто не забанен.")
@@ -400,8 +408,6 @@ async def cb_unban(callback: types.CallbackQuery):
 
 @router.message(Command("unban"))
 async def cmd_unban(msg: types.Message):
-    if not is_admin(msg.from_user.id):
-        return await msg.answer("🚫 Нет доступа.")
     parts = msg.text.strip().split(maxsplit=1)
     if len(parts) < 2:
         return await msg.answer("Формат: /unban <tg_id>")
@@ -409,16 +415,14 @@ async def cmd_unban(msg: types.Message):
         tg_id = int(parts[1])
     except ValueError:
         return await msg.answer("tg_id должен быть числом.")
-    unban_user(tg_id)
+    await run_db(unban_user, tg_id)
+    await resync_reminders()
     await msg.answer("✅ Разбанено.")
 
 
 
 @router.message(Command("ban"))
 async def cmd_ban(msg: types.Message):
-    if not is_admin(msg.from_user.id):
-        return await msg.answer("🚫 Нет прав администратора.")
-
     text = (msg.text or "").strip()
     parts = text.split(maxsplit=1)
     args = parts[1] if len(parts) > 1 else ""
@@ -446,7 +450,7 @@ async def cmd_ban(msg: types.Message):
 
         # @username
         if first.startswith("@"):
-            target_id = tg_id_by_username(first)
+            target_id = await run_db(tg_id_by_username, first)
             if not target_id:
                 return await msg.answer("❗ Не нашёл такого username среди пользователей бота.")
             a = a[1:]
@@ -465,7 +469,8 @@ async def cmd_ban(msg: types.Message):
             reason = " ".join(a)
 
     # Финальный бан
-    ban_user(int(target_id), reason=reason, days=days)
+    await run_db(ban_user, int(target_id), reason=reason, days=days)
+    await cancel_user_reminders(int(target_id))
     await msg.answer(f"🚫 Забанен: <code>{target_id}</code> на {days} дн.\nПричина: {reason}", parse_mode="HTML")
 
 @router.message(Command("abookfio"))
@@ -474,8 +479,6 @@ async def cmd_abookfio(msg: types.Message):
     Формат: /abookfio <Фамилия> <Комната> <machine_id> <YYYY-MM-DD> <HH> [коммент]
     Пример: /abookfio Иванов 412 3 2025-11-14 19 после пары
     """
-    if not is_admin(msg.from_user.id):
-        return await msg.answer("🚫 Нет прав администратора.")
 
     parts = (msg.text or "").strip().split(maxsplit=6)  # до 7 токенов
     if len(parts) < 6:
@@ -498,28 +501,21 @@ async def cmd_abookfio(msg: types.Message):
         return await msg.answer("Проверьте аргументы: machine_id — число, час 0–23, дата — YYYY-MM-DD.")
 
     # найдём/создадим пользователя по Фамилии и Комнате (вернётся users.id)
-    user_id = ensure_user_by_surname_room(surname, room)
+    user_id = await run_db(ensure_user_by_surname_room, surname, room)
 
     # узнаём тип и имя машины
-    with get_conn() as conn:
-        row = conn.execute("SELECT type, name FROM machines WHERE id=?", (machine_id,)).fetchone()
-    if not row:
+    machine = await run_db(get_machine, machine_id)
+    if not machine:
         return await msg.answer("Машина не найдена.")
-    machine_type, machine_name = row
-
-    # ограничение: 1 запись на тип в сутки
-    if get_user_bookings_today(user_id, date_iso, machine_type):
-        t = "стиралку" if machine_type == "wash" else "сушилку"
-        return await msg.answer(f"⚠️ У пользователя уже есть запись на {t} в этот день.")
+    machine_type, machine_name = machine.type, machine.name
 
-    # слот свободен?
-    free = get_free_hours(machine_id, date_iso)
-    if hour not in free:
+    # создаём запись; занятый слот и лимит «1 тип в сутки» отсекают уникальные ключи БД
+    if not await run_db(create_booking, user_id, machine_id, date_iso, hour):
+        if await run_db(get_user_bookings_today, user_id, date_iso, machine_type):
+            t = "стиралку" if machine_type == "wash" else "сушилку"
+            return await msg.answer(f"⚠️ У пользователя уже есть запись на {t} в этот день.")
         return await msg.answer("Этот час уже занят. Выберите другой.")
 
-    # создаём запись
-    create_booking(user_id, machine_id, date_iso, hour)
-
     # ответ админу
     text = (f"✅ Запись создана:\n"
             f"{machine_name} • {date_iso} {hour:02d}:00\n"
@@ -528,11 +524,10 @@ async def cmd_abookfio(msg: types.Message):
         text += f"\nКомментарий: {comment}"
     await msg.answer(text)
 
-def _machines_admin_view():
+def _machines_admin_view(rows):
     """
-    Текст + клавиатура для управления машинами.
+    Текст + клавиатура для управления машинами (rows — из get_all_machines()).
     """
-    rows = get_all_machines()
     if not rows:
         return "Машины не настроены.", None
 
@@ -557,31 +552,30 @@ def _machines_admin_view():
 
 @router.message(Command("machines"))
 async def cmd_machines(msg: types.Message):
-    if not is_admin(msg.from_user.id):
-        return await msg.answer("🚫 Нет прав администратора.")
-
-    text, kb = _machines_admin_view()
+    text, kb = _machines_admin_view(await run_db(get_all_machines))
     if kb is None:
         return await msg.answer(text)
     await msg.answer(text, reply_markup=kb)
 
 @router.callback_query(F.data.startswith("admin_mtoggle_"))
 async def admin_toggle_machine(callback: types.CallbackQuery):
-    await callback.answer()
-    if not is_admin(callback.from_user.id):
-        return await callback.answer("🚫 Нет доступа.", show_alert=True)
+    await ack(callback)
 
     try:
         _, _, mid_str, active_str = callback.data.split("_", 3)
         mid = int(mid_str)
         new_active = bool(int(active_str))   # 1 → включить, 0 → выключить
     except Exception:
-        return await callback.answer("Некорректные данные кнопки.", show_alert=True)
+        return await ack(callback, "Некорректные данные кнопки.", show_alert=True)
 
-    set_machine_active(mid, new_active)
+    await run_db(set_machine_active, mid, new_active)
+    if new_active:
+        await resync_reminders()
+    else:
+        await cancel_machine_reminders(mid)
 
     # перерисовываем список
-    text, kb = _machines_admin_view()
+    text, kb = _machines_admin_view(await run_db(get_all_machines))
     try:
         await callback.message.edit_text(text, reply_markup=kb)
     except Exception:
@@ -591,10 +585,7 @@ async def admin_toggle_machine(callback: types.CallbackQuery):
 
 @router.message(Command("notify_incomplete"))
 async def notify_incomplete(message: types.Message):
-    if not is_admin(message.from_user.id):
-        return await message.answer("🚫 Нет доступа.")
-
-    users = get_incomplete_users()
+    users = await run_db(get_incomplete_users)
     if not users:
         return await message.answer("Все пользователи уже заполнили профиль ✅")
 
@@ -633,8 +624,6 @@ async def notify_incomplete(message: types.Message):
 
 @router.message(Command("test_reminder"))
 async def cmd_test_reminder(msg: types.Message):
-    if not is_admin(msg.from_user.id):
-        return await msg.answer("🚫 Нет доступа.")
     parts = (msg.text or "").split()
     minutes = 1
     if len(parts) > 1:
@@ -653,16 +642,9 @@ async def cmd_test_reminder(msg: types.Message):
 
 @router.message(Command("laundry_news"))
 async def cmd_laundry_news(message: types.Message):
-    if not is_admin(message.from_user.id):
-        return await message.answer("🚫 Нет доступа.")
-
-    with get_conn() as conn:
-        wash = [name for (name,) in conn.execute(
-            "SELECT name FROM machines WHERE type='wash' AND is_active ORDER BY name"
-        ).fetchall()]
-        dry = [name for (name,) in conn.execute(
-            "SELECT name FROM machines WHERE type='dry' AND is_active ORDER BY name"
-        ).fetchall()]
+    catalog = await run_db(machine_catalog_snapshot)
+    wash = [m.name for m in catalog.active("wash")]
+    dry = [m.name for m in catalog.active("dry")]
 
     def _short(names):
         # превращаем 'Стиральная №3' → '№3', 'Сушилка №2' → '№2'
@@ -683,8 +665,11 @@ async def cmd_laundry_news(message: types.Message):
     )
 
     # берём всех пользователей бота
-    with get_conn() as conn:
-        rows = conn.execute("SELECT tg_id FROM users").fetchall()
+    def _all_tg_ids():
+        with get_conn() as conn:
+            return conn.execute("SELECT tg_id FROM users").fetchall()
+
+    rows = await run_db(_all_tg_ids)
 
     sent, skipped = 0, 0
 
@@ -714,3 +699,39 @@ async def cmd_laundry_news(message: types.Message):
         f"Готово. Сообщение отправлено: {sent}, не доставлено: {skipped}."
     )
 
+
+@router.message(Command("perf"))
+async def cmd_perf(msg: types.Message):
+    """Метрики пула потоков БД: видно, когда узким местом становится пул."""
+
+    st = db_executor_stats()
+    ps = await run_db(db_pool_stats)
+    lines = [
+        "⚙️ <b>Пул БД</b>",
+        f"Потоков: {st['workers']}, в очереди: {st['queued']} (пик {st['max_queued']})",
+        f"Долгих ожиданий: {st['slow_waits']}",
+        "Коннекты: " + ", ".join(f"{k}={v}" for k, v in ps.items()),
+        "Профили: " + ", ".join(f"{k}={v}" for k, v in user_cache_stats().items()),
+        "Username: " + ", ".join(f"{k}={v}" for k, v in username_stats().items()),
+        "Экраны записи: " + ", ".join(f"{k}={v}" for k, v in render_cache_stats().items()),
+        "Bot API: " + ", ".join(
+            f"{k}={v:.1f}" if isinstance(v, float) else f"{k}={v}"
+            for k, v in api_metrics.stats().items()
+        ),
+        "Баны: " + ", ".join(f"{k}={v}" for k, v in ban_registry.stats().items()),
+        "Напоминания: " + ", ".join(f"{k}={v}" for k, v in reminder_stats().items()),
+        "Neon: " + ", ".join(
+            f"{k}={v:.0f}" if isinstance(v, float) else f"{k}={v}"
+            for k, v in warmth_stats().items()
+        ),
+        "",
+    ]
+    top = sorted(st["per_fn"].items(), key=lambda kv: kv[1]["run_total"], reverse=True)[:10]
+    for name, f in top:
+        calls = int(f["calls"]) or 1
+        lines.append(
+            f"• <code>{name}</code>: {int(f['calls'])} выз., "
+            f"ожид. ср {f['wait_total'] / calls * 1000:.1f} / макс {f['wait_max'] * 1000:.0f} мс, "
+            f"выполн. ср {f['run_total'] / calls * 1000:.1f} мс"
+        )
+    await msg.answer("\n".join(lines), parse_mode="HTML")
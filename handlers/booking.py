@@ -1,30 +1,34 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 from aiogram import Router, types, F
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, Message
 from aiogram.exceptions import TelegramBadRequest
 
+from collections import OrderedDict
 from datetime import datetime, timedelta, time
 from zoneinfo import ZoneInfo
 
 from config import TIMEZONE, WORKING_HOURS
 from keyboards import main_menu
-from scheduler import schedule_reminder
-from database import (
-    is_banned,
-    get_conn,
+from scheduler import schedule_reminder, cancel_reminder
+from database import DBUnavailable, BookingOutcome, BookingResult
+from db_warmth import wait_warm
+from database_async import (
+    ban_status,
+    get_aconn,
     get_user,
-    get_user_bookings_today,
-    get_free_hours,
-    create_booking,
-    DBUnavailable
+    busy_masks,
+    availability_summary,
+    get_machine,
+    machine_catalog_snapshot,
+    book_slot,
+    delete_booking,
 )
-from sqlite3 import IntegrityError  # для SQLite
-
-# Для Postgres: корректно подхватить UniqueViolation, а без psycopg2 — сделать безопасную заглушку-класс
-try:
-    from psycopg2.errors import UniqueViolation  # type: ignore
-except Exception:
-    class UniqueViolation(Exception):
-        pass
+import occupancy
+import machine_catalog
+import api_metrics
+from callback_ack import ack, flush as flush_ack
 
 
 TZ = ZoneInfo(TIMEZONE)
@@ -33,27 +37,50 @@ TZ = ZoneInfo(TIMEZONE)
 def now_local() -> datetime:
     return datetime.now(TZ)
 
-def _busy_map_for_date(date_iso: str) -> dict[int, set[int]]:
-    """
-    {machine_id: {busy_hour, ...}} для выбранной даты.
-    Один запрос вместо N*get_free_hours().
-    """
-    with get_conn() as conn:
-        rows = conn.execute(
-            "SELECT machine_id, hour FROM bookings WHERE date=?",
-            (date_iso,),
-        ).fetchall()
+router = Router()
 
-    busy: dict[int, set[int]] = {}
-    for mid, h in rows:
-        busy.setdefault(int(mid), set()).add(int(h))
-    return busy
 
+# -------- утилиты интерфейса --------
+# Готовые (текст, клавиатура) экранов «машины на дату» и «часы машины».
+# Ключ включает версию занятости даты, поколение каталога машин и маску ещё
+# открытых часов: любая запись/отмена на дату, правка машин или смена часа
+# дают новый ключ, а старые записи просто вытесняются (LRU).
+RENDER_CACHE_SIZE = 256
+
+_render_cache: "OrderedDict[tuple, tuple[str, InlineKeyboardMarkup]]" = OrderedDict()
+_render_stats = {"hits": 0, "misses": 0}
+
+
+def _render_key(view: str, date: str, machine_id: int | None = None) -> tuple:
+    """Считать ДО чтения масок: изменение во время чтения даст уже другой ключ."""
+    return (
+        view, date, machine_id,
+        occupancy.version(date),
+        machine_catalog.snapshot()[1],
+        occupancy.future_mask(date, now_local()),
+    )
 
-router = Router()
+
+def _render_get(key: tuple):
+    hit = _render_cache.get(key)
+    if hit is None:
+        _render_stats["misses"] += 1
+        return None
+    _render_cache.move_to_end(key)
+    _render_stats["hits"] += 1
+    return hit
+
+
+def _render_put(key: tuple, text: str, kb: InlineKeyboardMarkup):
+    _render_cache[key] = (text, kb)
+    if len(_render_cache) > RENDER_CACHE_SIZE:
+        _render_cache.popitem(last=False)
+
+
+def render_cache_stats() -> dict:
+    return {"size": len(_render_cache), **_render_stats}
 
 
-# -------- утилиты интерфейса --------
 def _norm_kb(kb: InlineKeyboardMarkup | None):
     if not kb:
         return None
@@ -85,7 +112,8 @@ async def safe_edit(
     try:
         if text is not None and text != cur_text:
             return await msg.edit_text(text, reply_markup=reply_markup, parse_mode=parse_mode)
-        if new_kb is not None and new_kb != cur_kb:
+        # тот же текст: правим только клавиатуру (в т.ч. снимаем — вместо отдельного вызова заранее)
+        if new_kb != cur_kb and (new_kb is not None or text is not None):
             return await msg.edit_reply_markup(reply_markup=reply_markup)
         return None
     except TelegramBadRequest as e:
@@ -94,39 +122,48 @@ async def safe_edit(
             return None
         raise
 
-def _free_per_type_for_date(date_iso: str) -> tuple[int, int]:
-    now = now_local()
-    today_iso = now.date().isoformat()
 
-    with get_conn() as conn:
-        machines = conn.execute(
-            "SELECT id, type FROM machines WHERE is_active"
-        ).fetchall()
+SLOW_STEP_SEC = 0.7  # дольше — показываем «обрабатываю» (и этим же снимаем кнопки)
 
-    busy = _busy_map_for_date(date_iso)
 
-    free_wash_slots = 0
-    free_dry_slots = 0
+class _Step:
+    """Какое сообщение править итоговой правкой (после «обрабатываю» — уже изменённое)."""
 
-    for mid, mtype in machines:
-        mid = int(mid)
-        busy_hours = busy.get(mid, set())
-
-        # считаем свободные часы без доп. запросов
-        free_cnt = 0
-        for h in WORKING_HOURS:
-            if date_iso == today_iso and h <= now.hour:
-                continue
-            if h not in busy_hours:
-                free_cnt += 1
-
-        if mtype == "wash":
-            free_wash_slots += free_cnt
-        else:
-            free_dry_slots += free_cnt
+    def __init__(self, msg: Message | None):
+        self.msg = msg
 
-    return free_wash_slots, free_dry_slots
 
+@asynccontextmanager
+async def _processing(msg: Message | None, text: str = "⏳ Обрабатываю…"):
+    """
+    Шаг записи = одна правка сообщения. Промежуточная правка — только если
+    работа внутри блока (БД, сон Neon) заняла больше SLOW_STEP_SEC.
+    Итоговую правку делаем ПОСЛЕ блока, через step.msg.
+    """
+    step = _Step(msg)
+    started = False
+
+    async def _hint():
+        nonlocal started
+        await asyncio.sleep(SLOW_STEP_SEC)
+        started = True
+        try:
+            await flush_ack()  # долгий шаг: «часики» на кнопке не держим до конца
+            edited = await safe_edit(msg, text=text, parse_mode=None)
+            if isinstance(edited, Message):
+                step.msg = edited
+        except Exception:
+            pass
+
+    task = asyncio.create_task(_hint()) if msg is not None else None
+    try:
+        yield step
+    finally:
+        if task is not None:
+            if started:
+                await task  # правка уже ушла — итоговая должна прийти после неё
+            else:
+                task.cancel()
 
 '''
 # -------- вспомогательные подсчёты свободных --------
@@ -159,13 +196,10 @@ def _free_per_type_for_date(date_iso: str) -> tuple[int, int]:
     return free_wash_slots, free_dry_slots
 '''
 
-def _free_hours_for_machine_on_date(machine_id: int, date_iso: str) -> list[int]:
+async def _free_hours_for_machine_on_date(machine_id: int, date_iso: str) -> list[int]:
     """Список СВОБОДНЫХ часов по машине на дату (для 'сегодня' — только будущие)."""
-    free = get_free_hours(machine_id, date_iso)
-    now = now_local()
-    if date_iso == now.date().isoformat():
-        free = [h for h in free if h > now.hour]
-    return sorted(free)
+    busy = (await busy_masks(date_iso)).get(machine_id, 0)
+    return occupancy.mask_to_hours(occupancy.future_mask(date_iso, now_local()) & ~busy)
 
 
 # =========================================================
@@ -174,25 +208,15 @@ def _free_hours_for_machine_on_date(machine_id: int, date_iso: str) -> list[int]
 # --- /book: выбор даты ---
 @router.message(F.text == "/book")
 async def choose_date_first(
-    msg: types.Message, user_id: int | None = None, edit: bool = False
+    msg: types.Message, user_id: int | None = None, edit: bool = False,
+    db_retry: bool = True,
 ):
     try:
         uid = user_id or (msg.chat.id if getattr(msg, "chat", None) else msg.from_user.id)
-        if is_banned(uid):
-            # подтянем срок/причину, чтобы красиво показать
-            with get_conn() as conn:
-                row = conn.execute(
-                    "SELECT banned_until, reason FROM banned WHERE tg_id=?", (uid,)
-                ).fetchone()
-            until_txt = ""
-            if row and row[0]:
-                try:
-                    from datetime import datetime as _dt
-
-                    until_txt = _dt.fromisoformat(row[0]).strftime("%d.%m %H:%M")
-                except Exception:
-                    until_txt = row[0]
-            reason = (row[1] or "").strip() if row else ""
+        ban = await ban_status(uid)  # срок и причина — из памяти, без запроса
+        if ban:
+            until_txt = ban.expires.astimezone(TZ).strftime("%d.%m %H:%M") if ban.expires else ban.until
+            reason = ban.reason.strip()
             text = "🚫 Вы заблокированы."
             if until_txt:
                 text += f" До {until_txt}."
@@ -200,21 +224,27 @@ async def choose_date_first(
                 text += f"\nПричина: {reason}"
             return await msg.answer(text)
 
-        user = get_user(uid)
+        user = await get_user(uid)
         if not user or not (user[2] and user[3]):
             return await msg.answer(
                 "Сначала завершите регистрацию: /start → фамилия и номер комнаты."
             )
+        if not edit:
+            api_metrics.funnel_start(uid)  # считаем вызовы API до записи
 
         now = now_local()
         today = now.date()
         start_offset = 1 if now.hour >= 23 else 0  # после 23:00 «сегодня» скрываем
 
+        # сводка по всем дням — один запрос
+        first_day = today + timedelta(days=start_offset)
+        summary = await availability_summary(first_day, 3)
+
         days_buttons = []
-        for i in range(start_offset, start_offset + 3):
-            d = today + timedelta(days=i)
+        for i in range(3):
+            d = first_day + timedelta(days=i)
             d_iso = d.isoformat()
-            free_wash, free_dry = _free_per_type_for_date(d_iso)
+            free_wash, free_dry = summary[d_iso]["wash"], summary[d_iso]["dry"]
             caption = f"📅 {d.strftime('%d.%m')} — 🧺 {free_wash} / 🌬️ {free_dry}"
             days_buttons.append(
                 [InlineKeyboardButton(text=caption, callback_data=f"date_{d_iso}")]
@@ -229,6 +259,9 @@ async def choose_date_first(
         else:
             await msg.answer(text, reply_markup=kb)
     except DBUnavailable:
+        # Neon спит: ждём несколько секунд пробуждения и пробуем ещё раз
+        if db_retry and await wait_warm():
+            return await choose_date_first(msg, user_id, edit, db_retry=False)
         return await msg.answer(
             "⏳ База данных сейчас просыпается, бот жив.\n"
             "Просто повторите /book ещё раз."
@@ -310,11 +343,21 @@ async def _show_machines_for_date(message: Message, date: str):
 
 async def _show_machines_for_date(message: Message, date: str):
     """Текст + кнопки по всем машинам на выбранную дату."""
-    with get_conn() as conn:
-        cur = conn.execute(
-            "SELECT id, type, name FROM machines WHERE is_active ORDER BY type, name"
-        )
-        machines = cur.fetchall()  # (id, 'wash'|'dry', name)
+    text, kb = await _machines_screen(date)
+    await safe_edit(message, text=text, reply_markup=kb)
+
+
+async def _machines_screen(date: str) -> tuple[str, InlineKeyboardMarkup]:
+    key = _render_key("machines", date)
+    cached = _render_get(key)
+    if cached is None:
+        cached = await _render_machines_for_date(date)
+        _render_put(key, *cached)
+    return cached
+
+
+async def _render_machines_for_date(date: str) -> tuple[str, InlineKeyboardMarkup]:
+    machines = (await machine_catalog_snapshot()).active()  # (id, 'wash'|'dry', name, …)
 
     if not machines:
         kb = InlineKeyboardMarkup(
@@ -322,13 +365,9 @@ async def _show_machines_for_date(message: Message, date: str):
                 [InlineKeyboardButton(text="⬅️ К датам", callback_data="back_to_dates")]
             ]
         )
-        return await safe_edit(
-            message,
-            text="Машины ещё не добавлены администратором.",
-            reply_markup=kb,
-        )
+        return "Машины ещё не добавлены администратором.", kb
 
-    busy = _busy_map_for_date(date)
+    busy = await busy_masks(date)
 
     # красиво форматируем дату
     try:
@@ -340,20 +379,11 @@ async def _show_machines_for_date(message: Message, date: str):
     lines: list[str] = [f"📅 {header_date} — свободные слоты\n"]
     rows_btn: list[list[InlineKeyboardButton]] = []
 
-    now = now_local()
-    today_iso = now.date().isoformat()
+    open_hours = occupancy.future_mask(date, now_local())
 
     any_free = False
-    for machine_id, machine_type, machine_name in machines:
-        machine_id = int(machine_id)
-        busy_hours = busy.get(machine_id, set())
-
-        free_hours = []
-        for h in WORKING_HOURS:
-            if date == today_iso and h <= now.hour:
-                continue
-            if h not in busy_hours:
-                free_hours.append(h)
+    for machine_id, machine_type, machine_name, _ in machines:
+        free_hours = occupancy.mask_to_hours(open_hours & ~busy.get(machine_id, 0))
 
         if not free_hours:
             continue
@@ -376,84 +406,70 @@ async def _show_machines_for_date(message: Message, date: str):
                 [InlineKeyboardButton(text="⬅️ К датам", callback_data="back_to_dates")]
             ]
         )
-        return await safe_edit(
-            message,
-            text=f"На {date} свободных машин нет.",
-            reply_markup=kb,
-        )
+        return f"На {date} свободных машин нет.", kb
 
     rows_btn.append([InlineKeyboardButton(text="⬅️ К датам", callback_data="back_to_dates")])
     kb = InlineKeyboardMarkup(inline_keyboard=rows_btn)
-    await safe_edit(message, text="\n".join(lines).rstrip(), reply_markup=kb)
+    return "\n".join(lines).rstrip(), kb
 
 
 # Выбрали дату → показываем ВСЕ машины (wash+dry) и список свободных слотов
 @router.callback_query(F.data.startswith("date_"))
 async def choose_machine_for_date(callback: types.CallbackQuery):
-    await callback.answer()
-    try:
-        if callback.message:
-            await callback.message.edit_reply_markup(reply_markup=None)
-    except Exception:
-        pass
-
+    await ack(callback)
     date = callback.data.split("_", 1)[1]
-    await _show_machines_for_date(callback.message, date)
+    async with _processing(callback.message) as step:
+        text, kb = await _machines_screen(date)
+    await safe_edit(step.msg, text=text, reply_markup=kb)
 
 
 # Выбрали машину → выбираем ВРЕМЯ
 @router.callback_query(F.data.startswith("machine_"))
 async def choose_hour(callback: types.CallbackQuery):
-    await callback.answer()
-    try:
-        if callback.message:
-            await callback.message.edit_reply_markup(reply_markup=None)
-    except Exception:
-        pass
-
+    await ack(callback)
     # формат: machine_{machine_id}_{YYYY-MM-DD}
     try:
         _, machine_id_str, date = callback.data.split("_", 2)
         machine_id = int(machine_id_str)
+        datetime.fromisoformat(date)
     except Exception:
         return await safe_edit(callback.message, text="⚠️ Неверные данные запроса.")
 
-    with get_conn() as conn:
-        cur = conn.execute(
-            "SELECT type, name, is_active FROM machines WHERE id=?", (machine_id,)
-        )
-        row = cur.fetchone()
-    if not row:
-        return await safe_edit(callback.message, text="Ошибка: машина не найдена.")
-    machine_type, machine_name, is_active = row
-    if not is_active:
-        return await safe_edit(
-            callback.message,
-            text="⚠️ Эта машина сейчас недоступна для записи. Выберите другую.",
-        )
+    key = _render_key("hours", date, machine_id)
+    cached = _render_get(key)
+    if cached is None:
+        machine = await get_machine(machine_id)
+        if not machine:
+            return await safe_edit(callback.message, text="Ошибка: машина не найдена.")
+        if not machine.is_active:
+            return await safe_edit(
+                callback.message,
+                text="⚠️ Эта машина сейчас недоступна для записи. Выберите другую.",
+            )
+        async with _processing(callback.message) as step:
+            cached = await _render_hours(machine, date)
+        _render_put(key, *cached)
+        msg = step.msg
+    else:
+        msg = callback.message
+    text, kb = cached
+    return await safe_edit(msg, text=text, reply_markup=kb, parse_mode="HTML")
 
-    with get_conn() as conn:
-        busy_rows = conn.execute(
-            "SELECT hour FROM bookings WHERE machine_id=? AND date=?",
-            (machine_id, date),
-        ).fetchall()
-    busy_hours = {int(r[0]) for r in busy_rows}
-    free_hours = {h for h in WORKING_HOURS if h not in busy_hours}
 
-    #free_hours = set(get_free_hours(machine_id, date))
-    all_hours = WORKING_HOURS
+async def _render_hours(machine, date: str) -> tuple[str, InlineKeyboardMarkup]:
+    machine_id, machine_type, machine_name, _ = machine
 
-    now = now_local()
-    selected_date = datetime.fromisoformat(date).date()
+    busy = (await busy_masks(date)).get(machine_id, 0)
+    # прошедшие часы скрываем (для «сегодня» — всё до следующего часа)
+    open_hours = occupancy.future_mask(date, now_local())
 
     kb_rows = []
     has_free = False
-    for h in all_hours:
-        slot_dt = datetime.combine(selected_date, time(hour=h, tzinfo=TZ))
-        if slot_dt <= now:
-            continue  # скрываем прошедшие часы
+    for h in WORKING_HOURS:
+        if not open_hours & occupancy.HOUR_BIT[h]:
+            continue
 
-        if h in free_hours:
+        if not busy & occupancy.HOUR_BIT[h]:
             kb_rows.append(
                 [
                     InlineKeyboardButton(
@@ -479,24 +495,15 @@ async def choose_hour(callback: types.CallbackQuery):
     kb = InlineKeyboardMarkup(inline_keyboard=kb_rows)
 
     if not has_free:
-        return await safe_edit(
-            callback.message,
-            text=f"На {date} свободных часов не осталось.",
-            reply_markup=kb,
-        )
-
-    return await safe_edit(
-        callback.message,
-        text=f"{'🧺' if machine_type == 'wash' else '🌬️'} <b>{machine_name}</b>\nВыберите время ({date}):",
-        reply_markup=kb,
-        parse_mode="HTML",
-    )
+        return f"На {date} свободных часов не осталось.", kb
+    emoji = "🧺" if machine_type == "wash" else "🌬️"
+    return f"{emoji} <b>{machine_name}</b>\nВыберите время ({date}):", kb
 
 
 # Защита от клика по занятым слотам
 @router.callback_query(F.data == "busy")
 async def busy_slot(callback: types.CallbackQuery):
-    await callback.answer("Этот слот уже занят ❌", show_alert=True)
+    await ack(callback, "Этот слот уже занят ❌", show_alert=True)
 
 
 # Главное меню
@@ -506,16 +513,31 @@ async def back_to_menu(callback: types.CallbackQuery):
     await callback.message.answer("🏠 Главное меню:", reply_markup=main_menu)
 
 
+def _refusal_text(res: BookingResult) -> str:
+    """Текст отказа по результату book_slot."""
+    if res.outcome == BookingOutcome.BANNED:
+        return "🚫 Вы заблокированы и не можете записываться."
+    if res.outcome == BookingOutcome.NOT_REGISTERED:
+        return "Сначала завершите регистрацию: /start → фамилия и комната."
+    if res.outcome == BookingOutcome.NO_MACHINE:
+        return "Ошибка: машина не найдена."
+    if res.outcome == BookingOutcome.INACTIVE_MACHINE:
+        return "⚠️ Эта машина сейчас недоступна. Выберите другую через /book."
+    if res.outcome == BookingOutcome.ALREADY_MINE:
+        return "Вы уже записаны на этот слот."
+    if res.outcome == BookingOutcome.DAILY_LIMIT:
+        type_text = "стиральную машину" if res.machine_type == "wash" else "сушилку"
+        return (
+            f"⚠️ Вы уже записаны на {type_text} в этот день!\n"
+            f"Можно только одну запись на каждый тип машины в сутки."
+        )
+    return "⚠️ Слот только что заняли. Выберите другое время ⏰"
+
+
 # Подтверждение брони (ограничение: 1 запись на тип в сутки)
 @router.callback_query(F.data.startswith("book_"))
 async def finalize(callback: types.CallbackQuery):
-    await callback.answer()
-    try:
-        if callback.message:
-            await callback.message.edit_reply_markup(reply_markup=None)
-    except Exception:
-        pass
-
+    await ack(callback)
     try:
         _, machine_id_str, date_str, hour_str = callback.data.split("_")
         machine_id, hour = int(machine_id_str), int(hour_str)
@@ -524,23 +546,10 @@ async def finalize(callback: types.CallbackQuery):
             callback.message, text="Некорректные данные слота. Откройте /book заново."
         )
 
-    user = get_user(callback.from_user.id)
-    if is_banned(callback.from_user.id):
-        return await safe_edit(
-            callback.message,
-            text="🚫 Вы заблокированы и не можете записываться.",
-        )
-
-    if not user or not (user[2] and user[3]):
-        return await safe_edit(
-            callback.message,
-            "Сначала завершите регистрацию: /start → фамилия и комната.",
-        )
-
     try:
         sel_date = datetime.fromisoformat(date_str).date()
     except ValueError:
-        return await safe_edit(callback.message, "Некорректная дата слота.")
+        return await safe_edit(callback.message, text="Некорректная дата слота.")
 
     now = now_local()
     slot_dt = datetime.combine(sel_date, time(hour=hour, tzinfo=TZ))
@@ -550,57 +559,25 @@ async def finalize(callback: types.CallbackQuery):
             text="⏳ Это время уже прошло. Выберите другой слот.",
         )
 
-    with get_conn() as conn:
-        cur = conn.execute(
-            "SELECT type, name FROM machines WHERE id=?", (machine_id,)
-        )
-        row = cur.fetchone()
-        if not row:
-            return await safe_edit(msg=callback.message, text="Ошибка: машина не найдена.")
-        machine_type, machine_name = row
-
-    if get_user_bookings_today(user[0], date_str, machine_type):
-        type_text = "стиральную машину" if machine_type == "wash" else "сушилку"
-        return await safe_edit(
-            msg=callback.message,
-            text=(
-                f"⚠️ Вы уже записаны на {type_text} в этот день!\n"
-                f"Можно только одну запись на каждый тип машины в сутки."
-            ),
-        )
-
-    try:
-        create_booking(user[0], machine_id, date_str, hour)
-    except (IntegrityError, UniqueViolation):
-        # проверим, не ваша ли это запись
-        with get_conn() as conn:
-            mine = conn.execute(
-                """
-                SELECT 1
-                  FROM bookings
-                 WHERE user_id = ?
-                   AND machine_id = ?
-                   AND date =?
-                   AND hour =?
-                """,
-                (user[0], machine_id, date_str, hour),
-            ).fetchone()
-        if mine:
-            return await safe_edit(callback.message, "Вы уже записаны на этот слот.")
-        return await safe_edit(
-            callback.message,
-            text="⚠️ Слот только что заняли. Выберите другое время ⏰",
-            parse_mode="HTML",
-        )
-    except Exception:
+    # все проверки и сама запись — одним выражением в БД
+    async with _processing(callback.message, "⏳ Записываю…") as step:
+        try:
+            res = await book_slot(callback.from_user.id, machine_id, date_str, hour)
+        except Exception:
+            res = None
+    if res is None:
         # неожиданные ошибки — аккуратно сообщим
         return await safe_edit(
-            callback.message, text="Произошла ошибка сервера. Попробуйте ещё раз."
+            step.msg, text="Произошла ошибка сервера. Попробуйте ещё раз."
         )
 
+    if res.outcome != BookingOutcome.BOOKED:
+        return await safe_edit(step.msg, text=_refusal_text(res))
+    machine_type, machine_name = res.machine_type, res.machine_name
+
     icon = "🧺" if machine_type == "wash" else "🌬️"
     await safe_edit(
-        msg=callback.message,
+        msg=step.msg,
         text=(
             f"✅ Запись подтверждена!\n\n"
             f"📅 Дата: {date_str}\n"
@@ -616,10 +593,11 @@ async def finalize(callback: types.CallbackQuery):
         if slot_dt - timedelta(minutes=30) > now:
             await schedule_reminder(
                 callback.from_user.id,
-                machine_name,
+                machine_id,
                 date_str,
                 hour,
                 minutes_before=30,
+                booking_id=res.booking_id,
             )
     except Exception:
         pass
@@ -628,16 +606,12 @@ async def finalize(callback: types.CallbackQuery):
     if machine_type == "wash":
         next_hour = hour + 1
         if next_hour <= max(WORKING_HOURS):
-            # если ещё нет сушки в этот день
-            if not get_user_bookings_today(user[0], date_str, "dry"):
-                with get_conn() as conn:
-                    cur = conn.execute(
-                        "SELECT id, name FROM machines WHERE type='dry' AND is_active ORDER BY id"
-                    )
-                    dryers = cur.fetchall()
-                for dry_id, dry_name in dryers:
-                    free = get_free_hours(dry_id, date_str)
-                    if next_hour in free:
+            # если ещё нет сушки в этот день (book_slot уже знает)
+            if not res.other_type_booked:
+                dryers = sorted((await machine_catalog_snapshot()).active("dry"))
+                busy = await busy_masks(date_str)
+                for dry_id, _, dry_name, _ in dryers:
+                    if not busy.get(dry_id, 0) & occupancy.HOUR_BIT[next_hour]:
                         text = (
                             "🌬️ Нужна сушка после стирки?\n\n"
                             f"Могу сразу записать вас на <b>{dry_name}</b>\n"
@@ -660,13 +634,15 @@ async def finalize(callback: types.CallbackQuery):
                         await callback.message.answer(text, reply_markup=kb, parse_mode="HTML")
                         break
 
+    api_metrics.funnel_done(callback.from_user.id)
+
 
 # авто-создание сушки после стирки
 @router.callback_query(
     F.data.startswith("auto_dry_") & (F.data != "auto_dry_cancel")
 )
 async def auto_add_dryer(callback: types.CallbackQuery):
-    await callback.answer()
+    await ack(callback)
     try:
         parts = callback.data.split("_")
         # ожидаем: ["auto", "dry", "<dry_id>", "<YYYY-MM-DD>", "<HH>"]
@@ -678,56 +654,31 @@ async def auto_add_dryer(callback: types.CallbackQuery):
     except Exception:
         return await safe_edit(callback.message, text="Некорректные данные сушки.")
 
-    user = get_user(callback.from_user.id)
-    if not user:
-        return await safe_edit(
-            callback.message, text="Сначала завершите регистрацию: /start."
-        )
-    if is_banned(callback.from_user.id):
-        return await safe_edit(
-            callback.message, text="🚫 Вы заблокированы и не можете записываться."
-        )
-
-    # проверим, что машина — сушилка и слот ещё свободен
-    with get_conn() as conn:
-        row = conn.execute(
-            "SELECT type, name FROM machines WHERE id=?", (dry_id,)
-        ).fetchone()
-    if not row:
-        return await safe_edit(callback.message, text="Машина не найдена.")
-    m_type, m_name = row
-    if m_type != "dry":
-        return await safe_edit(callback.message, text="Этот слот не для сушки.")
-
-    # уже есть сушка в этот день?
-    if get_user_bookings_today(user[0], date_str, "dry"):
-        return await safe_edit(
-            callback.message,
-            text="У вас уже есть запись на сушку в этот день.",
-        )
-
-    free = get_free_hours(dry_id, date_str)
-    if hour not in free:
-        return await safe_edit(
-            callback.message,
-            text="К сожалению, этот слот сушки уже заняли. Выберите другой вручную через /book.",
-        )
-
-    try:
-        create_booking(user[0], dry_id, date_str, hour)
-    except (IntegrityError, UniqueViolation):
-        return await safe_edit(
-            callback.message,
-            text="К сожалению, этот слот сушки уже заняли. Выберите другой вручную через /book.",
-        )
-    except Exception:
-        return await safe_edit(
-            callback.message, text="Произошла ошибка при добавлении сушки."
-        )
+    async with _processing(callback.message, "⏳ Записываю…") as step:
+        try:
+            res = await book_slot(
+                callback.from_user.id, dry_id, date_str, hour, machine_type="dry"
+            )
+        except Exception:
+            res = None
+    if res is None:
+        return await safe_edit(step.msg, text="Произошла ошибка при добавлении сушки.")
+
+    if res.outcome != BookingOutcome.BOOKED:
+        if res.outcome == BookingOutcome.NO_MACHINE:
+            text = "Этот слот не для сушки."
+        elif res.outcome == BookingOutcome.DAILY_LIMIT:
+            text = "У вас уже есть запись на сушку в этот день."
+        elif res.outcome in (BookingOutcome.SLOT_TAKEN, BookingOutcome.INACTIVE_MACHINE):
+            text = "К сожалению, этот слот сушки уже заняли. Выберите другой вручную через /book."
+        else:
+            text = _refusal_text(res)
+        return await safe_edit(step.msg, text=text)
+    m_name = res.machine_name
 
     # текст подтверждения
     await safe_edit(
-        callback.message,
+        step.msg,
         text=(
             "✅ Добавлена запись на сушку!\n\n"
             f"📅 Дата: {date_str}\n"
@@ -745,10 +696,11 @@ async def auto_add_dryer(callback: types.CallbackQuery):
         if slot_dt - timedelta(minutes=30) > now:
             await schedule_reminder(
                 callback.from_user.id,
-                m_name,
+                dry_id,
                 date_str,
                 hour,
                 minutes_before=30,
+                booking_id=res.booking_id,
             )
     except Exception:
         pass
@@ -756,7 +708,7 @@ async def auto_add_dryer(callback: types.CallbackQuery):
 
 @router.callback_query(F.data == "auto_dry_cancel")
 async def auto_dry_cancel(callback: types.CallbackQuery):
-    await callback.answer("Заявка без сушки подтверждена")
+    await ack(callback, "Заявка без сушки подтверждена")
     try:
         await callback.message.edit_reply_markup(reply_markup=None)
     except Exception:
@@ -769,7 +721,7 @@ async def auto_dry_cancel(callback: types.CallbackQuery):
 # --- Отмена: показываем только будущие записи ---
 @router.message(F.text == "/cancel")
 async def show_user_bookings(msg: types.Message):
-    user = get_user(msg.from_user.id)
+    user = await get_user(msg.from_user.id)
     if not user:
         return await msg.answer("Сначала пройдите регистрацию с помощью /start")
 
@@ -777,19 +729,8 @@ async def show_user_bookings(msg: types.Message):
     today = now.date().isoformat()
     cur_hour = now.hour
 
-    with get_conn() as conn:
-        cur = conn.execute(
-            """
-            SELECT b.id, m.name, b.date, b.hour
-              FROM bookings b
-              JOIN machines m ON b.machine_id = m.id
-             WHERE b.user_id = ?
-               AND ((b.date > ?) OR (b.date = ? AND b.hour >= ?))
-             ORDER BY b.date, b.hour
-        """,
-            (user[0], today, today, cur_hour),
-        )
-        bookings = cur.fetchall()
+    async with get_aconn() as conn:
+        bookings = await conn.run_all("bookings.user_future", (user[0], today, today, cur_hour))
 
     if not bookings:
         return await msg.answer("У вас нет активных записей.")
@@ -804,17 +745,17 @@ async def show_user_bookings(msg: types.Message):
 
 @router.callback_query(F.data.startswith("cancel_"))
 async def cancel_booking(callback: types.CallbackQuery):
-    await callback.answer()  # ← быстрый ACK
+    await ack(callback)  # ← быстрый ACK
     booking_id = int(callback.data.split("_")[1])
-    with get_conn() as conn:
-        conn.execute("DELETE FROM bookings WHERE id=?", (booking_id,))
+    if await delete_booking(booking_id):
+        await cancel_reminder(booking_id)
     await safe_edit(msg=callback.message, text="🗑️ Запись отменена.")
 
 
 # --- Мои записи: только будущие ---
 @router.message(F.text == "/mybookings")
 async def show_future_bookings(msg: types.Message):
-    user = get_user(msg.from_user.id)
+    user = await get_user(msg.from_user.id)
     if not user:
         return await msg.answer("Сначала пройдите регистрацию с помощью /start")
 
@@ -822,8 +763,8 @@ async def show_future_bookings(msg: types.Message):
     today = now.date().isoformat()
     cur_hour = now.hour
 
-    with get_conn() as conn:
-        cur = conn.execute(
+    async with get_aconn() as conn:
+        rows = await conn.fetchall(
             """
             SELECT m.name, b.date, b.hour
               FROM bookings b
@@ -834,7 +775,6 @@ async def show_future_bookings(msg: types.Message):
         """,
             (user[0], today, today, cur_hour),
         )
-        rows = cur.fetchall()
 
     if not rows:
         return await msg.answer("У вас нет активных записей.")
@@ -889,19 +829,19 @@ async def cmd_help(msg: types.Message):
 
 @router.callback_query(F.data == "none")
 async def inactive_day(callback: types.CallbackQuery):
-    await callback.answer("⚠️ В этот день все слоты заняты.", show_alert=True)
+    await ack(callback, "⚠️ В этот день все слоты заняты.", show_alert=True)
 
 
 # -------- Навигация «Назад» --------
 @router.callback_query(F.data == "back_to_dates")
 async def back_to_dates(callback: types.CallbackQuery):
-    await callback.answer()
+    await ack(callback)
     await choose_date_first(callback.message, user_id=callback.from_user.id, edit=True)
 
 
 @router.callback_query(F.data.startswith("back_to_machines_all_"))
 async def back_to_machines_all(callback: types.CallbackQuery):
-    await callback.answer()
+    await ack(callback)
     parts = callback.data.split("_", 4)
     if len(parts) != 5 or not parts[4]:
         return await safe_edit(callback.message, text="⚠️ Неверные данные навигации.")
@@ -5,12 +5,13 @@ from aiogram.fsm.state import StatesGroup, State
 from aiogram.filters import CommandStart
 from aiogram.types import ReplyKeyboardRemove
 
-from database import (
+from database_async import (
     get_user, save_user, is_banned, ban_user,
     register_failed_attempt, reset_failed_attempts,
-    update_username,
+    update_username, get_machine,
 )
 from keyboards import main_menu, start_menu
+from callback_ack import ack
 
 import re
 
@@ -45,12 +46,12 @@ async def start_cmd(msg: types.Message, state: FSMContext):
     await state.clear()
     tg_id = msg.from_user.id
     # обновим username (если поменялся в Telegram)
-    update_username(tg_id, msg.from_user.username)
+    await update_username(tg_id, msg.from_user.username)
 
-    if is_banned(tg_id):
+    if await is_banned(tg_id):
         return await msg.answer("🚫 Вы заблокированы на 7 дней за нарушение правил. Попробуйте позже.")
 
-    user = get_user(tg_id)
+    user = await get_user(tg_id)
     if user and user[2] and user[3]:
         text = ("👋 <b>С возвращением!</b>\n\n"
                 "Вы уже зарегистрированы.\n"
@@ -68,15 +69,15 @@ async def start_cmd(msg: types.Message, state: FSMContext):
 @router.message(F.text == "🧺 Начать запись")
 async def start_registration(msg: types.Message, state: FSMContext):
     tg_id = msg.from_user.id
-    if is_banned(tg_id):
+    if await is_banned(tg_id):
         return await msg.answer("🚫 Вы заблокированы на 7 дней за нарушение правил. Попробуйте позже.")
 
-    user = get_user(tg_id)
+    user = await get_user(tg_id)
     if user and user[2] and user[3]:
         return await msg.answer("Вы уже зарегистрированы! Используйте меню ниже.", reply_markup=main_menu)
 
     # на всякий обновим username
-    update_username(tg_id, msg.from_user.username)
+    await update_username(tg_id, msg.from_user.username)
 
     await msg.answer("Введите вашу фамилию для регистрации:")
     await state.set_state(RegForm.surname)
@@ -87,20 +88,20 @@ async def reg_surname(msg: types.Message, state: FSMContext):
     tg_id = msg.from_user.id
     surname = (msg.text or "").strip()
 
-    if is_banned(tg_id):
+    if await is_banned(tg_id):
         return await msg.answer("🚫 Вы заблокированы на 7 дней за нарушение правил. Попробуйте позже.")
     if not surname:
         return await msg.answer("Введите фамилию текстом.")
 
     # проверка на мат
     if is_offensive(surname):
-        count = register_failed_attempt(tg_id)
+        count = await register_failed_attempt(tg_id)
         if count >= 3:
-            ban_user(tg_id, reason="3 нецензурные попытки регистрации", days=7)
+            await ban_user(tg_id, reason="3 нецензурные попытки регистрации", days=7)
             return await msg.answer("🚫 Вы заблокированы на 7 дней за неоднократные нарушения при регистрации.")
         return await msg.answer("⚠️ Недопустимая фамилия. Введите корректную фамилию.")
 
-    reset_failed_attempts(tg_id)
+    await reset_failed_attempts(tg_id)
     await state.update_data(surname=surname)
     await msg.answer("Введите номер вашей комнаты:")
     await state.set_state(RegForm.room)
@@ -111,7 +112,7 @@ async def reg_room(msg: types.Message, state: FSMContext):
     tg_id = msg.from_user.id
     room = (msg.text or "").strip()
 
-    if is_banned(tg_id):
+    if await is_banned(tg_id):
         return await msg.answer("🚫 Вы заблокированы на 7 дней за нарушение правил. Попробуйте позже.")
     if not is_valid_room(room):
         return await msg.answer("❌ Неверный номер комнаты. Введите три цифры, 100–555.")
@@ -119,23 +120,24 @@ async def reg_room(msg: types.Message, state: FSMContext):
     data = await state.get_data()
     surname = data.get("surname", "").strip()
 
-    save_user(tg_id, surname, room)
+    dropped = await save_user(tg_id, surname, room)
 
     await msg.answer(
         f"✅ Регистрация завершена!\nФамилия: {surname}\nКомната: {room}\n\n"
         f"Теперь вы можете записаться на прачечную:",
         reply_markup=main_menu
     )
+    await _report_dropped(msg, dropped)
     await state.clear()
 
 # --- редактирование профиля (/edit) ---
 @router.message(F.text == "/edit")
 async def edit_profile(msg: types.Message, state: FSMContext):
     tg_id = msg.from_user.id
-    if is_banned(tg_id):
+    if await is_banned(tg_id):
         return await msg.answer("🚫 Вы заблокированы на 7 дней за нарушение правил. Попробуйте позже.")
 
-    user = get_user(tg_id)
+    user = await get_user(tg_id)
     if not user:
         return await msg.answer("Вы ещё не зарегистрированы. Используйте /start для регистрации.")
 
@@ -148,7 +150,7 @@ async def edit_surname(msg: types.Message, state: FSMContext):
     tg_id = msg.from_user.id
     surname = (msg.text or "").strip()
 
-    if is_banned(tg_id):
+    if await is_banned(tg_id):
         return await msg.answer("🚫 Вы заблокированы на 7 дней за нарушение правил. Попробуйте позже.")
     if not surname:
         return await msg.answer("Введите фамилию текстом.")
@@ -165,7 +167,7 @@ async def edit_room(msg: types.Message, state: FSMContext):
     tg_id = msg.from_user.id
     room = (msg.text or "").strip()
 
-    if is_banned(tg_id):
+    if await is_banned(tg_id):
         return await msg.answer("🚫 Вы заблокированы на 7 дней за нарушение правил. Попробуйте позже.")
     if not is_valid_room(room):
         return await msg.answer("❌ Неверный номер комнаты. Введите три цифры, 100–555.")
@@ -173,15 +175,31 @@ async def edit_room(msg: types.Message, state: FSMContext):
     data = await state.get_data()
     surname = data.get("surname", "").strip()
 
-    save_user(tg_id, surname, room)
+    dropped = await save_user(tg_id, surname, room)
     await msg.answer(f"✅ Данные обновлены!\nФамилия: {surname}\nКомната: {room}")
+    await _report_dropped(msg, dropped)
     await state.clear()
 
+
+async def _report_dropped(msg: types.Message, dropped: list[tuple]):
+    """Записи, внесённые админом на ваши Фамилию+Комнату, которые упёрлись в лимит «1 тип в сутки»."""
+    if not dropped:
+        return
+    lines = []
+    for machine_id, date_iso, hour in dropped:
+        machine = await get_machine(machine_id)
+        name = machine.name if machine else f"машина #{machine_id}"
+        lines.append(f"• {name} — {date_iso} {hour:02d}:00")
+    await msg.answer(
+        "⚠️ Часть записей, внесённых администратором, не перенесена: "
+        "у вас уже есть запись этого типа в тот день.\n" + "\n".join(lines)
+    )
+
 # --- кнопка из рассылки «Заполнить профиль» ---
 @router.callback_query(F.data == "fill_profile")
 async def cb_fill_profile(callback: types.CallbackQuery, state: FSMContext):
-    await callback.answer()
-    user = get_user(callback.from_user.id)
+    await ack(callback)
+    user = await get_user(callback.from_user.id)
     if user and user[2] and user[3]:
         return await callback.message.answer("Вы уже зарегистрированы ✅\nМожете бронировать из меню.")
     await callback.message.answer("Введите вашу фамилию для регистрации:")
@@ -0,0 +1,73 @@
+# machine_catalog.py
+"""
+Каталог машин в памяти процесса: id → (type, name, is_active) и name → id.
+
+Таблица machines меняется только из /machines и при старте
+(ensure_config_machines), а читается почти в каждом хендлере. Поэтому
+каталог загружается один раз (загрузчики — machine_catalog в database.py /
+database_async.py) и сбрасывается set_machine_active / add_machine.
+"""
+import threading
+from typing import NamedTuple
+
+
+class Machine(NamedTuple):
+    id: int
+    type: str           # 'wash' | 'dry'
+    name: str
+    is_active: bool
+
+
+_lock = threading.Lock()
+_by_id: dict[int, Machine] | None = None  # None — не загружен
+_by_name: dict[str, int] = {}
+_generation = 0  # растёт при сбросе: загрузка, начатая до сброса, не кэшируется
+
+
+def snapshot() -> tuple["_Catalog | None", int]:
+    """(каталог, поколение): каталог — если загружен, иначе None и поколение для load()."""
+    with _lock:
+        if _by_id is not None:
+            return _Catalog(_by_id, _by_name), _generation
+        return None, _generation
+
+
+def load(rows, generation: int) -> "_Catalog":
+    """rows — (id, type, name, is_active) из machines.all."""
+    global _by_id, _by_name
+    by_id = {
+        int(mid): Machine(int(mid), t, name, bool(active)) for mid, t, name, active in rows
+    }
+    by_name = {m.name: m.id for m in by_id.values()}
+    with _lock:
+        if generation == _generation:
+            _by_id, _by_name = by_id, by_name
+    return _Catalog(by_id, by_name)
+
+
+def invalidate():
+    global _by_id, _by_name, _generation
+    with _lock:
+        _by_id, _by_name = None, {}
+        _generation += 1
+
+
+class _Catalog:
+    """Неизменяемый снимок каталога (словари не меняются — их только заменяют целиком)."""
+
+    def __init__(self, by_id: dict[int, Machine], by_name: dict[str, int]):
+        self._by_id = by_id
+        self._by_name = by_name
+
+    def get(self, machine_id: int) -> Machine | None:
+        return self._by_id.get(int(machine_id))
+
+    def id_by_name(self, name: str) -> int | None:
+        return self._by_name.get(name)
+
+    def all(self) -> list[Machine]:
+        """Все машины, как в админке: по типу, затем по имени."""
+        return sorted(self._by_id.values(), key=lambda m: (m.type, m.name))
+
+    def active(self, type_: str | None = None) -> list[Machine]:
+        return [m for m in self.all() if m.is_active and (type_ is None or m.type == type_)]
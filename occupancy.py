@@ -0,0 +1,140 @@
+# occupancy.py
+"""
+Занятость слотов в памяти процесса.
+
+На каждую дату храним {machine_id: битовая маска}, бит i ↔ час WORKING_HOURS[i].
+Дата загружается из БД один раз (загрузчики — busy_masks в database.py /
+database_async.py), дальше маски поддерживаются в актуальном виде вызовами
+mark_busy / mark_free при записи, отмене, удалении админом и очистке.
+Вопросы «свободен ли час», «какие часы свободны», «сколько свободно» —
+битовые операции без SQL.
+
+Модуль не ходит в БД сам и безопасен для вызова из потоков run_db.
+"""
+import threading
+from datetime import datetime
+
+from config import WORKING_HOURS
+
+HOUR_BIT = {h: 1 << i for i, h in enumerate(WORKING_HOURS)}
+ALL_HOURS = (1 << len(WORKING_HOURS)) - 1
+
+_lock = threading.Lock()
+_by_date: dict[str, dict[int, int]] = {}
+# сколько раз дату меняли, пока она не загружена: загрузчик сверяет счётчик,
+# чтобы не закэшировать снимок, сделанный до чужого INSERT/DELETE
+_touched: dict[str, int] = {}
+_version = 0  # растёт при любом изменении — ключ для кэшей отрисовки
+_date_version: dict[str, int] = {}  # дата → _version на момент её последнего изменения
+_reset_version = 0                  # _version на момент последнего общего сброса
+
+
+def hours_to_mask(hours) -> int:
+    mask = 0
+    for h in hours:
+        mask |= HOUR_BIT.get(int(h), 0)
+    return mask
+
+
+def mask_to_hours(mask: int) -> list[int]:
+    return [h for h, bit in HOUR_BIT.items() if mask & bit]
+
+
+def bit_count(mask: int) -> int:
+    return bin(mask).count("1")
+
+
+def future_mask(date_iso: str, now: datetime) -> int:
+    """Часы, на которые ещё можно записаться: для «сегодня» — только после текущего часа."""
+    today = now.date().isoformat()
+    if date_iso < today:
+        return 0
+    if date_iso > today:
+        return ALL_HOURS
+    return hours_to_mask(h for h in WORKING_HOURS if h > now.hour)
+
+
+# ---------- загрузка ----------
+def lookup(date_iso: str) -> tuple[dict[int, int] | None, int]:
+    """
+    (маски, токен): маски — если дата уже в памяти; иначе None и токен,
+    который загрузчик передаёт в load_date после запроса в БД.
+    """
+    with _lock:
+        masks = _by_date.get(date_iso)
+        if masks is not None:
+            return dict(masks), 0
+        return None, _touched.get(date_iso, 0)
+
+
+def load_date(date_iso: str, rows, token: int) -> dict[int, int]:
+    """
+    Строим маски из строк (machine_id, hour). Кэшируем, только если за время
+    запроса дату никто не менял; иначе просто отдаём построенное.
+    """
+    masks: dict[int, int] = {}
+    for mid, h in rows:
+        masks[int(mid)] = masks.get(int(mid), 0) | HOUR_BIT.get(int(h), 0)
+    with _lock:
+        if date_iso in _by_date:
+            return dict(_by_date[date_iso])
+        if _touched.get(date_iso, 0) == token:
+            _by_date[date_iso] = masks
+            _touched.pop(date_iso, None)
+    return dict(masks)
+
+
+# ---------- изменения ----------
+def _change(date_iso: str, machine_id: int, hour: int, busy: bool):
+    global _version
+    bit = HOUR_BIT.get(int(hour), 0)
+    with _lock:
+        _version += 1
+        _date_version[date_iso] = _version
+        masks = _by_date.get(date_iso)
+        if masks is None:
+            _touched[date_iso] = _touched.get(date_iso, 0) + 1
+            return
+        cur = masks.get(machine_id, 0)
+        masks[machine_id] = (cur | bit) if busy else (cur & ~bit)
+
+
+def mark_busy(date_iso, machine_id: int, hour: int):
+    _change(str(date_iso), int(machine_id), hour, True)
+
+
+def mark_free(date_iso, machine_id: int, hour: int):
+    _change(str(date_iso), int(machine_id), hour, False)
+
+
+def drop_before(date_iso: str):
+    """Очистка: даты раньше date_iso больше не нужны."""
+    global _version
+    with _lock:
+        for d in [d for d in _by_date if d < date_iso]:
+            del _by_date[d]
+        for d in [d for d in _touched if d < date_iso]:
+            del _touched[d]
+        for d in [d for d in _date_version if d < date_iso]:
+            del _date_version[d]
+        _version += 1
+
+
+def invalidate(date_iso: str | None = None):
+    """Забыть дату (или всё): следующее обращение перечитает из БД."""
+    global _version, _reset_version
+    with _lock:
+        _version += 1
+        if date_iso is None:
+            _by_date.clear()
+            _reset_version = _version
+        else:
+            _by_date.pop(date_iso, None)
+            _date_version[date_iso] = _version
+
+
+def version(date_iso: str | None = None) -> int:
+    """Общая версия или версия одной даты (меняется, только когда меняют эту дату)."""
+    if date_iso is None:
+        return _version
+    return max(_date_version.get(date_iso, 0), _reset_version)
@@ -1,18 +1,36 @@
 # scheduler.py
+import asyncio
+import os
+import re
 from datetime import datetime, timedelta, time
 from zoneinfo import ZoneInfo
 
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.jobstores.base import JobLookupError
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 from apscheduler.triggers.date import DateTrigger
+from apscheduler.util import utc_timestamp_to_datetime
+from sqlalchemy import create_engine, select
 
-from config import TIMEZONE
+from config import TIMEZONE, DB_PATH
 from database import (
+    DATABASE_URL,
     cleanup_old_bookings,
+    expire_bans,
+    flush_usernames,
+    USERNAME_FLUSH_SEC,
     get_conn,
-    get_machine_id_by_name,
-    was_reminder_sent,
     mark_reminder_sent,
+    reminder_plan,
+    ReminderPlan,
+    ban_registry_snapshot,
+    machine_catalog_snapshot,
+    take_migration_dropped,
+    admin_ids,
 )
+import ban_registry
+from db_executor import run_db
+from db_warmth import prewake_if_needed, db_state
 
 from aiogram import Bot
 
@@ -35,9 +53,116 @@ job_defaults = {
     "max_instances": 1,
 }
 
+
+# --- Напоминания храним в БД (та же Postgres/SQLite), чтобы они переживали рестарт ---
+# Задача — одна на границу слота: dispatch_slot + (дата, час, минут_до); Bot не сериализуется.
+REMINDER_JOBSTORE = "reminders"
+REMINDER_JOBS_TABLE = "reminder_jobs"
+
+_UNKNOWN = object()
+
+
+class _ReminderJobStore(SQLAlchemyJobStore):
+    """
+    SQL-хранилище, которое помнит время каждой своей задачи.
+
+    Планировщик просыпается каждые несколько секунд (интервальные задачи) и
+    спрашивает у всех хранилищ «что созрело». Пишем в таблицу только мы, так что
+    id → время держим в памяти (читаем один раз при старте) и не ходим в БД
+    (и не будим Neon), пока ближайшее не наступило. Ближайшее пересчитываем
+    в памяти и только когда ушла сама ближайшая задача — без SQL в event loop.
+    Вызовы сериализует планировщик (_jobstores_lock).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._times: dict[str, datetime | None] | None = None  # None — ещё не читали
+        self._next = _UNKNOWN
+
+    def _load_times(self) -> dict[str, datetime | None]:
+        with self.engine.begin() as conn:
+            rows = conn.execute(select(self.jobs_t.c.id, self.jobs_t.c.next_run_time)).fetchall()
+        return {job_id: utc_timestamp_to_datetime(ts) for job_id, ts in rows}
+
+    def _known_times(self) -> dict[str, datetime | None]:
+        if self._times is None:
+            self._times = self._load_times()
+        return self._times
+
+    def get_next_run_time(self):
+        if self._next is _UNKNOWN:
+            self._next = min((t for t in self._known_times().values() if t is not None), default=None)
+        return self._next
+
+    def get_due_jobs(self, now):
+        nxt = self.get_next_run_time()
+        if nxt is None or nxt > now:
+            return []
+        jobs = super().get_due_jobs(now)
+        if not jobs:
+            # ближайшей задачи в таблице нет (не восстановилась и удалена самим
+            # SQLAlchemyJobStore) — память сверяем с таблицей
+            self._times, self._next = None, _UNKNOWN
+        return jobs
+
+    def _set_time(self, job):
+        times = self._known_times()
+        prev = times.get(job.id)
+        times[job.id] = job.next_run_time
+        if self._next is _UNKNOWN:
+            return
+        if prev is not None and prev == self._next:
+            self._next = _UNKNOWN  # сдвинулась сама ближайшая
+        elif job.next_run_time is not None:
+            self._next = job.next_run_time if self._next is None else min(self._next, job.next_run_time)
+
+    def add_job(self, job):
+        super().add_job(job)
+        self._set_time(job)
+
+    def update_job(self, job):
+        super().update_job(job)
+        self._set_time(job)
+
+    def remove_job(self, job_id):
+        try:
+            super().remove_job(job_id)
+        finally:
+            if self._times is not None and self._times.pop(job_id, None) == self._next:
+                self._next = _UNKNOWN
+
+    def remove_all_jobs(self):
+        super().remove_all_jobs()
+        self._times, self._next = {}, None
+
+    def job_ids(self) -> set[str]:
+        """id всех задач без распаковки их состояния."""
+        with self.engine.begin() as conn:
+            return {row[0] for row in conn.execute(select(self.jobs_t.c.id))}
+
+
+def _jobstore_url() -> str:
+    if DATABASE_URL:
+        # postgres:// | postgresql:// → драйвер psycopg2 (уже в зависимостях)
+        return re.sub(r"^postgres(ql)?(\+\w+)?://", "postgresql+psycopg2://", DATABASE_URL)
+    return f"sqlite:///{DB_PATH}"
+
+
+reminder_store = _ReminderJobStore(
+    engine=create_engine(
+        _jobstore_url(),
+        pool_size=1,
+        max_overflow=2,
+        pool_pre_ping=True,   # Neon мог усыпить/оборвать коннект
+        pool_recycle=1800,
+    ),
+    tablename=REMINDER_JOBS_TABLE,
+)
+
 scheduler = AsyncIOScheduler(
     timezone=TZ,
     job_defaults=job_defaults,
+    jobstores={"default": {"type": "memory"}, REMINDER_JOBSTORE: reminder_store},
 )
 
 def setup_scheduler():
@@ -51,6 +176,40 @@ def setup_scheduler():
             id="cleanup_daily",
             replace_existing=True,
         )
+        # истёкшие баны — пачкой, а не проверкой в каждом хендлере
+        scheduler.add_job(
+            ban_expiry_tick,
+            trigger="interval",
+            minutes=15,
+            id="ban_expiry",
+            replace_existing=True,
+        )
+        # username из /start — пачкой (см. update_username)
+        scheduler.add_job(
+            flush_usernames,
+            trigger="interval",
+            seconds=USERNAME_FLUSH_SEC,
+            id="username_flush",
+            replace_existing=True,
+        )
+        # брони, въехавшие в горизонт напоминаний или добавленные мимо schedule_reminder;
+        # первый проход — сразу при старте: индекс броней живёт только в памяти
+        scheduler.add_job(
+            refresh_reminder_horizon,
+            trigger="interval",
+            minutes=REMINDER_REFRESH_MIN,
+            next_run_time=datetime.now(TZ),
+            id="reminder_horizon",
+            replace_existing=True,
+        )
+        # будим Neon заранее: перед открытием рабочего окна и перед напоминаниями
+        scheduler.add_job(
+            db_warmth_tick,
+            trigger="interval",
+            seconds=60,
+            id="db_warmth",
+            replace_existing=True,
+        )
         # сторож: каждую минуту проверяем, не пришло ли время напоминания
         '''
         scheduler.add_job(
@@ -66,18 +225,41 @@ def setup_scheduler():
     return scheduler
 
 
+async def ban_expiry_tick():
+    # срок ближайшего бана — из памяти: DELETE только когда есть что удалять и
+    # база не спит; до того истёкший бан и так не действует (ban_registry._active)
+    due = ban_registry.expiry_due(datetime.now(TZ))
+    if due is False or db_state() == "cold":
+        return
+    try:
+        expired = await run_db(expire_bans)
+        if expired:
+            print(f"🔓 Истекло банов: {expired}")
+    except Exception as e:
+        print(f"⚠️ Истёкшие баны не удалены: {e}")
+
+
+async def db_warmth_tick():
+    now = datetime.now(TZ)
+    # ближайшее напоминание — из памяти хранилища, без запроса в (возможно спящую) БД
+    nxt = reminder_store.get_next_run_time()
+    await prewake_if_needed(now, [nxt] if nxt else [])
+
+
 # =========================================================
 #        Базовая постановка напоминания
 # =========================================================
 async def schedule_reminder(
     tg_id: int,
-    machine_name: str,
+    machine_id: int,
     date_str: str,
     hour: int,
     minutes_before: int = 30,
+    booking_id: int | None = None,
 ):
     """
     Постановка обычного напоминания (tg_id — именно Telegram ID, а не users.id).
+    booking_id — чтобы отмена записи могла снять таймер слота (cancel_reminder).
     """
     try:
         d = datetime.fromisoformat(date_str).date()
@@ -91,36 +273,225 @@ async def schedule_reminder(
     # если уже пора / чуть опоздали — шлём сразу
     if now >= reminder_dt:
         if (now - reminder_dt).total_seconds() <= LATE_WINDOW_SEC:
-            await send_reminder(tg_id, machine_name, d.isoformat(), hour, minutes_before)
+            await send_reminder(tg_id, machine_id, d.isoformat(), hour, minutes_before)
         return
 
-    safe_name = str(machine_name).replace(" ", "_")
-    job_id = f"rem_{tg_id}_{safe_name}_{d.isoformat()}_{hour}_{minutes_before}"
+    # своей задачи у брони нет: взводим таймер её слота, а кого оповещать —
+    # dispatch_slot возьмёт из bookings в момент срабатывания
+    if booking_id is not None:
+        _index_booking(booking_id, (d.isoformat(), hour, minutes_before), tg_id, machine_id)
+    await _arm_slot(d.isoformat(), hour, minutes_before, reminder_dt)
 
-    #job_id = f"rem_{tg_id}_{d.isoformat()}_{hour}"
-    scheduler.add_job(
-        send_reminder,
-        trigger=DateTrigger(run_date=reminder_dt),
-        id=job_id,
-        args=[tg_id, machine_name, d.isoformat(), hour, minutes_before],
-        replace_existing=True,
-        misfire_grace_time=LATE_WINDOW_SEC,
-    )
+
+# =========================================================
+#   Колесо слотов: один таймер на HH:30, а не задача на бронь
+# =========================================================
+SEND_WORKERS = 4  # параллельных отправок из очереди напоминаний
+
+_armed: set[tuple[str, int, int]] = set()  # (дата, час, минут_до) с таймером в хранилище
+# Индекс живых броней: id брони → (слот, tg_id, machine_id) и слот → id броней.
+# Полон для просмотренного горизонта; слоты дальше него при снятии таймера
+# взведёт заново refresh_reminder_horizon, когда они въедут в горизонт.
+_booking_slot: dict[int, tuple[tuple[str, int, int], int, int]] = {}
+_slot_bookings: dict[tuple[str, int, int], set[int]] = {}
+_send_queue: asyncio.Queue | None = None
+_senders: list[asyncio.Task] = []
+_wheel_stats = {"armed": 0, "fired": 0, "queued": 0, "send_errors": 0, "cancelled": 0, "filtered": 0}
+
+
+def _slot_job_id(date_iso: str, hour: int, minutes_before: int) -> str:
+    return f"slot_{date_iso}_{hour}_{minutes_before}"
+
+
+def _slot_key(job_id: str) -> tuple[str, int, int] | None:
+    """(дата, час, минут_до) из id таймера слота; None — задача другого формата."""
+    parts = job_id.split("_")
+    if len(parts) != 4 or parts[0] != "slot":
+        return None
+    return parts[1], int(parts[2]), int(parts[3])
+
+
+def _add_slot_jobs(items: list[tuple[tuple[str, int, int], datetime]]):
+    """Синхронно: каждая задача — запрос в хранилище, поэтому зовём через run_db."""
+    for key, reminder_dt in items:
+        scheduler.add_job(
+            dispatch_slot,
+            trigger=DateTrigger(run_date=reminder_dt),
+            id=_slot_job_id(*key),
+            args=list(key),
+            jobstore=REMINDER_JOBSTORE,
+            replace_existing=True,
+            misfire_grace_time=LATE_WINDOW_SEC,
+        )
+        _armed.add(key)
+        _wheel_stats["armed"] += 1
+
+
+async def _arm_slot(date_iso: str, hour: int, minutes_before: int, reminder_dt: datetime):
+    key = (date_iso, hour, minutes_before)
+    if key in _armed:
+        return  # слот уже взведён другой бронью — в БД не идём
+    await run_db(_add_slot_jobs, [(key, reminder_dt)])
+
+
+async def dispatch_slot(date_iso: str, hour: int, minutes_before: int):
+    """Граница слота: все брони на (дата, час) с проверками — одним запросом, отправка — через очередь."""
+    key = (date_iso, hour, minutes_before)
+    _armed.discard(key)
+    for bid in _slot_bookings.pop(key, ()):
+        _booking_slot.pop(bid, None)
+    _wheel_stats["fired"] += 1
+
+    plans = await run_db(reminder_plan, date_iso, hour, minutes_before)
+    for plan in await _drop_unwanted(plans):
+        if _reminder_needed(plan):
+            _enqueue_send((plan.tg_id, plan.machine_id, date_iso, hour, minutes_before, False, plan))
+
+
+def _enqueue_send(item: tuple):
+    global _send_queue
+    if _send_queue is None:
+        _send_queue = asyncio.Queue()
+        _senders.extend(asyncio.create_task(_sender()) for _ in range(SEND_WORKERS))
+    _send_queue.put_nowait(item)
+    _wheel_stats["queued"] += 1
+
+
+async def _sender():
+    while True:
+        item = await _send_queue.get()
+        try:
+            await send_reminder(*item)
+        except Exception as e:
+            _wheel_stats["send_errors"] += 1
+            print(f"⚠️ Напоминание {item}: {e}")
+        finally:
+            _send_queue.task_done()
+
+
+# --- индекс броней: снятие таймеров при отмене / удалении / бане / выключении машины ---
+def _index_booking(booking_id: int, key: tuple[str, int, int], tg_id: int, machine_id: int):
+    _booking_slot[int(booking_id)] = (key, int(tg_id), int(machine_id))
+    _slot_bookings.setdefault(key, set()).add(int(booking_id))
+
+
+def _remove_slot_jobs(keys: list[tuple[str, int, int]]):
+    """Синхронно (запросы в хранилище) — через run_db."""
+    for key in keys:
+        try:
+            scheduler.remove_job(_slot_job_id(*key), REMINDER_JOBSTORE)
+            _wheel_stats["cancelled"] += 1
+        except JobLookupError:
+            pass  # уже сработал
+        _armed.discard(key)
+
+
+async def _unindex(booking_ids) -> int:
+    """Убрать брони из индекса; таймеры опустевших слотов снять. Возвращает число снятых."""
+    emptied = []
+    for bid in booking_ids:
+        entry = _booking_slot.pop(int(bid), None)
+        if entry is None:
+            continue
+        key = entry[0]
+        bids = _slot_bookings.get(key)
+        if bids is not None:
+            bids.discard(int(bid))
+            if not bids:
+                del _slot_bookings[key]
+                if key in _armed:
+                    emptied.append(key)
+    # индекс знает не все брони слота (/abookfio, /import попадают в него только
+    # проходом по горизонту): перед снятием таймера — один запрос по слоту
+    for key in list(emptied):
+        if await _drop_unwanted(await run_db(reminder_plan, *key)):
+            emptied.remove(key)
+    if not emptied:
+        return 0
+    await run_db(_remove_slot_jobs, emptied)
+    # пока снимали, на слот могли записаться — вернём таймер
+    for key in emptied:
+        if key in _slot_bookings:
+            reminder_dt = datetime.combine(
+                datetime.fromisoformat(key[0]).date(), time(hour=key[1]), tzinfo=TZ
+            ) - timedelta(minutes=key[2])
+            if reminder_dt > datetime.now(TZ):
+                await _arm_slot(*key, reminder_dt)
+    return len(emptied)
+
+
+async def cancel_reminder(booking_id: int) -> int:
+    """Запись удалена (отмена пользователем / админом)."""
+    return await _unindex([booking_id])
+
+
+async def cancel_user_reminders(tg_id: int) -> int:
+    """Бан: брони остаются, но напоминать по ним не нужно."""
+    return await _unindex([b for b, (_, t, _) in _booking_slot.items() if t == int(tg_id)])
+
+
+async def cancel_machine_reminders(machine_id: int) -> int:
+    """Машина выключена: брони остаются, напоминания по ней не шлём."""
+    return await _unindex([b for b, (_, _, m) in _booking_slot.items() if m == int(machine_id)])
+
+
+async def resync_reminders() -> int:
+    """Разбан / включение машины: снятые таймеры вернёт полный проход по горизонту."""
+    _mark.update(max_id=None, until=None)
+    return await refresh_reminder_horizon()
+
+
+def _forget_before(date_iso: str):
+    for key in [k for k in _slot_bookings if k[0] < date_iso]:
+        for bid in _slot_bookings.pop(key):
+            _booking_slot.pop(bid, None)
+
+
+def _reminder_filters():
+    return ban_registry_snapshot(), machine_catalog_snapshot()
+
+
+async def _drop_unwanted(plans: list[ReminderPlan]) -> list[ReminderPlan]:
+    """Забаненным и по выключенным машинам не шлём (снимки в памяти, без запросов)."""
+    if not plans:
+        return plans
+    bans, catalog = await run_db(_reminder_filters)
+    now = datetime.now(TZ)
+    kept = []
+    for plan in plans:
+        machine = catalog.get(plan.machine_id)
+        if ban_registry.get(bans, plan.tg_id, now) or (machine is not None and not machine.is_active):
+            _wheel_stats["filtered"] += 1
+            continue
+        kept.append(plan)
+    return kept
+
+
+def reminder_stats() -> dict:
+    return {
+        **_wheel_stats,
+        "indexed": len(_booking_slot),
+        **{f"horizon_{k}": v for k, v in _horizon_stats.items()},
+        "slots": len(_armed),
+        "backlog": _send_queue.qsize() if _send_queue is not None else 0,
+    }
 
 
 async def send_reminder(
     tg_id: int,
-    machine_name: str,
+    machine_id: int,
     date_iso: str,
     hour: int,
     minutes_before: int,
-    allow_late: bool = False
+    allow_late: bool = False,
+    plan: ReminderPlan | None = None,
 ):
     """
     Отправка напоминания. tg_id — Telegram ID.
 
-    Здесь:
-    - проверяем, что бронь ещё существует;
+    Бронь, тип машины, стирка перед сушкой и антидубль — одним запросом
+    (reminder_plan); dispatch_slot передаёт уже готовый plan.
+    - бронь отменена — не шлём;
     - если это сушка и за час до неё есть стирка, не шлём напоминание;
     - текст зависит от типа машины (wash/dry).
     """
@@ -150,71 +521,19 @@ async def send_reminder(
     if BOT_REF is None:
         return
 
-    # определяем машину и её тип
-    m_id = get_machine_id_by_name(machine_name)
-    if m_id is None:
-        # если по имени не нашли машину — лучше вообще ничего не слать
-        return
-
-    with get_conn() as conn:
-        row = conn.execute(
-            "SELECT type FROM machines WHERE id=?",
-            (m_id,),
-        ).fetchone()
-    machine_type = row[0] if row else None
-
-    # 1) проверка: бронь всё ещё существует?
-    with get_conn() as conn:
-        exists = conn.execute(
-            """
-            SELECT 1
-              FROM bookings b
-              JOIN users   u ON u.id = b.user_id
-             WHERE u.tg_id = ?
-               AND b.machine_id = ?
-               AND b.date = ?
-               AND b.hour = ?
-             LIMIT 1
-        """,
-            (tg_id, m_id, date_iso, hour),
-        ).fetchone()
-
-    if not exists:
-        # запись отменена или перенесена — не шлём
-        return
-
-    # 2) если это СУШКА и сразу перед ней есть СТИРКА этого же пользователя,
-    # то напоминание на сушку не отправляем
-    if machine_type == "dry" and hour > 0:
-        prev_hour = hour - 1
-        with get_conn() as conn:
-            has_wash_prev = conn.execute(
-                """
-                SELECT 1
-                  FROM bookings b
-                  JOIN users   u ON u.id = b.user_id
-                  JOIN machines m ON m.id = b.machine_id
-                 WHERE u.tg_id = ?
-                   AND b.date = ?
-                   AND b.hour = ?
-                   AND m.type = 'wash'
-                 LIMIT 1
-            """,
-                (tg_id, date_iso, prev_hour),
-            ).fetchone()
-        if has_wash_prev:
-            # сразу после стирки идёт сушка — напоминание для сушилки не нужно
+    if plan is None:
+        plans = await run_db(reminder_plan, date_iso, hour, minutes_before, tg_id, machine_id)
+        if not plans:
+            # запись отменена или перенесена — не шлём
             return
-
-    # 3) антидубли (фиксируем по tg_id + machine_id + дате/часу)
-    if was_reminder_sent(tg_id, m_id, date_iso, hour, minutes_before):
+        plan = plans[0]
+        if not await _drop_unwanted(plans):
+            return
+    if not _reminder_needed(plan):
         return
 
     # подбираем текст под тип машины
-    if machine_type == "wash":
-        kind = "стирка"
-        emoji = "🧺"
-    elif machine_type == "dry":
+    if plan.machine_type == "dry":
         kind = "сушка"
         emoji = "🌬️"
     else:
@@ -224,18 +543,10 @@ async def send_reminder(
     text = (
         "⏰ <b>Напоминание</b>\n\n"
         f"Через <b>{minutes_before} мин</b> у вас {kind}.\n"
-        f"{emoji} Машина: <b>{machine_name}</b>\n"
+        f"{emoji} Машина: <b>{plan.machine_name}</b>\n"
         f"📅 Дата: {date_iso}\n"
         f"🕒 Время: {hour:02d}:00"
     )
-    '''
-    try:
-        await BOT_REF.send_message(tg_id, text, parse_mode="HTML")
-        mark_reminder_sent(tg_id, m_id, date_iso, hour, minutes_before)
-    except Exception:
-        # молча, если не удалось отправить
-        pass
-    '''
     # 1) сначала пробуем отправить сообщение
     try:
         await BOT_REF.send_message(tg_id, text, parse_mode="HTML")
@@ -244,51 +555,172 @@ async def send_reminder(
         # просто выходим, чтобы не спамить ретраями
         return
 
-    # 2) затем фиксируем факт отправки в БД (без try/except, чтобы
-    mark_reminder_sent(tg_id, m_id, date_iso, hour, minutes_before)
+    # 2) затем фиксируем факт отправки в БД (антидубли по tg_id + machine_id + дате/часу)
+    await run_db(mark_reminder_sent, tg_id, machine_id, date_iso, hour, minutes_before)
+
+
+def _reminder_needed(plan: ReminderPlan) -> bool:
+    if plan.sent:
+        return False
+    # сразу после стирки идёт сушка — напоминание для сушилки не нужно
+    return not (plan.machine_type == "dry" and plan.wash_before)
 
 
 # =========================================================
-#   Восстановление напоминаний после рестарта
+#   Горизонт напоминаний: сверка на старте и докатка по водяным знакам
 # =========================================================
-async def rebuild_reminders_for_horizon(
-    hours: int = 48, minutes_before: int = 30
-):
+REMINDER_HORIZON_HOURS = 48
+REMINDER_REFRESH_MIN = int(os.getenv("REMINDER_REFRESH_MIN", "10"))
+
+# Водяные знаки последнего прохода: max(bookings.id) и конец горизонта (дата, час).
+# None — прохода ещё не было, следующий просмотрит весь горизонт.
+_mark: dict = {"max_id": None, "until": None}
+_horizon_stats = {"runs": 0, "skipped_cold": 0, "rows": 0, "armed": 0}
+
+
+async def refresh_reminder_horizon(
+    hours: int = REMINDER_HORIZON_HOURS, minutes_before: int = 30
+) -> int:
     """
-    При старте сервиса пробегаем по записям в горизонте `hours`
-    и ставим напоминания. ВАЖНО: здесь берём u.tg_id.
+    Взводит слоты для броней, появившихся в горизонте `hours` с прошлого прохода:
+      - новые строки (id выше водяного знака) — /import, /abookfio и всё,
+        что мимо schedule_reminder;
+      - слоты, въехавшие в горизонт за это время (бронь далеко вперёд).
+    Уже просмотренное не перечитываем; найденные брони попадают в индекс
+    (для снятия таймеров при отмене). Возвращает число взведённых слотов.
     """
     now = datetime.now(TZ)
     end = now + timedelta(hours=hours)
+    max_id, until = _mark["max_id"], _mark["until"]
+
+    if max_id is not None and db_state() == "cold" and _until_dt(until) - now > timedelta(hours=1):
+        # спящую базу не будим, пока просмотренный горизонт с запасом впереди:
+        # новые брони (и /import) её и так разбудят
+        _horizon_stats["skipped_cold"] += 1
+        return 0
+
+    first = max_id is None
+
+    def _new_slots():
+        cond = """(b.date > ? OR (b.date = ? AND b.hour >= ?))
+                   AND (b.date < ? OR (b.date = ? AND b.hour <= ?))"""
+        params = [
+            now.date().isoformat(), now.date().isoformat(), now.hour,
+            end.date().isoformat(), end.date().isoformat(), end.hour,
+        ]
+        if not first:
+            cond += " AND (b.id > ? OR b.date > ? OR (b.date = ? AND b.hour > ?))"
+            params += [max_id, until[0], until[0], until[1]]
+        with get_conn() as conn:
+            return conn.execute(
+                f"""
+                SELECT b.date, b.hour, b.id, u.tg_id, b.machine_id
+                  FROM bookings b
+                  JOIN users u ON u.id = b.user_id
+                 WHERE {cond}
+            """,
+                params,
+            ).fetchall()
+
+    rows = await run_db(_new_slots)
+    if first:
+        # после рестарта таймеры уже лежат в хранилище — их не перезаписываем
+        for job_id in await run_db(reminder_store.job_ids):
+            key = _slot_key(job_id)
+            if key is not None:
+                _armed.add(key)
+
+    _forget_before(now.date().isoformat())
+    slots = set()
+    for date_iso, hour, bid, tg_id, machine_id in rows:
+        key = (str(date_iso), int(hour), minutes_before)
+        _index_booking(bid, key, tg_id, machine_id)
+        slots.add(key)
+
+    to_arm, late = [], []
+    for key in sorted(slots):
+        if key in _armed:
+            continue
+        reminder_dt = datetime.combine(
+            datetime.fromisoformat(key[0]).date(), time(hour=key[1]), tzinfo=TZ
+        ) - timedelta(minutes=minutes_before)
+        if reminder_dt > now:
+            to_arm.append((key, reminder_dt))
+        elif (now - reminder_dt).total_seconds() <= LATE_WINDOW_SEC:
+            late.append(key)  # граница слота только что прошла — рассылаем сразу
+
+    if to_arm:
+        await run_db(_add_slot_jobs, to_arm)  # один поход в пул на всю пачку
+    for key in late:
+        await dispatch_slot(*key)
+
+    _mark["max_id"] = max([max_id or 0] + [int(r[2]) for r in rows])
+    _mark["until"] = (end.date().isoformat(), end.hour)
+    _horizon_stats["runs"] += 1
+    _horizon_stats["rows"] += len(rows)
+    _horizon_stats["armed"] += len(to_arm)
+    return len(to_arm)
+
+
+def _until_dt(until: tuple[str, int]) -> datetime:
+    return datetime.combine(datetime.fromisoformat(until[0]).date(), time(hour=until[1]), tzinfo=TZ)
 
-    with get_conn() as conn:
-        rows = conn.execute(
-            """
-            SELECT u.tg_id, m.name, b.date, b.hour
-              FROM bookings b
-              JOIN machines m ON m.id = b.machine_id
-              JOIN users   u ON u.id = b.user_id
-             WHERE (b.date > ? OR (b.date = ? AND b.hour >= ?))
-               AND (b.date < ? OR (b.date = ? AND b.hour <= ?))
-        """,
-            (
-                now.date().isoformat(),
-                now.date().isoformat(),
-                now.hour,
-                end.date().isoformat(),
-                end.date().isoformat(),
-                end.hour,
-            ),
-        ).fetchall()
-
-    for tg_id, machine_name, date_iso, hour in rows:
-        await schedule_reminder(
-            int(tg_id),
-            machine_name,
-            str(date_iso),
-            int(hour),
-            minutes_before,
-        )
+
+async def rebuild_reminders_for_horizon(
+    hours: int = REMINDER_HORIZON_HOURS, minutes_before: int = 30
+) -> int:
+    """
+    Полная сверка таймеров слотов с записями в горизонте `hours` (на старте):
+    убираем задачи старого формата «одна на бронь», сбрасываем водяные знаки
+    и просматриваем горизонт целиком. Возвращает число взведённых слотов.
+    """
+    for job_id in await run_db(reminder_store.job_ids):
+        if _slot_key(job_id) is None:
+            await run_db(scheduler.remove_job, job_id, REMINDER_JOBSTORE)
+    _mark.update(max_id=None, until=None)
+    return await refresh_reminder_horizon(hours, minutes_before)
+
+
+def reminders_need_check() -> bool:
+    """
+    Сверять ли напоминания на старте: по REMINDERS_STARTUP_CHECK=1, если
+    хранилище пустое или в нём остались задачи старого формата (не slot_*).
+    """
+    if os.getenv("REMINDERS_STARTUP_CHECK") == "1":
+        return True
+    ids = reminder_store.job_ids()
+    return not ids or any(not i.startswith("slot_") for i in ids)
+
+
+# =========================================================
+#     Записи, удалённые миграцией (двойные за сутки)
+# =========================================================
+async def notify_migration_dropped(bot: Bot):
+    """Сообщить жильцам и админам о записях, которые удалила миграция схемы."""
+    dropped = take_migration_dropped()
+    if not dropped:
+        return
+    lines = []
+    for tg_id, machine_name, date_iso, hour in dropped:
+        lines.append(f"• {tg_id}: {machine_name} {date_iso} {hour:02d}:00")
+        if tg_id is None or tg_id < 0:
+            continue  # стаб из /abookfio: писать некому
+        try:
+            await bot.send_message(
+                tg_id,
+                f"⚠️ Ваша запись на {machine_name} {date_iso} в {hour:02d}:00 отменена: "
+                "в один день можно записаться только один раз на стирку и один на сушку, "
+                "а эта запись была лишней.",
+            )
+        except Exception as e:
+            print(f"⚠️ Не удалось уведомить {tg_id} об удалённой записи: {e}")
+        await asyncio.sleep(0.05)  # лёгкий троттлинг
+    text = "🛠 Миграция удалила двойные записи (лимит «1 тип в сутки»):\n" + "\n".join(lines)
+    for admin_id in admin_ids():
+        try:
+            await bot.send_message(admin_id, text)
+        except Exception:
+            pass
 
 
 # =========================================================
@@ -342,21 +774,25 @@ async def watchdog_tick(minutes_before: int = 30):
     dates = (today, tomorrow)
 
     placeholders = ",".join(["?"] * len(dates))
-    with get_conn() as conn:
-        rows = conn.execute(
-            f"""
-            SELECT u.tg_id,
-                   b.machine_id,
-                   m.name,
-                   b.date,
-                   b.hour
-              FROM bookings b
-              JOIN machines m ON m.id = b.machine_id
-              JOIN users   u ON u.id = b.user_id
-             WHERE b.date IN ({placeholders})
-        """,
-            dates,
-        ).fetchall()
+
+    def _rows_for_dates():
+        with get_conn() as conn:
+            return conn.execute(
+                f"""
+                SELECT u.tg_id,
+                       b.machine_id,
+                       m.name,
+                       b.date,
+                       b.hour
+                  FROM bookings b
+                  JOIN machines m ON m.id = b.machine_id
+                  JOIN users   u ON u.id = b.user_id
+                 WHERE b.date IN ({placeholders})
+            """,
+                dates,
+            ).fetchall()
+
+    rows = await run_db(_rows_for_dates)
 
     for tg_id, machine_id, m_name, date_iso, hour in rows:
         # date_iso может быть date или str
@@ -368,21 +804,15 @@ async def watchdog_tick(minutes_before: int = 30):
 
         # вместо окна 0..LATE_WINDOW_SEC
         if reminder_dt <= now < slot_dt:
-            if not was_reminder_sent(
-                    int(tg_id),
-                    int(machine_id),
-                    str(date_iso),
-                    int(hour),
-                    minutes_before,
-            ):
-                await send_reminder(
-                    int(tg_id),
-                    m_name,
-                    str(date_iso),
-                    int(hour),
-                    minutes_before,
-                    allow_late=True
-                )
+            # антидубль проверяет сам send_reminder (reminder_plan)
+            await send_reminder(
+                int(tg_id),
+                int(machine_id),
+                str(date_iso),
+                int(hour),
+                minutes_before,
+                allow_late=True
+            )
 
         '''
         # окно «пора напоминать»: [reminder_dt, reminder_dt + LATE_WINDOW_SEC]
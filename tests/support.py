@@ -0,0 +1,37 @@
+# tests/support.py
+"""
+Общая SQLite-база для тестов — одна на процесс, во временном каталоге.
+
+DB_PATH подменяем до импорта database: его (и database_async, scheduler)
+читают при импорте. Тесты не чистят таблицы, а разводят данные по своим
+датам, tg_id и именам машин.
+"""
+import atexit
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_tmp: tempfile.TemporaryDirectory | None = None
+
+
+def database():
+    """Модуль database поверх временной базы (схема уже накачена)."""
+    global _tmp
+    if _tmp is None:
+        os.environ.pop("DATABASE_URL", None)  # только SQLite
+        os.environ.setdefault("BOT_TOKEN", "1:test")
+        _tmp = tempfile.TemporaryDirectory()
+        atexit.register(_tmp.cleanup)
+        import config
+        config.DB_PATH = os.path.join(_tmp.name, "laundry.db")
+    import database as db
+    db.init_db()
+    return db
+
+
+def machine(db, type_: str, name: str) -> int:
+    db.add_machine(type_, name)
+    return db.get_machine_id_by_name(name)
@@ -0,0 +1,73 @@
+# tests/test_bind_stub.py
+"""
+Привязка стаба (записи админа по Фамилии+Комнате) к реальному tg_id,
+когда часть записей стаба упирается в лимит «1 тип в сутки».
+
+Запуск: python -m unittest discover -s tests
+"""
+import unittest
+
+import support
+
+db = None
+
+
+def setUpModule():
+    global db
+    db = support.database()
+
+
+class BindStubWithDuplicateTest(unittest.TestCase):
+    DAY = "2030-01-01"
+    NEXT_DAY = "2030-01-02"
+
+    def test_conflicting_stub_booking_is_reported_and_freed(self):
+        w1 = support.machine(db, "wash", "Стиральная №1")
+        w2 = support.machine(db, "wash", "Стиральная №2")
+
+        # жилец уже зарегистрирован и записан на стирку в DAY
+        db.save_user(100, "Петров", "5")
+        real_id = db.get_user(100)[0]
+        self.assertIsNotNone(db.create_booking(real_id, w1, self.DAY, 10))
+
+        # админ внёс записи на Фамилию+Комнату, ещё не привязанные к tg_id
+        stub_id = db.ensure_user_by_surname_room("Иванов", "7")
+        self.assertIsNotNone(db.create_booking(stub_id, w2, self.DAY, 12))       # конфликт
+        self.assertIsNotNone(db.create_booking(stub_id, w1, self.NEXT_DAY, 9))   # переносится
+        self.assertNotIn(12, db.get_free_hours(w2, self.DAY))  # маски дня уже загружены
+
+        dropped = db.save_user(100, "Иванов", "7")
+
+        self.assertEqual(dropped, [(w2, self.DAY, 12)])
+        # слот конфликтной записи снова свободен — и в БД, и в битовых масках
+        self.assertIn(12, db.get_free_hours(w2, self.DAY))
+        # неконфликтная запись перенесена на жильца, стаба больше нет
+        self.assertTrue(db.get_user_booking_exact(real_id, w1, self.NEXT_DAY, 9))
+        self.assertTrue(db.get_user_booking_exact(real_id, w1, self.DAY, 10))
+        self.assertNotEqual(db.ensure_user_by_surname_room("Иванов", "7"), stub_id)
+
+    def test_resaving_profile_keeps_own_bookings(self):
+        w = support.machine(db, "wash", "Стиральная №5")
+        db.save_user(110, "Сидоров", "8")
+        real_id = db.get_user(110)[0]
+        self.assertIsNotNone(db.create_booking(real_id, w, self.DAY, 15))
+
+        # /edit с теми же данными: сам жилец — не стаб
+        self.assertEqual(db.save_user(110, "Сидоров", "8"), [])
+
+        self.assertEqual(db.get_user(110)[0], real_id)
+        self.assertTrue(db.get_user_booking_exact(real_id, w, self.DAY, 15))
+
+    def test_namesake_is_not_a_stub(self):
+        w = support.machine(db, "wash", "Стиральная №6")
+        db.save_user(120, "Кузнецов", "9")
+        first_id = db.get_user(120)[0]
+        self.assertIsNotNone(db.create_booking(first_id, w, self.DAY, 16))
+
+        db.save_user(121, "Кузнецов", "9")  # однофамилец из той же комнаты
+
+        self.assertTrue(db.get_user_booking_exact(first_id, w, self.DAY, 16))
+
+
+if __name__ == "__main__":
+    unittest.main()
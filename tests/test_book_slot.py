@@ -0,0 +1,110 @@
+# tests/test_book_slot.py
+"""
+book_slot: запись одним выражением и разбор причины отказа.
+
+Запуск: python -m unittest discover -s tests
+"""
+import unittest
+
+import support
+
+db = None
+Outcome = None
+
+
+def setUpModule():
+    global db, Outcome
+    db = support.database()
+    Outcome = db.BookingOutcome
+
+
+class BookSlotTest(unittest.TestCase):
+    DAY = "2031-03-01"
+
+    @classmethod
+    def setUpClass(cls):
+        cls.w1 = support.machine(db, "wash", "Тест-стиральная №1")
+        cls.w2 = support.machine(db, "wash", "Тест-стиральная №2")
+        cls.d1 = support.machine(db, "dry", "Тест-сушилка №1")
+        for tg_id in (201, 202, 203, 204, 205):
+            db.save_user(tg_id, f"Жилец{tg_id}", "3")
+
+    def test_booked_returns_machine_and_marks_slot_busy(self):
+        res = db.book_slot(201, self.w1, self.DAY, 10)
+
+        self.assertEqual(res.outcome, Outcome.BOOKED)
+        self.assertIsNotNone(res.booking_id)
+        self.assertEqual(res.user_id, db.get_user(201)[0])
+        self.assertEqual((res.machine_type, res.machine_name), ("wash", "Тест-стиральная №1"))
+        self.assertFalse(res.other_type_booked)
+        self.assertNotIn(10, db.get_free_hours(self.w1, self.DAY))
+
+    def test_slot_taken_and_already_mine(self):
+        self.assertEqual(db.book_slot(202, self.w2, self.DAY, 12).outcome, Outcome.BOOKED)
+
+        self.assertEqual(db.book_slot(203, self.w2, self.DAY, 12).outcome, Outcome.SLOT_TAKEN)
+        self.assertEqual(db.book_slot(202, self.w2, self.DAY, 12).outcome, Outcome.ALREADY_MINE)
+
+    def test_daily_limit_per_type_and_dryer_after_wash(self):
+        self.assertEqual(db.book_slot(204, self.w1, self.DAY, 14).outcome, Outcome.BOOKED)
+
+        res = db.book_slot(204, self.w2, self.DAY, 15)
+        self.assertEqual(res.outcome, Outcome.DAILY_LIMIT)
+        self.assertIn(15, db.get_free_hours(self.w2, self.DAY))
+
+        # другой тип в тот же день — можно, и результат знает о стирке
+        dry = db.book_slot(204, self.d1, self.DAY, 15)
+        self.assertEqual(dry.outcome, Outcome.BOOKED)
+        self.assertTrue(dry.other_type_booked)
+
+    def test_expected_type_mismatch_is_no_machine(self):
+        res = db.book_slot(205, self.w1, "2031-03-02", 10, machine_type="dry")
+        self.assertEqual(res.outcome, Outcome.NO_MACHINE)
+
+    def test_banned(self):
+        db.save_user(206, "Нарушитель", "4")
+        db.ban_user(206, "тест", days=1)
+        try:
+            res = db.book_slot(206, self.w1, "2031-03-03", 10)
+        finally:
+            db.unban_user(206)
+        self.assertEqual(res.outcome, Outcome.BANNED)
+        self.assertIn(10, db.get_free_hours(self.w1, "2031-03-03"))
+
+    def test_inactive_machine(self):
+        off = support.machine(db, "wash", "Тест-стиральная выкл")
+        db.set_machine_active(off, False)
+        res = db.book_slot(205, off, "2031-03-04", 10)
+        self.assertEqual(res.outcome, Outcome.INACTIVE_MACHINE)
+        self.assertEqual(res.machine_name, "Тест-стиральная выкл")
+
+    def test_not_registered(self):
+        self.assertEqual(db.book_slot(299, self.w1, "2031-03-05", 10).outcome, Outcome.NOT_REGISTERED)
+
+
+class AsyncBookSlotTest(unittest.IsolatedAsyncioTestCase):
+    """database_async.book_slot — то же выражение, тот же разбор."""
+
+    DAY = "2031-03-10"
+
+    async def asyncSetUp(self):
+        import database_async
+        self.adb = database_async
+        self.w = support.machine(db, "wash", "Тест-стиральная async")
+        db.save_user(211, "Асинхронов", "6")
+        db.save_user(212, "Параллельный", "6")
+
+    async def asyncTearDown(self):
+        await self.adb.close_aconn_pool()
+
+    async def test_booked_then_taken(self):
+        res = await self.adb.book_slot(211, self.w, self.DAY, 11)
+        self.assertEqual(res.outcome, Outcome.BOOKED)
+        self.assertEqual(res.machine_name, "Тест-стиральная async")
+
+        res = await self.adb.book_slot(212, self.w, self.DAY, 11)
+        self.assertEqual(res.outcome, Outcome.SLOT_TAKEN)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,183 @@
+# tests/test_callback_ack.py
+"""
+ACK на нажатия: в теле ответа на вебхук, если хендлер успел за
+REPLY_WAIT_SEC, иначе — отдельным запросом; остальные апдейты — в фоне.
+
+Запуск: python -m unittest discover -s tests
+"""
+import asyncio
+import os
+import unittest
+import warnings
+from unittest import mock
+
+import support  # noqa: F401  (путь к модулям бота)
+
+os.environ.setdefault("BOT_TOKEN", "1:test")
+os.environ.setdefault("WEBHOOK_BASE_URL", "http://localhost")
+
+from aiogram import Bot, Dispatcher, F, Router  # noqa: E402
+from aiogram.client.session.base import BaseSession  # noqa: E402
+from aiohttp import web  # noqa: E402
+from aiohttp.test_utils import TestClient, TestServer  # noqa: E402
+
+import callback_ack  # noqa: E402
+from callback_ack import DeferredAnswerMiddleware, ack, flush  # noqa: E402
+
+WAIT = 0.2
+webhook_app = None
+
+
+def setUpModule():
+    global webhook_app
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")  # NotAppKeyWarning от app["ready"] при импорте
+        import webhook_app as app_module
+    webhook_app = app_module
+
+
+class _Session(BaseSession):
+    """Bot API без сети: запоминаем имена вызванных методов."""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls.append(type(method).__name__)
+        return True
+
+    async def stream_content(self, *args, **kwargs):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+def _router(done: list) -> Router:
+    r = Router()
+
+    @r.callback_query(F.data == "fast")
+    async def fast(callback):
+        await ack(callback, "ok")
+
+    @r.callback_query(F.data == "flush")
+    async def flushed(callback):
+        await ack(callback)
+        await flush()
+        done.append("after-flush")
+
+    @r.callback_query(F.data == "slow")
+    async def slow(callback):
+        await ack(callback)
+        await asyncio.sleep(WAIT * 3)
+        done.append("slow")
+
+    @r.callback_query(F.data == "fail")
+    async def fail(callback):
+        await ack(callback)
+        raise RuntimeError("boom")
+
+    @r.message()
+    async def message(msg):
+        await asyncio.sleep(WAIT * 3)
+        done.append("message")
+
+    return r
+
+
+def _callback(data: str) -> dict:
+    return {
+        "update_id": 1,
+        "callback_query": {
+            "id": "q", "chat_instance": "c", "data": data,
+            "from": {"id": 1, "is_bot": False, "first_name": "a"},
+        },
+    }
+
+
+MESSAGE = {
+    "update_id": 2,
+    "message": {"message_id": 1, "date": 0, "chat": {"id": 1, "type": "private"}, "text": "hi"},
+}
+
+
+class CallbackReplyTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        patcher = mock.patch.multiple(callback_ack, REPLY_WAIT_SEC=WAIT)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(webhook_app, "REPLY_WAIT_SEC", WAIT)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.session = _Session()
+        self.done = []
+        bot = Bot("1:test", session=self.session)
+        dp = Dispatcher()
+        dp.callback_query.outer_middleware(DeferredAnswerMiddleware())
+        dp.include_router(_router(self.done))
+        app = web.Application()
+        webhook_app.CallbackReplyHandler(dispatcher=dp, bot=bot, handle_in_background=True).register(
+            app, path="/webhook"
+        )
+        self.client = TestClient(TestServer(app))
+        await self.client.start_server()
+
+    async def asyncTearDown(self):
+        await self.client.close()
+
+    async def _post(self, update: dict) -> str:
+        resp = await self.client.post("/webhook", json=update)
+        self.assertEqual(resp.status, 200)
+        return await resp.text()
+
+    async def test_fast_handler_answers_in_response_body(self):
+        body = await self._post(_callback("fast"))
+        self.assertIn("answerCallbackQuery", body)
+        self.assertEqual(self.session.calls, [])
+
+    async def test_flush_sends_answer_immediately(self):
+        body = await self._post(_callback("flush"))
+        self.assertNotIn("answerCallbackQuery", body)
+        self.assertEqual(self.session.calls, ["AnswerCallbackQuery"])
+        self.assertEqual(self.done, ["after-flush"])
+
+    async def test_slow_handler_gets_answer_after_wait(self):
+        body = await self._post(_callback("slow"))
+        self.assertNotIn("answerCallbackQuery", body)
+        await asyncio.sleep(WAIT)  # таймер слота срабатывает чуть позже ответа вебхука
+        self.assertEqual(self.session.calls, ["AnswerCallbackQuery"])
+        self.assertEqual(self.done, [])  # хендлер ещё работает, Telegram уже получил 200
+        await asyncio.sleep(WAIT * 3)
+        self.assertEqual(self.done, ["slow"])
+        self.assertEqual(self.session.calls, ["AnswerCallbackQuery"])  # без повторного ACK
+
+    async def test_failing_handler_still_answers(self):
+        with mock.patch("builtins.print"):
+            await self._post(_callback("fail"))
+        self.assertEqual(self.session.calls, ["AnswerCallbackQuery"])
+
+    async def test_message_is_handled_in_background(self):
+        await self._post(MESSAGE)
+        self.assertEqual(self.done, [])
+        await asyncio.sleep(WAIT * 4)
+        self.assertEqual(self.done, ["message"])
+
+
+class AckWithoutSlotTest(unittest.IsolatedAsyncioTestCase):
+    async def test_ack_outside_webhook_is_sent_directly(self):
+        from aiogram.types import CallbackQuery
+
+        session = _Session()
+        bot = Bot("1:test", session=session)
+        callback = CallbackQuery.model_validate(
+            _callback("x")["callback_query"], context={"bot": bot}
+        )
+        await ack(callback, "ok")
+        await flush()  # без слота — ничего не делает
+        self.assertEqual(session.calls, ["AnswerCallbackQuery"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,116 @@
+# tests/test_migrations.py
+"""
+init_db: база до версионирования (v0) догоняется до SCHEMA_VERSION,
+повторный запуск — один SELECT версии и ничего больше.
+
+Каждый сценарий — в отдельном процессе: database читает DB_PATH при импорте.
+
+Запуск: python -m unittest discover -s tests
+"""
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from support import ROOT
+
+# схема SQLite-базы, созданной кодом до миграций (ещё без schema_version)
+V0_SCHEMA = """
+CREATE TABLE users(
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    tg_id INTEGER UNIQUE,
+    surname TEXT,
+    room TEXT
+);
+CREATE TABLE machines(
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    type TEXT,
+    name TEXT
+);
+CREATE TABLE bookings(
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER,
+    machine_id INTEGER,
+    date TEXT,
+    hour INTEGER,
+    UNIQUE(user_id, date, machine_id)
+);
+CREATE UNIQUE INDEX uniq_slot ON bookings(machine_id, date, hour);
+INSERT INTO users (tg_id, surname, room) VALUES (501, 'Старый', '1');
+INSERT INTO machines (type, name) VALUES ('wash', 'Стиральная №1'), ('wash', 'Стиральная №2');
+-- две стирки в один день: новый уникальный индекс их не пустит
+INSERT INTO bookings (user_id, machine_id, date, hour) VALUES (1, 1, '2030-01-01', 10);
+INSERT INTO bookings (user_id, machine_id, date, hour) VALUES (1, 2, '2030-01-01', 12);
+"""
+
+RUN_INIT = """
+import json, sys
+import config
+config.DB_PATH = sys.argv[1]
+import database as db
+first = db.init_db()
+dropped = db.take_migration_dropped()
+second = db.init_db()
+with db.get_conn() as conn:
+    version = db._read_schema_version(conn)
+print(json.dumps({
+    "first": first, "second": second, "version": version,
+    "expected": db.SCHEMA_VERSION, "dropped": dropped,
+}))
+"""
+
+
+def _init_twice(db_path: str) -> dict:
+    env = {k: v for k, v in os.environ.items() if k != "DATABASE_URL"}
+    out = subprocess.run(
+        [sys.executable, "-c", RUN_INIT, db_path],
+        cwd=ROOT, env=env, capture_output=True, text=True, timeout=60, check=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+class InitDbTest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self._tmp.name, "laundry.db")
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_v0_database_is_upgraded_once(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.executescript(V0_SCHEMA)
+        conn.close()
+
+        res = _init_twice(self.db_path)
+
+        self.assertTrue(res["first"])
+        self.assertFalse(res["second"])
+        self.assertEqual(res["version"], res["expected"])
+        # лишняя запись дня удалена и отдана для уведомления, ранняя осталась
+        self.assertEqual(res["dropped"], [[501, "Стиральная №2", "2030-01-01", 12]])
+        conn = sqlite3.connect(self.db_path)
+        try:
+            rows = conn.execute("SELECT machine_id, hour, machine_type FROM bookings").fetchall()
+            index = conn.execute(
+                "SELECT name FROM sqlite_master WHERE name = 'uq_bookings_user_date_type'"
+            ).fetchone()
+        finally:
+            conn.close()
+        self.assertEqual(rows, [(1, 10, "wash")])
+        self.assertIsNotNone(index)
+
+    def test_empty_database(self):
+        res = _init_twice(self.db_path)
+
+        self.assertTrue(res["first"])
+        self.assertFalse(res["second"])
+        self.assertEqual(res["version"], res["expected"])
+        self.assertEqual(res["dropped"], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+# tests/test_occupancy.py
+"""
+Маски занятости в памяти: загрузка, правки при записи/отмене, версии для
+кэшей отрисовки и сброс.
+
+Запуск: python -m unittest discover -s tests
+"""
+import unittest
+
+import support
+
+db = None
+occupancy = None
+
+
+def setUpModule():
+    global db, occupancy
+    db = support.database()
+    import occupancy as occ
+    occupancy = occ
+
+
+H1, H2 = 10, 11  # часы из WORKING_HOURS
+
+
+class OccupancyMasksTest(unittest.TestCase):
+    def test_change_during_load_is_not_cached(self):
+        day = "2032-01-01"
+        masks, token = occupancy.lookup(day)
+        self.assertIsNone(masks)
+
+        occupancy.mark_busy(day, 1, H1)  # чужой INSERT, пока загрузчик ждёт БД
+        loaded = occupancy.load_date(day, [(2, H2)], token)
+
+        self.assertEqual(loaded, {2: occupancy.HOUR_BIT[H2]})
+        self.assertIsNone(occupancy.lookup(day)[0])  # устаревший снимок не закэширован
+
+    def test_marks_update_loaded_date(self):
+        day = "2032-01-02"
+        _, token = occupancy.lookup(day)
+        occupancy.load_date(day, [(1, H1)], token)
+
+        occupancy.mark_busy(day, 1, H2)
+        self.assertEqual(occupancy.mask_to_hours(occupancy.lookup(day)[0][1]), [H1, H2])
+        occupancy.mark_free(day, 1, H1)
+        self.assertEqual(occupancy.mask_to_hours(occupancy.lookup(day)[0][1]), [H2])
+
+    def test_version_moves_only_for_changed_date(self):
+        day, other = "2032-01-03", "2032-01-04"
+        before, before_other = occupancy.version(day), occupancy.version(other)
+
+        occupancy.mark_busy(day, 1, H1)
+
+        self.assertGreater(occupancy.version(day), before)
+        self.assertEqual(occupancy.version(other), before_other)
+
+    def test_invalidate_all_moves_every_date_version(self):
+        day = "2032-01-05"
+        before = occupancy.version(day)
+        occupancy.invalidate()
+        self.assertGreater(occupancy.version(day), before)
+
+
+class OccupancyWithDatabaseTest(unittest.TestCase):
+    DAY = "2032-02-01"
+
+    def test_booking_and_delete_keep_masks_in_sync(self):
+        w = support.machine(db, "wash", "Маски-стиральная")
+        db.save_user(301, "Масочный", "9")
+        self.assertIn(H1, db.get_free_hours(w, self.DAY))  # дата загружена в память
+
+        res = db.book_slot(301, w, self.DAY, H1)
+        self.assertNotIn(H1, db.get_free_hours(w, self.DAY))
+
+        db.delete_booking(res.booking_id)
+        self.assertIn(H1, db.get_free_hours(w, self.DAY))
+
+        # после сброса маски перечитываются из БД и совпадают
+        occupancy.invalidate(self.DAY)
+        self.assertIn(H1, db.get_free_hours(w, self.DAY))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,123 @@
+# tests/test_reminder_dispatch.py
+"""
+Колесо слотов: один таймер на (дата, час, минут_до), получатели — из bookings
+в момент срабатывания; отмена, бан и выключение машины снимают таймер, только
+если в слоте не осталось кому напоминать.
+
+Планировщик не запускаем: задачи остаются «отложенными» в памяти APScheduler,
+а отправку подменяем записью в список.
+
+Запуск: python -m unittest discover -s tests
+"""
+import asyncio
+import unittest
+from unittest import mock
+
+import support
+
+db = None
+S = None
+MB = 30
+
+
+def setUpModule():
+    global db, S
+    db = support.database()
+    import scheduler
+    S = scheduler
+
+
+class SlotDispatchTest(unittest.IsolatedAsyncioTestCase):
+    DAY = "2034-05-01"
+
+    @classmethod
+    def setUpClass(cls):
+        cls.w1 = support.machine(db, "wash", "Колесо-стиральная №1")
+        cls.w2 = support.machine(db, "wash", "Колесо-стиральная №2")
+        cls.off = support.machine(db, "wash", "Колесо-стиральная выкл")
+        for tg_id in range(601, 608):
+            db.save_user(tg_id, f"Колесо{tg_id}", "12")
+
+    async def asyncSetUp(self):
+        S.scheduler.remove_all_jobs()
+        for state in (S._armed, S._booking_slot, S._slot_bookings):
+            state.clear()
+        S._send_queue = None
+        S._senders.clear()
+        self.sent = []
+
+        async def fake_send(tg_id, machine_id, date_iso, hour, minutes_before, allow_late=False, plan=None):
+            self.sent.append((tg_id, machine_id, hour))
+
+        patcher = mock.patch.object(S, "send_reminder", fake_send)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def asyncTearDown(self):
+        for task in S._senders:
+            task.cancel()
+        await asyncio.gather(*S._senders, return_exceptions=True)
+
+    async def _book(self, tg_id: int, machine_id: int, hour: int, schedule: bool = True) -> int:
+        res = db.book_slot(tg_id, machine_id, self.DAY, hour)
+        self.assertEqual(res.outcome, db.BookingOutcome.BOOKED)
+        if schedule:
+            await S.schedule_reminder(tg_id, machine_id, self.DAY, hour, MB, booking_id=res.booking_id)
+        return res.booking_id
+
+    def _job(self, hour: int):
+        return S.scheduler.get_job(S._slot_job_id(self.DAY, hour, MB), S.REMINDER_JOBSTORE)
+
+    async def _dispatch(self, hour: int):
+        await S.dispatch_slot(self.DAY, hour, MB)
+        if S._send_queue is not None:
+            await S._send_queue.join()
+
+    async def test_one_timer_per_slot_sends_to_everyone(self):
+        await self._book(601, self.w1, 10)
+        await self._book(602, self.w2, 10)
+
+        self.assertEqual(S._armed, {(self.DAY, 10, MB)})
+        await self._dispatch(10)
+
+        self.assertEqual(sorted(self.sent), [(601, self.w1, 10), (602, self.w2, 10)])
+        self.assertEqual(S.reminder_stats()["indexed"], 0)
+
+    async def test_cancel_last_booking_removes_timer(self):
+        bid = await self._book(603, self.w1, 12)
+        self.assertIsNotNone(self._job(12))
+
+        db.delete_booking(bid)
+        self.assertEqual(await S.cancel_reminder(bid), 1)
+
+        self.assertIsNone(self._job(12))
+        self.assertNotIn((self.DAY, 12, MB), S._armed)
+
+    async def test_cancel_keeps_timer_for_unindexed_booking(self):
+        await self._book(604, self.w1, 14, schedule=False)  # /abookfio, /import: мимо индекса
+        bid = await self._book(605, self.w2, 14)
+
+        db.delete_booking(bid)
+        self.assertEqual(await S.cancel_reminder(bid), 0)
+
+        self.assertIsNotNone(self._job(14))
+        await self._dispatch(14)
+        self.assertEqual(self.sent, [(604, self.w1, 14)])
+
+    async def test_ban_and_disabled_machine_are_filtered(self):
+        await self._book(606, self.w1, 16)
+        await self._book(607, self.off, 16)
+
+        db.ban_user(606, "тест", days=1)
+        db.set_machine_active(self.off, False)
+        try:
+            self.assertEqual(await S.cancel_user_reminders(606), 0)  # в слоте ещё 607
+            self.assertEqual(await S.cancel_machine_reminders(self.off), 1)
+            self.assertIsNone(self._job(16))
+        finally:
+            db.unban_user(606)
+            db.set_machine_active(self.off, True)
+
+
+if __name__ == "__main__":
+    unittest.main()
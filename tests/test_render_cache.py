@@ -0,0 +1,55 @@
+# tests/test_render_cache.py
+"""
+Кэш готовых экранов записи: ключ меняется при записи на дату и правке машин,
+запись на другую дату ключ не трогает.
+
+Запуск: python -m unittest discover -s tests
+"""
+import unittest
+
+import support
+
+db = None
+booking = None
+
+
+def setUpModule():
+    global db, booking
+    db = support.database()
+    from handlers import booking as booking_handlers
+    booking = booking_handlers
+
+
+class RenderKeyTest(unittest.TestCase):
+    DAY, OTHER_DAY = "2033-01-01", "2033-01-02"
+
+    def setUp(self):
+        self.w = support.machine(db, "wash", "Экран-стиральная")
+        db.save_user(401, "Экранный", "2")
+        db.save_user(402, "Соседний", "2")
+
+    def test_key_follows_occupancy_and_catalog(self):
+        key = booking._render_key("hours", self.DAY, self.w)
+        booking._render_put(key, "text", None)
+        self.assertIsNotNone(booking._render_get(key))
+
+        db.book_slot(401, self.w, self.OTHER_DAY, 10)
+        self.assertEqual(booking._render_key("hours", self.DAY, self.w), key)
+
+        db.book_slot(402, self.w, self.DAY, 10)
+        booked = booking._render_key("hours", self.DAY, self.w)
+        self.assertNotEqual(booked, key)
+        self.assertIsNone(booking._render_get(booked))
+
+        support.machine(db, "dry", "Экран-сушилка")
+        self.assertNotEqual(booking._render_key("hours", self.DAY, self.w), booked)
+
+    def test_lru_is_bounded(self):
+        for i in range(booking.RENDER_CACHE_SIZE + 5):
+            booking._render_put(("test", i), "text", None)
+        self.assertEqual(booking.render_cache_stats()["size"], booking.RENDER_CACHE_SIZE)
+        self.assertIsNone(booking._render_get(("test", 0)))
+
+
+if __name__ == "__main__":
+    unittest.main()
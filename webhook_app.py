@@ -5,11 +5,23 @@ from aiohttp import web
 
 from aiogram import Bot, Dispatcher
 from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.methods import TelegramMethod
 from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 
-from database import init_db, add_machine, get_machines_by_type, DBUnavailable
+from database import (
+    init_db, add_machine, get_machines_by_type, DBUnavailable, prewarm_db_pool,
+    machine_catalog_snapshot, ban_registry_snapshot, flush_usernames,
+    print_index_report,
+)
 from config import WASHING_MACHINES, DRYERS
-from scheduler import setup_scheduler, rebuild_reminders_for_horizon, attach_bot
+from scheduler import (
+    setup_scheduler, rebuild_reminders_for_horizon, reminders_need_check, attach_bot,
+    notify_migration_dropped,
+)
+from db_executor import run_db, shutdown_db_executor
+from database_async import close_aconn_pool
+from api_metrics import ApiCallCounter, track_user
+from callback_ack import DeferredAnswerMiddleware, REPLY_WAIT_SEC
 
 REMINDERS_TASK: asyncio.Task | None = None
 WH_RETRY_TASK: asyncio.Task | None = None
@@ -55,8 +67,12 @@ async def readiness_middleware(request: web.Request, handler):
 
 # === Telegram client с таймаутами ===
 session = AiohttpSession()
+session.middleware(ApiCallCounter())  # счётчик вызовов Bot API (см. /perf)
 bot = Bot(token=BOT_TOKEN, session=session)
 dp = Dispatcher()
+dp.update.outer_middleware(track_user)
+# ACK на нажатия — телом ответа на вебхук, без отдельного запроса к Bot API
+dp.callback_query.outer_middleware(DeferredAnswerMiddleware())
 
 # === Подключаем твои роутеры ===
 from handlers.registration import router as registration_router  # noqa: E402
@@ -66,6 +82,43 @@ from handlers.admin import router as admin_router  # noqa: E402
 dp.include_routers(registration_router, booking_router, admin_router)
 
 
+class CallbackReplyHandler(SimpleRequestHandler):
+    """
+    Апдейты — в фоне: Telegram получает 200 сразу и не шлёт апдейт повторно,
+    даже если хендлер долгий (рассылки, импорт, холодный Neon).
+    Нажатие кнопки ждём не дольше REPLY_WAIT_SEC: успел хендлер — его метод
+    (ACK из callback_ack) уходит телом ответа, не успел — отправится сам.
+    """
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        update = await request.json(loads=bot.session.json_loads)
+        task = asyncio.create_task(self.dispatcher.feed_raw_update(bot=bot, update=update, **self.data))
+        self._background_feed_update_tasks.add(task)
+        task.add_done_callback(self._background_feed_update_tasks.discard)
+
+        if "callback_query" in update:
+            await asyncio.wait({task}, timeout=REPLY_WAIT_SEC)
+            if task.done() and not task.cancelled() and task.exception() is None:
+                result = task.result()
+                if isinstance(result, TelegramMethod):
+                    return web.Response(body=self._build_response_writer(bot=bot, result=result))
+                return web.json_response({}, dumps=bot.session.json_dumps)
+
+        task.add_done_callback(lambda t: self._send_late(bot, t))
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    def _send_late(self, bot: Bot, task: asyncio.Task):
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            print(f"⚠️ Апдейт не обработан: {task.exception()!r}")
+            return
+        if isinstance(task.result(), TelegramMethod):
+            late = asyncio.create_task(self.dispatcher.silent_call_request(bot=bot, result=task.result()))
+            self._background_feed_update_tasks.add(late)
+            late.add_done_callback(self._background_feed_update_tasks.discard)
+
+
 # === /health для Render и пингов ===
 async def health(_):
     return web.json_response({"ok": True})
@@ -86,14 +139,24 @@ async def init_db_with_retries():
     delay = 1
     while True:
         try:
-            init_db()
-            ensure_config_machines()
-            return
+            await run_db(prewarm_db_pool)  # коннекты открываются до первого апдейта
+            migrated = await run_db(init_db)  # схема актуальна → один SELECT версии
+            await run_db(ensure_config_machines)
+            await run_db(machine_catalog_snapshot)  # каталог машин — в память сразу
+            await run_db(ban_registry_snapshot)     # и баны
+            break
         except DBUnavailable as e:
             # print(f"⏳ DB недоступна (Neon sleep): {e}. Повтор через {delay}s…")
             await asyncio.sleep(delay)
             delay = min(delay * 2, 60)  # 1s → 2s → 4s → … → 60s
 
+    # какие индексы берут горячие запросы — в лог после миграции (или по DB_INDEX_REPORT=1)
+    if migrated or os.getenv("DB_INDEX_REPORT") == "1":
+        try:
+            await run_db(print_index_report)
+        except Exception as e:
+            print(f"⚠️ Отчёт по индексам не построен: {e}")
+
 
 # === Фоновая инициализация бота ===
 async def background_init(app: web.Application):
@@ -116,9 +179,8 @@ async def background_init(app: web.Application):
 
         global REMINDERS_TASK, WH_RETRY_TASK
 
-        REMINDERS_TASK = asyncio.create_task(
-            rebuild_reminders_for_horizon(hours=48, minutes_before=30)
-        )
+        # напоминания лежат в БД и пережили рестарт; сверка — по флагу или при пустом хранилище
+        REMINDERS_TASK = asyncio.create_task(_check_reminders())
 
         '''
         # НЕ критично: восстанавливаем напоминания отдельной задачей
@@ -137,11 +199,24 @@ async def background_init(app: web.Application):
 
             #app["wh_retry_task"] = asyncio.create_task(_retry_set_webhook(bot, WEBHOOK_URL))
 
+        # миграция могла удалить двойные записи — сообщаем, чьи
+        await notify_migration_dropped(bot)
+
     except Exception as e:
         # ready НЕ ставим → /webhook будет отдавать 503, Telegram будет ретраить
         print(f"❌ Ошибка инициализации: {e}")
 
 
+async def _check_reminders():
+    try:
+        if not await run_db(reminders_need_check):
+            return
+        added = await rebuild_reminders_for_horizon(hours=48, minutes_before=30)
+        print(f"⏰ Сверка напоминаний: добавлено {added}")
+    except Exception as e:
+        print(f"⚠️ Сверка напоминаний не удалась: {e}")
+
+
 # === on_startup / on_cleanup ===
 async def on_startup(app: web.Application):
     # Стартуем инициализацию в фоне, но апдейты не примем, пока app["ready"] не set()
@@ -187,6 +262,15 @@ async def on_cleanup(app: web.Application):
     except Exception:
         pass
 
+    # дописать username, накопленные с последнего flush
+    try:
+        await run_db(flush_usernames)
+    except Exception as e:
+        print(f"⚠️ username не записаны при остановке: {e}")
+
+    shutdown_db_executor()
+    await close_aconn_pool()
+
     # Закрываем сессию бота
     await bot.session.close()
 
@@ -202,7 +286,10 @@ app.on_cleanup.append(on_cleanup)
 app.router.add_get("/health", health)
 
 # вебхук
-SimpleRequestHandler(dispatcher=dp, bot=bot).register(app, path=WEBHOOK_PATH)
+# в фоне; нажатия кнопок — с коротким ожиданием ACK (см. CallbackReplyHandler)
+CallbackReplyHandler(dispatcher=dp, bot=bot, handle_in_background=True).register(
+    app, path=WEBHOOK_PATH
+)
 setup_application(app, dp, bot=bot)  # корректное завершение
 
 if __name__ == "__main__":